@@ -0,0 +1,341 @@
+"""
+Starts a ring of nodes in this process on localhost ports and measures it under a GET/SET workload
+
+    python benchmark.py --nodes 8 --ops 2000 --output results.json
+    python benchmark.py --nodes 8 --ops 2000 --compare results.json
+
+The results are written as json, so the numbers of two commits can be compared
+"""
+from chord.client import Client
+from chord.node import Node
+from chord.chordnode import ChordNode
+from chord.asyncchordnode import AsyncChordNode
+from chord.tcpclientserver import TCPClientServer
+from chord.asynctcpclientserver import AsyncTCPClientServer
+import argparse, hashlib, json, os, random, subprocess, sys, threading, time
+
+HOST = '127.0.0.1'
+
+
+def hash_val(value):
+    myhash = hashlib.sha1(value.encode())
+    return int(myhash.hexdigest(), 16)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summary(latencies, hops, errors, elapsed):
+    """
+    :param latencies: The latency of every operation in seconds
+    :param hops: The number of nodes visited by every operation
+    :return: A dict object with the latency percentiles in ms, the hops and the throughput
+    """
+    ops = len(latencies)
+    return {
+        "ops": ops,
+        "errors": errors,
+        "throughput_ops_s": round(ops / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.5) * 1000, 3) if ops else None,
+            "p99": round(percentile(latencies, 0.99) * 1000, 3) if ops else None,
+            "max": round(max(latencies) * 1000, 3) if ops else None,
+            "mean": round(sum(latencies) / ops * 1000, 3) if ops else None,
+        },
+        "hops": {
+            "p50": percentile(hops, 0.5),
+            "p99": percentile(hops, 0.99),
+            "mean": round(sum(hops) / len(hops), 3) if hops else None,
+        },
+    }
+
+
+class Benchmark:
+
+    CONVERGENCE_TIMEOUT = 60
+    POLL_TIME = 0.05
+
+    def __init__(self, args):
+        super().__init__()
+        self.args = args
+        self.node_class = AsyncChordNode if args.use_async else ChordNode
+        self.node_class.LOOKUP_ITERATIVE = args.iterative
+        self.node_class.READ_CONSISTENCY = args.read_consistency
+        self.node_class.TRACE_SAMPLE_RATE = args.trace_sample_rate
+        compression = None if args.compression == "none" else args.compression
+        TCPClientServer.COMPRESSION = AsyncTCPClientServer.COMPRESSION = compression
+        self.clients = []
+        self.users = []
+        self.next_port = args.port
+
+    def _new_client(self):
+        port = self.next_port
+        self.next_port += 1
+        return Client(hash_val(f"{HOST}:{port}"), HOST, port, self.node_class)
+
+    def nodes(self):
+        return [client.chord_client for client in self.clients]
+
+    def _ring_converged(self):
+        """
+        :return: True if the successor and the predecessor of every node are the right ones
+        """
+        nodes = self.nodes()
+        ids = sorted(node.id for node in nodes)
+        for node in nodes:
+            i = ids.index(node.id)
+            if node.successor.id != ids[(i + 1) % len(ids)]:
+                return False
+            if len(ids) > 1 and (not node.predecessor or node.predecessor.id != ids[i - 1]):
+                return False
+        return True
+
+    def _fingers_converged(self):
+        """
+        :return: True if every finger of every node points to the successor of its start
+        """
+        nodes = self.nodes()
+        ids = sorted(node.id for node in nodes)
+
+        def successor(k):
+            return next((id for id in ids if id >= k), ids[0])
+
+        return all(node.finger_table[i].id == successor(node.finger_table.start(i))
+                   for node in nodes for i in range(node.mbits))
+
+    def _wait_convergence(self):
+        """
+        :return: A tuple (ring seconds, fingers seconds), None if it did not converge in CONVERGENCE_TIMEOUT
+        """
+        start = time.monotonic()
+        ring_time = fingers_time = None
+        while time.monotonic() - start < self.CONVERGENCE_TIMEOUT:
+            if ring_time is None and self._ring_converged():
+                ring_time = time.monotonic() - start
+            if ring_time is not None and self._fingers_converged():
+                fingers_time = time.monotonic() - start
+                break
+            time.sleep(self.POLL_TIME)
+        return (round(ring_time, 3) if ring_time is not None else None,
+                round(fingers_time, 3) if fingers_time is not None else None)
+
+    def start_ring(self):
+        first = self._new_client()
+        if not first.start():
+            raise RuntimeError(f"Port {first.chord_client.port} not available")
+        self.clients.append(first)
+        entry = Node(first.chord_client.id, HOST, first.chord_client.port)
+
+        start = time.monotonic()
+        for _ in range(self.args.nodes - 1):
+            client = self._new_client()
+            client.join(entry)
+            if not client.node_joined:
+                raise RuntimeError(f"Node {client.chord_client.port} could not join")
+            self.clients.append(client)
+        joined = time.monotonic() - start
+        ring_time, fingers_time = self._wait_convergence()
+        return {"nodes": len(self.clients), "joins_s": round(joined, 3),
+                "ring_converged_s": ring_time, "fingers_converged_s": fingers_time}
+
+    def join_one(self):
+        """
+        Joins one more node to the converged ring and measures the time until the ring converges again
+        """
+        client = self._new_client()
+        entry = random.choice(self.nodes())
+        start = time.monotonic()
+        client.join(Node(entry.id, entry.host, entry.port))
+        if not client.node_joined:
+            return {"error": "join failed"}
+        self.clients.append(client)
+        joined = time.monotonic() - start
+        ring_time, fingers_time = self._wait_convergence()
+        return {"join_s": round(joined, 3), "ring_converged_s": ring_time, "fingers_converged_s": fingers_time}
+
+    def _bytes_on_wire(self):
+        servers = [client.chord_client.server for client in self.clients + self.users]
+        return sum(server.bytes_sent for server in servers)
+
+    def _run_phase(self, operation, keys):
+        """
+        Runs an operation over the keys from 'concurrency' threads, each operation is sent to a random node
+        :param operation: A function (user, key, node) -> GetSetResponse
+        :return: The summary dict of the phase
+        """
+        latencies, hops = [], []
+        errors = [0]
+        lock = threading.Lock()
+        shares = [keys[i::len(self.users)] for i in range(len(self.users))]
+        nodes = [Node(node.id, node.host, node.port) for node in self.nodes()]
+        bytes_before = self._bytes_on_wire()
+
+        def worker(user, share):
+            rng = random.Random()
+            for key in share:
+                node = rng.choice(nodes)
+                start = time.perf_counter()
+                response = operation(user, key, node)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    if response and response.success:
+                        latencies.append(elapsed)
+                        hops.append(len(response.nodes_visited))
+                    else:
+                        errors[0] += 1
+
+        threads = [threading.Thread(target=worker, args=(user, share)) for user, share in zip(self.users, shares)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        result = summary(latencies, hops, errors[0], elapsed)
+        result["bytes_on_wire"] = self._bytes_on_wire() - bytes_before
+        return result
+
+    def _run_batch_phase(self, operation, keys):
+        """
+        Sends the keys in GET_MANY or SET_MANY requests of 'batch' keys
+        """
+        latencies = []
+        errors = 0
+        nodes = [Node(node.id, node.host, node.port) for node in self.nodes()]
+        bytes_before = self._bytes_on_wire()
+        start = time.perf_counter()
+        for i in range(0, len(keys), self.args.batch):
+            batch = keys[i:i + self.args.batch]
+            batch_start = time.perf_counter()
+            responses = operation(self.users[0], batch, random.choice(nodes))
+            latencies.append(time.perf_counter() - batch_start)
+            errors += sum(not response.success for response in responses)
+        elapsed = time.perf_counter() - start
+        result = summary(latencies, [], errors, elapsed)
+        result["keys"] = len(keys)
+        result["keys_s"] = round(len(keys) / elapsed, 1) if elapsed else None
+        result["bytes_on_wire"] = self._bytes_on_wire() - bytes_before
+        return result
+
+    def run_workload(self):
+        args = self.args
+        for i in range(args.concurrency):
+            port = self.next_port
+            self.next_port += 1
+            self.users.append(Client(hash_val(f"user:{port}"), HOST, port, self.node_class))
+
+        rng = random.Random(args.seed)
+        value = 'x' * args.value_size
+        keys = [hash_val(f"key{i}") for i in range(args.keys)]
+        results = {"set": self._run_phase(lambda user, key, node: user.set({'key': key, 'value': value}, node), keys)}
+
+        # A mix of reads and writes over keys chosen with the configured skew
+        weights = [1 / (i + 1) ** args.skew for i in range(len(keys))]
+        ops = rng.choices(keys, weights=weights, k=args.ops)
+        reads = set(rng.sample(range(args.ops), int(args.ops * args.read_ratio)))
+        ops = [(key, i in reads) for i, key in enumerate(ops)]
+        results["mixed"] = self._run_phase(
+            lambda user, op, node: user.get(op[0], node) if op[1] else user.set({'key': op[0], 'value': value}, node),
+            ops)
+        results["get"] = self._run_phase(lambda user, key, node: user.get(key, node), keys)
+
+        if args.batch:
+            data = {key: value for key in keys}
+            results["set_many"] = self._run_batch_phase(
+                lambda user, batch, node: user.set_many({key: data[key] for key in batch}, node), keys)
+            results["get_many"] = self._run_batch_phase(lambda user, batch, node: user.get_many(batch, node), keys)
+        return results
+
+    def stop(self):
+        for client in self.users + self.clients:
+            client.stop()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def flatten(results, prefix=""):
+    """
+    :return: A dict of 'path.to.metric' -> number with every numeric metric of the results
+    """
+    metrics = dict()
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = value
+    return metrics
+
+
+def compare(results, baseline):
+    """
+    Prints the change of every metric against the results of other run
+    """
+    current, previous = flatten(results["results"]), flatten(baseline["results"])
+    print(f"\n{'metric':45} {baseline.get('commit') or 'baseline':>12} {results.get('commit') or 'current':>12} {'change':>9}")
+    for name, value in current.items():
+        before = previous.get(name)
+        if before is None:
+            continue
+        change = f"{(value - before) / before * 100:+.1f}%" if before else ""
+        print(f"{name:45} {before:>12} {value:>12} {change:>9}")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Chord ring benchmark, the nodes run in this process")
+    parser.add_argument("--nodes", type=int, default=8, help="Number of nodes of the ring")
+    parser.add_argument("--port", type=int, default=7000, help="First port of the nodes")
+    parser.add_argument("--keys", type=int, default=1000, help="Number of keys set before the mixed workload")
+    parser.add_argument("--ops", type=int, default=2000, help="Number of operations of the mixed workload")
+    parser.add_argument("--read-ratio", type=float, default=0.9, help="Fraction of reads of the mixed workload")
+    parser.add_argument("--skew", type=float, default=0.0, help="Zipf exponent of the key popularity, 0 is uniform")
+    parser.add_argument("--value-size", type=int, default=100, help="Size of the values in bytes")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of client threads")
+    parser.add_argument("--batch", type=int, default=0, help="Also run GET_MANY/SET_MANY with batches of this size")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use AsyncChordNode")
+    parser.add_argument("--iterative", action="store_true", help="Use iterative lookups")
+    parser.add_argument("--read-consistency", default="owner", choices=["owner", "any", "nearest"],
+                        help="Consistency of the GETs, 'any' and 'nearest' may be answered by a replica")
+    parser.add_argument("--compression", default="zlib", choices=["none", "zlib", "bz2", "lzma"],
+                        help="Compression of the frames larger than COMPRESSION_THRESHOLD")
+    parser.add_argument("--trace-sample-rate", type=float, default=0.01, help="Fraction of the requests traced")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="File where the json results are written")
+    parser.add_argument("--compare", help="Json results of a previous run to compare with")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    benchmark = Benchmark(args)
+    results = {"commit": git_commit(), "config": vars(args), "results": {}}
+    try:
+        results["results"]["ring"] = benchmark.start_ring()
+        results["results"].update(benchmark.run_workload())
+        results["results"]["join"] = benchmark.join_one()
+    finally:
+        benchmark.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,210 @@
+from chord.logger import logger
+from chord.chordnode import ChordNode
+from chord.asynctcpclientserver import AsyncTCPClientServer
+from chord.steps import Send, Gather, FirstOf, Sleep
+
+import asyncio, contextlib, threading, time
+
+
+class AsyncChordNode(ChordNode):
+    """
+    ChordNode running on a single asyncio event loop
+    Incoming requests are tasks instead of threads and the maintenance scheduler
+    (stabilize, fix_fingers, check_predecessor, replication, clear_cache, measure_latency) runs as a task of the same loop
+    The protocol generators of ChordNode are run by an asyncio engine, so both nodes share the same protocol
+    The synchronous methods of ChordNode can still be called from other threads
+    """
+
+    def __init__(self, id, host, port, mbits, data_dir = None):
+        super().__init__(id, host, port, mbits, data_dir)
+        self.server = AsyncTCPClientServer(self.host, self.port, self)
+        self.loop = None
+        self.loop_thread = None
+        self.maintenance_task = None
+
+    def _start_loop(self, daemon):
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=daemon)
+        self.loop_thread.start()
+
+    def _stop_loop(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join()
+            self.loop.close()
+            self.loop = None
+
+    def _run(self, coro):
+        """
+        Runs a coroutine in the event loop of the node and waits for its result
+        Must not be called from the event loop thread
+        """
+        if not self.loop:
+            # Only used as a client, the loop must not keep the process alive
+            self._start_loop(daemon=True)
+        if threading.current_thread() is self.loop_thread:
+            coro.close()
+            raise RuntimeError("Blocking call inside the event loop, use the async method")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def start(self):
+        """
+        Starts the event loop, the server and the maintenance tasks
+        :return: A Response object containing the status of the server
+        """
+        if self.loop and self.loop_thread.daemon:
+            self._stop_loop()
+            self.server.streams.clear()
+            self.server.opening.clear()
+        if not self.loop:
+            self._start_loop(daemon=False)
+
+        server_status = self._run(self.server.start_server())
+        if server_status.success:
+            self.server_started = True
+            self._run(self._start_maintenance())
+        return server_status
+
+    async def _start_maintenance(self):
+        self.scheduler = self._create_scheduler(self.maintenance_functions())
+        self.maintenance_task = asyncio.ensure_future(self.scheduler.run_async())
+
+    def _job(self, protocol):
+        """
+        :return: The maintenance coroutine function that runs the protocol in the event loop
+        """
+        return lambda: self._drive_async(protocol())
+
+    async def _stop_maintenance(self):
+        if self.maintenance_task:
+            self.scheduler.stop()
+            self.maintenance_task.cancel()
+            await asyncio.gather(self.maintenance_task, return_exceptions=True)
+            self.maintenance_task = None
+
+    def stop(self):
+        self.server_started = False
+        if self.loop:
+            self._run(self._stop_maintenance())
+            self._run(self.server.stop_server())
+            self._stop_loop()
+        self.own_data.close()
+        self.replicated_data.close()
+
+    async def handle_message_async(self, dict_message, queue_wait = 0.0):
+        """
+        Performs the operations requested by others nodes without blocking the event loop
+        The requests needed to contact other nodes are awaited by the engine of the node
+        :param dict_message: A RequestMessage object as a dict containing the requested operation
+        :param queue_wait: The time from the arrival of the message until its task started
+        :return: A Response object as a dict containing the result of the operation requested
+        """
+        start = time.perf_counter()
+        message = self.decode_message(dict_message)
+        token = self.tracer.enter(message.trace)
+        try:
+            response = await self._drive_async(self._message_steps(message))
+        finally:
+            self.tracer.leave(token)
+        self._observe_handled(message.type, start, response)
+        if self.tracer.sampled(message.trace):
+            self.tracer.record(message.trace, "handle", message.type, self.id, message.origen, start,
+                               response.get('success'), queue_wait)
+        return response
+
+    def _run_steps(self, steps):
+        return self._run(self._drive_async(steps))
+
+    async def _drive_async(self, steps):
+        """
+        Runs a protocol generator with the asyncio engine, the steps it yields are awaited in the event loop
+        The writes to a durable storage do not block the loop, their commit is awaited before the generator
+        contacts other nodes or returns its result
+        :param steps: A protocol generator, it yields the steps of chord.steps and returns its result
+        :return: The value returned by the generator
+        """
+        value, error = None, None
+        while True:
+            appended = self._appended()
+            try:
+                with self._deferred_commits():
+                    step = steps.throw(error) if error else steps.send(value)
+            except StopIteration as stop:
+                await self._commits(appended)
+                return stop.value
+            await self._commits(appended)
+            try:
+                value, error = await self._perform_async(step), None
+            except Exception as e:
+                value, error = None, e
+
+    def _durable_storages(self):
+        return (self.own_data, self.replicated_data) if self.data_dir else ()
+
+    def _deferred_commits(self):
+        """
+        :return: A context where the durable storages do not wait for the commit of the writes
+        """
+        context = contextlib.ExitStack()
+        for storage in self._durable_storages():
+            context.enter_context(storage.deferred_commits())
+        return context
+
+    def _appended(self):
+        return [storage.appended for storage in self._durable_storages()]
+
+    async def _commits(self, appended):
+        """
+        Awaits the commit of the writes made to the durable storages since they had 'appended' records,
+        a protocol that has not written anything does not wait for the writes of the others
+        """
+        for storage, before in zip(self._durable_storages(), appended):
+            if storage.appended != before:
+                await asyncio.wrap_future(storage.commit_future())
+
+    async def _perform_async(self, step):
+        """
+        Awaits a step yielded by a protocol generator
+        :return: The value the generator is resumed with
+        """
+        if isinstance(step, Send):
+            return await self.send_request_async(step.type, step.key, step.node, step.data, step.timeout)
+        if isinstance(step, Gather):
+            return list(await asyncio.gather(*[self._perform_async(child) for child in step.steps]))
+        if isinstance(step, FirstOf):
+            for request in asyncio.as_completed([self._perform_async(child) for child in step.steps]):
+                value = step.accept(await request)
+                if value is not None:
+                    return value
+            return None
+        if isinstance(step, Sleep):
+            return await asyncio.sleep(step.seconds)
+        return await self._drive_async(step)
+
+    def send_request(self, type, key, node, data = None, timeout = None):
+        return self._run(self.send_request_async(type, key, node, data, timeout))
+
+    def send_request_future(self, type, key, node, data = None, timeout = None):
+        if not self.loop:
+            self._start_loop(daemon=True)
+        return asyncio.run_coroutine_threadsafe(self.send_request_async(type, key, node, data, timeout), self.loop)
+
+    async def send_request_async(self, type, key, node, data = None, timeout = None):
+        """
+        Sends a request message containing a operation to the node address
+        :return: The result of the operation performed by the node, or None in case of error.
+        """
+        start = time.perf_counter()
+        trace = self.tracer.propagate()
+        try:
+            message = self._build_request(type, key, node, data, trace)
+            server_response = await self.server.send_message(node.host, node.port, message, timeout)
+            success = self._request_succeeded(server_response)
+            self._observe_sent(type, start, success)
+            self._observe_rtt(type, node, start, success)
+            if trace[1]:
+                self.tracer.record(trace, "send", type, self.id, node.id, start, success)
+            return self._handle_server_response(server_response)
+        except Exception as e:
+            logger.exception(f"ERROR send_request_async: {repr(e)}")
+            self._observe_sent(type, start, False)
@@ -0,0 +1,299 @@
+import asyncio, itertools, time
+from chord.logger import logger
+from chord.tcpclientserver import TCPClientServer
+from utils.response import Response
+from utils.codec import CODECS, CODECS_BY_NAME, DEFAULT_CODEC
+from utils.compression import COMPRESSORS, COMPRESSED
+
+
+class MultiplexedStream:
+    """
+    The stream to a server node shared by every request sent to it
+    The responses are matched with their request by the request id
+    """
+
+    def __init__(self, reader, writer, codec, compressor=None):
+        super().__init__()
+        self.reader = reader
+        self.writer = writer
+        self.codec = codec
+        self.compressor = compressor # None if the frames are not compressed
+        self.pending = dict() # request id -> asyncio.Future
+        self.request_ids = itertools.count(1)
+        self.write_lock = asyncio.Lock()
+        self.closed = False
+
+
+class AsyncTCPClientServer:
+    """
+    asyncio version of TCPClientServer, it uses the same framed wire protocol
+    Every request is handled as a task in the event loop of the node instead of a thread
+    """
+
+    MAX_CONNECTIONS = TCPClientServer.MAX_CONNECTIONS
+    RESPONSE_TIMEOUT = TCPClientServer.RESPONSE_TIMEOUT
+    FRAME_HEADER = TCPClientServer.FRAME_HEADER
+    MAX_FRAME_SIZE = TCPClientServer.MAX_FRAME_SIZE
+    HANDSHAKE = TCPClientServer.HANDSHAKE
+    PREFERRED_CODECS = TCPClientServer.PREFERRED_CODECS
+    COMPRESSION = TCPClientServer.COMPRESSION
+    COMPRESSION_LEVEL = TCPClientServer.COMPRESSION_LEVEL
+    COMPRESSION_THRESHOLD = TCPClientServer.COMPRESSION_THRESHOLD
+
+    # The negotiation and the compression of the bodies are the same as in TCPClientServer
+    _choose_compression = TCPClientServer._choose_compression
+    _compression_proposal = TCPClientServer._compression_proposal
+    _compressor = TCPClientServer._compressor
+    _pack_body = TCPClientServer._pack_body
+    _unpack_body = TCPClientServer._unpack_body
+
+    def __init__(self, host, port, node):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.node = node
+        self.server = None
+        self.streams = dict() # (host, port) -> MultiplexedStream
+        self.opening = dict() # (host, port) -> asyncio.Lock, a single stream is opened at a time
+        self.connections = set()
+        self.tasks = set()
+        self.bytes_sent = 0 # Frames sent and received, headers included
+        self.bytes_received = 0
+        self.compression = self.COMPRESSION
+        self.compression_level = self.COMPRESSION_LEVEL
+        self.compression_threshold = self.COMPRESSION_THRESHOLD
+        self.frames_compressed = 0
+        self.bytes_before_compression = 0 # Bodies of the compressed frames, before and after the compression
+        self.bytes_after_compression = 0
+
+    async def start_server(self):
+        """
+        Initializes and starts the asyncio stream server
+        :return: A Response object with the server status
+        """
+        server_response = Response()
+        try:
+            self.server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                     backlog=self.MAX_CONNECTIONS)
+            server_response.success = True
+            server_response.payload = f"Server started at ({self.host}:{self.port})"
+        except Exception as e:
+            server_response.success = False
+            server_response.error = f"ERROR init_server: {e}"
+        return server_response
+
+    async def stop_server(self):
+        """
+        Stops the server and closes the client streams
+        """
+        try:
+            if self.server:
+                self.server.close()
+                await self.server.wait_closed()
+            for task in list(self.tasks):
+                task.cancel()
+            for writer in list(self.connections):
+                writer.close()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            await asyncio.sleep(0)
+        except Exception as e:
+            logger.exception(f" STOP SERVER ID: {self.node.id} stop_server, error: {e}")
+        finally:
+            for stream in self.streams.values():
+                stream.writer.close()
+            self.streams.clear()
+            self.opening.clear()
+
+    def stats(self):
+        """
+        :return: A dict with the open connections, the bytes transferred and the compression
+        """
+        return {
+            "connections_in": len(self.connections),
+            "connections_out": len(self.streams),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "frames_compressed": self.frames_compressed,
+            "bytes_before_compression": self.bytes_before_compression,
+            "bytes_after_compression": self.bytes_after_compression,
+            "tasks": len(self.tasks),
+        }
+
+    async def _write_frame(self, writer, codec_id, body):
+        writer.write(self.FRAME_HEADER.pack(codec_id, len(body)) + body)
+        self.bytes_sent += self.FRAME_HEADER.size + len(body)
+        await writer.drain()
+
+    async def _read_frame(self, reader):
+        """
+        Reads one framed message
+        :return: A tuple (codec id, body), or None if the peer closed the connection
+        """
+        try:
+            header = await reader.readexactly(self.FRAME_HEADER.size)
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise
+            return None
+        codec_id, size = self.FRAME_HEADER.unpack(header)
+        if size > self.MAX_FRAME_SIZE:
+            raise ValueError(f"Frame of {size} bytes exceeds MAX_FRAME_SIZE")
+        if codec_id != self.HANDSHAKE and codec_id & ~COMPRESSED not in CODECS:
+            raise ValueError(f"Unknown codec {codec_id}")
+        body = await reader.readexactly(size)
+        self.bytes_received += self.FRAME_HEADER.size + size
+        return codec_id, body
+
+    async def _handshake(self, reader, writer):
+        """
+        Negotiates the codec and the compression of a new client connection
+        :return: A tuple (codec, compressor) chosen by the peer, JSON if it does not answer a known codec
+                 and None if it does not compress
+        """
+        proposal = {"codecs": list(self.PREFERRED_CODECS), "compression": self._compression_proposal()}
+        await self._write_frame(writer, self.HANDSHAKE, DEFAULT_CODEC.encode(proposal))
+        frame = await self._read_frame(reader)
+        if not frame:
+            raise ConnectionError("Handshake failed, connection closed by the peer")
+        codec_id, body = frame
+        if codec_id != self.HANDSHAKE:
+            return DEFAULT_CODEC, None
+        answer = DEFAULT_CODEC.decode(body)
+        compressor = None
+        if answer.get('compression') in COMPRESSORS:
+            compressor = self._compressor(answer['compression'])
+        return CODECS_BY_NAME.get(answer.get('codec'), DEFAULT_CODEC), compressor
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Reads the messages of a connection and handles every message in its own task
+        """
+        write_lock = asyncio.Lock()
+        compressor = None
+        self.connections.add(writer)
+        try:
+            while True:
+                frame = await self._read_frame(reader)
+                if frame is None:
+                    break
+                codec_id, body = frame
+                if codec_id == self.HANDSHAKE:
+                    proposal = DEFAULT_CODEC.decode(body)
+                    chosen = next((name for name in proposal.get('codecs', []) if name in CODECS_BY_NAME),
+                                  DEFAULT_CODEC.name)
+                    compression = self._choose_compression(proposal.get('compression', []))
+                    compressor = self._compressor(compression) if compression else None
+                    answer = {"codec": chosen, "compression": compression}
+                    async with write_lock:
+                        await self._write_frame(writer, self.HANDSHAKE, DEFAULT_CODEC.encode(answer))
+                    continue
+                task = asyncio.ensure_future(self._handle_data(codec_id, body, writer, write_lock, compressor,
+                                                               time.perf_counter()))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            logger.error(f" ERROR SERVER ID: {self.node.id} _handle_connection: {e}")
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def _handle_data(self, codec_id, body, writer, write_lock, compressor, received_at):
+        try:
+            codec, body = self._unpack_body(codec_id, body, compressor)
+            message = codec.decode(body)
+            response = await self.node.handle_message_async(message, time.perf_counter() - received_at)
+            response['request_id'] = message.get('request_id')
+            codec_id, body = self._pack_body(codec, codec.encode(response), compressor)
+            async with write_lock:
+                await self._write_frame(writer, codec_id, body)
+        except Exception as e:
+            logger.exception(f" ERROR SERVER ID: {self.node.id} _handle_data")
+            writer.close()
+
+    async def _stream(self, host, port):
+        """
+        Obtains the stream to a server node or opens a new one
+        :return: The MultiplexedStream
+        """
+        address = (host, port)
+        stream = self.streams.get(address)
+        if stream and not stream.closed:
+            return stream
+        async with self.opening.setdefault(address, asyncio.Lock()):
+            stream = self.streams.get(address)
+            if stream and not stream.closed:
+                return stream
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                codec, compressor = await self._handshake(reader, writer)
+            except Exception:
+                writer.close()
+                raise
+            stream = MultiplexedStream(reader, writer, codec, compressor)
+            self.streams[address] = stream
+            task = asyncio.ensure_future(self._read_responses(address, stream))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            return stream
+
+    async def _read_responses(self, address, stream):
+        """
+        Reads the responses of a stream and completes the future of their request
+        """
+        error = ConnectionError("Connection closed by the peer")
+        try:
+            while True:
+                frame = await self._read_frame(stream.reader)
+                if frame is None:
+                    break
+                codec, body = self._unpack_body(*frame, stream.compressor)
+                response = codec.decode(body)
+                # A response without a pending request belongs to a request that has timed out
+                future = stream.pending.pop(response.get('request_id'), None)
+                if future and not future.done():
+                    future.set_result(response)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            error = e
+        finally:
+            stream.closed = True
+            if self.streams.get(address) is stream:
+                del self.streams[address]
+            stream.writer.close()
+            for future in stream.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            stream.pending.clear()
+
+    async def send_message(self, host, port, message, timeout=None):
+        """
+        Sends a message to other server node over the stream shared by every request to the node
+        The request is tagged with a request id, so the responses can arrive in any order
+        :param host: The server node host
+        :param port: The server node port
+        :param message: The message as a dict, it is encoded with the codec negotiated for the stream
+        :param timeout: The maximum time to wait for the response, RESPONSE_TIMEOUT by default
+        :return: A Response object whose payload is the decoded response sended by the node contacted
+        """
+        timeout = timeout or self.RESPONSE_TIMEOUT
+        server_response = Response()
+        request_id = None
+        stream = None
+        try:
+            stream = await asyncio.wait_for(self._stream(host, port), timeout)
+            request_id = next(stream.request_ids)
+            future = asyncio.get_running_loop().create_future()
+            stream.pending[request_id] = future
+            codec_id, body = self._pack_body(stream.codec, stream.codec.encode(dict(message, request_id=request_id)),
+                                             stream.compressor)
+            async with stream.write_lock:
+                await self._write_frame(stream.writer, codec_id, body)
+            server_response.payload = await asyncio.wait_for(future, timeout)
+            server_response.success = True
+        except Exception as e:
+            logger.error(f" ERROR SERVER ID: {self.node.id} send_message: {repr(e)}")
+            server_response.success = False
+            server_response.error = f"ERROR send_message: {repr(e)}"
+        finally:
+            if request_id is not None:
+                stream.pending.pop(request_id, None)
+        return server_response
@@ -1,74 +1,313 @@
 from chord.node import Node
 from chord.type import Type
+from chord.consistency import Consistency
 from chord.logger import logger
 from chord.storage import Storage
+from chord.durablestorage import DurableStorage
+from chord.lrucache import LRUCache
+from chord.locationcache import LocationCache
+from chord.latency import LatencyTable
+from chord.hotkeys import HotKeys
+from chord.tracing import Tracer
+from chord.metrics import Metrics
 from chord.fingernode import FingerNode
+from chord.fingertable import FingerTable
+from chord.scheduler import MaintenanceJob, MaintenanceScheduler
+from chord.steps import Send, Gather, FirstOf, Sleep
 from chord.tcpclientserver import TCPClientServer
 from utils.response import Response
 from utils.requestmessage import RequestMessage
 from utils.getsetresponse import GetSetResponse
+from concurrent.futures import Future
 
 
-import threading, json, enum, time, logging, sys, ast
+import threading, json, enum, time, logging, sys, os, hashlib, math, random
 
 class ChordNode(Node):
 
-    STABILIZATION_TIME = 0.6
-    REPLICATION_TIME   = 3
-    CLEAR_CACHE_TIME   = 10
+    CHANGE_LOG_SIZE    = 100000
+    SUCCESSOR_LIST_SIZE = 4
+
+    # Maintenance jobs: name -> (min interval, max interval, jitter)
+    # The interval of a job grows up to the max while it detects no changes and returns to the min after a change
+    MAINTENANCE_INTERVALS = {
+        "stabilize":         (0.3, 5, 0.2),
+        "fix_fingers":       (0.3, 5, 0.2),
+        "check_predecessor": (0.6, 5, 0.2),
+        "replication":       (1, 5, 0.2),
+        "clear_cache":       (10, 10, 0.2),
+        "measure_latency":   (2, 10, 0.2),
+    }
+    # A change of the successor or the predecessor tightens the jobs that keep the topology,
+    # a finger change only tightens fix_fingers
+    TOPOLOGY_JOBS = ("stabilize", "fix_fingers", "check_predecessor")
+
+    # Lookups are recursive by default, in iterative mode the node drives every hop itself
+    # sending GET_CPF to LOOKUP_PARALLELISM candidates at once
+    LOOKUP_ITERATIVE   = False
+    LOOKUP_PARALLELISM = 3
+    LOOKUP_HOP_TIMEOUT = 1
+
+    # In bulk mode fix_fingers refreshes the whole finger table, looking up only the first level of every
+    # distinct finger. FINGER_REFRESH_PROBES top levels are also looked up in the first round, they are
+    # usually distinct fingers. A refresh stops after FINGER_REFRESH_ROUNDS rounds of concurrent lookups
+    BULK_FINGER_REFRESH   = True
+    FINGER_REFRESH_PROBES = 8
+    FINGER_REFRESH_ROUNDS = 8
+
+    # With proximity routing a lookup hop goes to the preceding node with the lowest estimated latency among
+    # those whose distance to the key is at most PROXIMITY_PROGRESS times the one of the closest preceding node
+    # GETs are answered by the owner of the key unless they ask for other consistency
+    READ_CONSISTENCY = Consistency.OWNER
+
+    PROXIMITY_ROUTING  = True
+    PROXIMITY_PROGRESS = 4
+    # Requests answered by the receiver without contacting other nodes, their response time is the round trip time
+    RTT_TYPES = (Type.CHECK_STATUS, Type.NOTIFY, Type.GET_PREDECESSOR, Type.GET_SUCCESSOR,
+                 Type.GET_SUCCESSOR_LIST, Type.GET_CPF)
+
+    # Maintenance messages are never queued behind lookups or bulk transfers
+    MESSAGE_PRIORITY = {
+        Type.CHECK_STATUS:       0,
+        Type.STATS:              0,
+        Type.TRACES:             0,
+        Type.NOTIFY:             0,
+        Type.GET_PREDECESSOR:    0,
+        Type.GET_SUCCESSOR:      0,
+        Type.GET_SUCCESSOR_LIST: 0,
+        Type.FIND_SUCCESSOR:     1,
+        Type.GET_CPF:            1,
+        Type.GET_DATA:           2,
+        Type.SET_DATA:           2,
+        Type.GET_MANY:           2,
+        Type.SET_MANY:           2,
+        Type.CACHE_PUSH:         2,
+        Type.CACHE_INVALIDATE:   2,
+        Type.REPLICATION:        3,
+        Type.GET_KEYS:           3,
+    }
+    DEFAULT_PRIORITY = 2
+    # The protocols waiting for other nodes are resumed with this priority, before any new request is started
+    CONTINUATION_PRIORITY = 0
+
+    # A node with durable storage that joins again sends a digest of the keys it already has per bucket of its range,
+    # only the buckets that differ are sent back
+    KEY_DIGEST_BUCKETS = 256
+
+    # The keys of a joining node are transferred in chunks, the next chunk is requested once the previous one
+    # has been stored. A chunk has at most KEY_CHUNK_SIZE keys and is cut when its values exceed KEY_CHUNK_BYTES
+    KEY_CHUNK_SIZE  = 1000
+    KEY_CHUNK_BYTES = 4 * 1024 * 1024
+    KEY_TRANSFER_TRIES = 10
+
+    # Fraction of the requests started by this node that are traced, and the number of spans kept in memory
+    TRACE_SAMPLE_RATE = Tracer.SAMPLE_RATE
+    TRACE_BUFFER_SIZE = Tracer.CAPACITY
     
-    def __init__(self, id, host, port, mbits):
+    def __init__(self, id, host, port, mbits, data_dir = None):
         super().__init__(id, host, port)
         self.successor = None
+        self.successor_list = [] # The next SUCCESSOR_LIST_SIZE nodes, successor_list[0] is the successor
         self.predecessor = None
         self.mbits = mbits
         self.next = -1
-        self.finger_table = [FingerNode(id, host, port) for _ in range(mbits)]
-        self.own_data = Storage() # Data from (pred.id , self.id]
-        self.replicated_data = Storage()   # Data from pred.id
-        self.cache = Storage()
+        self.finger_table = FingerTable(id, mbits, self)
+        self.bulk_finger_refresh = self.BULK_FINGER_REFRESH
+        self.data_dir = data_dir # The data survives a restart if it is set
+        if data_dir:
+            self.own_data = DurableStorage(os.path.join(data_dir, "own_data"), self.CHANGE_LOG_SIZE)
+            self.replicated_data = DurableStorage(os.path.join(data_dir, "replicated_data"))
+        else:
+            self.own_data = Storage(self.CHANGE_LOG_SIZE) # Data from (pred.id , self.id]
+            self.replicated_data = Storage()   # Data from pred.id
+        self.replica_acked = None   # (successor id, own_data version stored by the successor)
+        self.replica_source = None  # (predecessor id, version of his data stored in replicated_data)
+        self.cache = LRUCache()
+        self.locations = LocationCache(mbits) # Successors of key ranges learned from the lookups and the traffic
+        self.lookup_iterative = self.LOOKUP_ITERATIVE
+        self.lookup_parallelism = self.LOOKUP_PARALLELISM
+        self.proximity_routing = self.PROXIMITY_ROUTING
+        self.read_consistency = self.READ_CONSISTENCY
+        self.latencies = LatencyTable()
+        self.hot_keys = HotKeys() # Request rate of the own keys and the nodes the hot ones have been pushed to
+        self.tracer = Tracer(self.TRACE_SAMPLE_RATE, self.TRACE_BUFFER_SIZE)
         self.server = TCPClientServer(self.host, self.port, self)
         self.server_started = False
+        self.scheduler = None
+        self.metrics = Metrics()
+        self.metrics.add_collector(self._metric_gauges)
+        self.siblings = dict() # id -> ChordNode, the virtual nodes served by the same process and socket
+        self.job_suffix = "" # Makes the job names unique when the scheduler is shared by virtual nodes
         
     def start(self):
         """
-        Initializes the server and the stabilization threads
+        Initializes the server and the maintenance scheduler
         :return: A Response object containing the status of the server
         """
         server_status = self.server.start_server()
         if server_status.success:
             self.server_started = True
-            threading.Thread(target=self._run_function_thread, 
-                            args=(self.stabilize, self.STABILIZATION_TIME)).start()
-
-            threading.Thread(target=self._run_function_thread, 
-                            args=(self.fix_fingers, self.STABILIZATION_TIME)).start()
+            self.scheduler = self._create_scheduler(self.maintenance_functions())
+            self.scheduler.start()
+        return server_status
 
-            threading.Thread(target=self._run_function_thread, 
-                            args=(self.check_predecessor, self.STABILIZATION_TIME)).start()
-                        
-            threading.Thread(target=self._run_function_thread, 
-                            args=(self.replication, self.REPLICATION_TIME)).start()
+    def maintenance_functions(self):
+        """
+        :return: A dict of job name -> function with the maintenance jobs of the node
+        """
+        return {
+            "stabilize": self._job(self._stabilize_steps),
+            "fix_fingers": self._job(self._fix_fingers_steps),
+            "check_predecessor": self._job(self._check_predecessor_steps),
+            "replication": self._job(self._replication_steps),
+            "clear_cache": self.clear_cache,
+            "measure_latency": self._job(self._measure_latency_steps),
+        }
 
-            threading.Thread(target=self._run_function_thread,
-                            args=(self.clear_cache, self.CLEAR_CACHE_TIME)).start()
-        return server_status
+    def _job(self, protocol):
+        """
+        :param protocol: A function that returns a protocol generator
+        :return: The maintenance function that starts the protocol with the engine of the node,
+                 it returns a Future so the scheduler does not wait for the nodes contacted
+        """
+        return lambda: self._drive(protocol())
 
     def stop(self):
+        if self.scheduler:
+            self.scheduler.stop()
         self.server.stop_server()
         self.server_started = False
+        self.own_data.close()
+        self.replicated_data.close()
+
+    def _create_scheduler(self, functions):
+        """
+        Creates the scheduler of the maintenance jobs with the MAINTENANCE_INTERVALS
+        :param functions: A dict of job name -> function, each function returns True if it detected a change
+        :return: The MaintenanceScheduler
+        """
+        scheduler = MaintenanceScheduler(name=f"maintenance-{self.port}")
+        self.add_jobs(scheduler, functions)
+        scheduler.observer = self._observe_maintenance
+        return scheduler
+
+    def add_jobs(self, scheduler, functions):
+        """
+        Adds the maintenance jobs of the node to a scheduler, that may be shared with other virtual nodes
+        :param functions: A dict of job name -> function, each function returns True if it detected a change
+        :return: A list with the names of the jobs added
+        """
+        topology_jobs = self._job_names(*self.TOPOLOGY_JOBS)
+        names = []
+        for name, func in functions.items():
+            min_interval, max_interval, jitter = self.MAINTENANCE_INTERVALS[name]
+            tightens = topology_jobs if name in ("stabilize", "check_predecessor") else ()
+            names.append(self._job_names(name)[0])
+            scheduler.add_job(MaintenanceJob(names[-1], func, min_interval, max_interval, jitter, tightens=tightens))
+        return names
+
+    def _job_names(self, *names):
+        return tuple(name + self.job_suffix for name in names)
+
+    def _data_changed(self):
+        """
+        Replicates soon the data stored in this node, so the successor does not lag behind after a quiet period
+        """
+        if self.scheduler:
+            self.scheduler.tighten(*self._job_names("replication"))
+
+    def _topology_changed(self):
+        """
+        Runs the topology maintenance jobs soon, used when a change is detected outside of them
+        """
+        if self.scheduler:
+            self.scheduler.tighten(*self._job_names(*self.TOPOLOGY_JOBS))
 
 
-    def handle_message(self, str_message):
+    def handle_message(self, dict_message):
         """ 
         Performs the operations requested by others nodes
-        :param str_message: A RequestMessage object in json format containing the requested operation
-        :return: A Response object in json format containing the result of the operation requested
+        :param dict_message: A RequestMessage object as a dict containing the requested operation
+        :return: A Response object as a dict containing the result of the operation requested
+        """
+        return self.process_message(self.decode_message(dict_message))
+
+    def decode_message(self, dict_message):
+        """
+        :param dict_message: A RequestMessage object as a dict, as decoded by the connection codec
+        :return: The RequestMessage object
+        """
+        message = RequestMessage()
+        message.update(dict_message)
+        return message
+
+    def message_priority(self, message):
+        """
+        :param message: A RequestMessage object
+        :return: The priority used to queue the message, lower values are handled first
+        """
+        return self.MESSAGE_PRIORITY.get(message.type, self.DEFAULT_PRIORITY)
+
+    def reject_message(self, message):
+        """
+        Builds the response sent when the message can not be queued because the node is overloaded
+        :return: A Response object as a dict
+        """
+        response = Response(origen=self.id, destination=message.origen, request_id=message.request_id)
+        response.success = False
+        response.error = "Node busy, request queue is full"
+        return vars(response)
+
+    def process_message(self, message, queue_wait = 0.0):
+        """
+        Performs the operation of a decoded request message and waits for its response
+        :param message: A RequestMessage object containing the requested operation
+        :param queue_wait: The time the message waited in the queue of the worker pool
+        :return: A Response object as a dict containing the result of the operation requested
+        """
+        return self.process_message_future(message, queue_wait).result()
+
+    def process_message_future(self, message, queue_wait = 0.0):
+        """
+        Performs the operation of a decoded request message without waiting for the nodes it contacts,
+        so the worker that handles it is free while the request is forwarded
+        Its count and duration are recorded in the metrics, the requests sent to handle it carry its trace,
+        and a span is recorded if the trace is sampled
+        :param message: A RequestMessage object containing the requested operation
+        :param queue_wait: The time the message waited in the queue of the worker pool
+        :return: A Future whose result is a Response object as a dict containing the result of the operation
+        """
+        start = time.perf_counter()
+        result = Future()
+        result.set_running_or_notify_cancel()
+
+        def done(request):
+            if request.exception():
+                result.set_exception(request.exception())
+                return
+            response = request.result()
+            self._observe_handled(message.type, start, response)
+            if self.tracer.sampled(message.trace):
+                self.tracer.record(message.trace, "handle", message.type, self.id, message.origen, start,
+                                   response.get('success'), queue_wait)
+            result.set_result(response)
+
+        token = self.tracer.enter(message.trace)
+        try:
+            request = self._drive(self._message_steps(message))
+        finally:
+            self.tracer.leave(token)
+        request.add_done_callback(done)
+        return result
+
+    def _message_steps(self, message):
+        """
+        Protocol of the requests sent by other nodes, shared by both engines
+        :param message: A RequestMessage object containing the requested operation
+        :return: A Response object as a dict containing the result of the operation requested
         """
         try:
-            message = RequestMessage()
-            message.update(json.loads(str_message))
-            response = Response(origen=self.id, destination=message.origen)
+            response = Response(origen=self.id, destination=message.origen, request_id=message.request_id)
             
             request_type = message.type
             key  = message.key
@@ -78,16 +317,19 @@ class ChordNode(Node):
                 raise ValueError('Type not provided')
 
             if (request_type == Type.FIND_SUCCESSOR):
-                successor_k = self.find_successor(key)
+                successor_k = yield from self._find_successor_steps(key)
                 if (not successor_k):
                     raise ValueError('FIND_SUCCESSOR: Successor not found')
                 response.payload = vars(successor_k)
 
+            elif (request_type == Type.GET_CPF):
+                response.payload = self._closest_preceding_state(key, data['count'] if data else 1)
+
             elif (request_type == Type.GET_SUCCESSOR):
                 response.payload = vars(self.successor)
 
             elif (request_type == Type.GET_DATA):
-                data = self.get(key)
+                data = yield from self._get_steps(key, data)
                 if not data:
                     raise ValueError('GET_DATA: No get data Response')
                 response.payload = data
@@ -95,6 +337,9 @@ class ChordNode(Node):
             elif (request_type == Type.GET_PREDECESSOR):
                 response.payload = vars(self.predecessor) if self.predecessor else None
 
+            elif (request_type == Type.GET_SUCCESSOR_LIST):
+                response.payload = self._successor_state()
+
             elif (request_type == Type.NOTIFY):
                 self.notify(data)
 
@@ -102,39 +347,69 @@ class ChordNode(Node):
                 response.payload = {"status":"ok", "server_id": self.id}
                 
             elif (request_type == Type.SET_DATA):
-                set_data = self._set_data(data)
+                set_data = yield from self._set_data_steps(data)
                 if not set_data:
                     raise ValueError('SET_DATA: No set data Response')
                 response.payload = set_data
 
+            elif (request_type == Type.GET_MANY):
+                response.payload = yield from self._get_many_steps(data['keys'])
+
+            elif (request_type == Type.SET_MANY):
+                response.payload = yield from self._set_many_steps(data['items'])
+
             elif (request_type == Type.GET_KEYS):
-                keys = self._get_keys(data)
-                response.payload = str(keys)
+                response.payload = self._get_keys(data)
 
             elif (request_type == Type.REPLICATION):
-                self._save_replicated_data(data, message.origen)
+                response.payload = self._save_replicated_data(data, message.origen)
+
+            elif (request_type == Type.CACHE_PUSH):
+                self.cache.set_key_value(data['key'], (data['value'], data.get('version')), data['ttl'])
+
+            elif (request_type == Type.CACHE_INVALIDATE):
+                for pushed_key in data['keys']:
+                    self.cache.invalidate(pushed_key)
+
+            elif (request_type == Type.STATS):
+                response.payload = self.stats(data.get('format') if data else None)
+
+            elif (request_type == Type.TRACES):
+                response.payload = self.tracer.dump(data.get('trace_id') if data else None)
                 
             else:
                 raise ValueError(f"Type {request_type} not found")
 
             response.success = True
-            return json.dumps(vars(response))
+            return vars(response)
             
         except Exception as e:
             logger.exception(f"Error handle_message: {e}")
             response.success = False
             response.error = "Error handle_message exception"
-            return json.dumps(vars(response))
+            return vars(response)
 
     def _save_replicated_data(self, data, pred_id):
         """
         Saves the data sended by other node in the replicated_data storage
         The node who send the information has to be his predecessor
-        :param data: The data to save
+        :param data: A dict object with the replication mode ('full' or 'delta'), the versions and the data
         :param pred_id: The node id sending the data
+        :return: A dict object with the version applied, or asking for a full copy if the delta can not be applied
         """
-        if self.predecessor and self.predecessor.id == pred_id:
-            self.replicated_data.set_store_data(ast.literal_eval(data))
+        if not self.predecessor or self.predecessor.id != pred_id:
+            return {"accepted": False}
+
+        if data['mode'] == 'full':
+            self.replicated_data.set_store_data(dict(data['items']))
+        elif self.replica_source == (pred_id, data['base']):
+            self.replicated_data.apply_changes(data['changes'])
+        else:
+            # The base version is not the one stored, or the predecessor has changed
+            return {"resync": True}
+
+        self.replica_source = (pred_id, data['version'])
+        return {"version": data['version']}
 
 
     def _handle_server_response(self, server_response):
@@ -146,7 +421,7 @@ class ChordNode(Node):
         try:
             if server_response.success and server_response.payload:
                 request_response = Response()
-                request_response.update(json.loads(server_response.payload))
+                request_response.update(server_response.payload)
                 
                 if request_response.success:
                     return request_response.payload
@@ -158,47 +433,235 @@ class ChordNode(Node):
             logger.exception(f"ERROR _handle_server_response: {repr(e)}")
 
  
-    def send_request(self, type, key, node, data = None):
+    def send_request(self, type, key, node, data = None, timeout = None):
         """ 
         Sends a request message containing a operation to the node address
         :param type: The type of operation to perform
         :param key: The key used to perform a search operation
         :param node: The node to send the operation
         :param data: Data sended to the node
+        :param timeout: The maximum time to wait for the response, the server RESPONSE_TIMEOUT by default
         :return: The result of the operation performed by the node, or None in case of error.
         """
+        return self.send_request_future(type, key, node, data, timeout).result()
+
+    def send_request_future(self, type, key, node, data = None, timeout = None):
+        """
+        Sends a request message without waiting for the response, the requests sent to a node share its connection
+        :return: A Future whose result is the result of the operation performed by the node, or None in case of error
+        """
+        result = Future()
+        result.set_running_or_notify_cancel()
+        start = time.perf_counter()
+        trace = self.tracer.propagate()
+
+        def done(request):
+            server_response = request.result()
+            success = self._request_succeeded(server_response)
+            self._observe_sent(type, start, success)
+            self._observe_rtt(type, node, start, success)
+            if trace[1]:
+                self.tracer.record(trace, "send", type, self.id, node.id, start, success)
+            result.set_result(self._handle_server_response(server_response))
+
         try:
-            message = RequestMessage(type, key, self.id, node.id, data)
-            message = json.dumps(vars(message))
-            server_response = self.server.send_message(node.host, node.port, message)
-            return self._handle_server_response(server_response)
+            message = self._build_request(type, key, node, data, trace)
+            sibling = self._local_sibling(node)
+            if sibling:
+                self._send_local(sibling, message).add_done_callback(done)
+            else:
+                self.server.submit_message(node.host, node.port, message, timeout).add_done_callback(done)
         except Exception as e:
-            logger.exception("ERROR send_request: ", repr(e))
+            logger.exception(f"ERROR send_request: {repr(e)}")
+            self._observe_sent(type, start, False)
+            result.set_result(None)
+        return result
+
+    def _run_steps(self, steps):
+        """
+        Runs a protocol generator and waits for its result, used by the blocking methods of the node
+        """
+        return self._drive(steps).result()
+
+    def _drive(self, steps):
+        """
+        Runs a protocol generator with the threaded engine, without blocking the calling thread
+        Every step is started with send_request_future, and the generator is resumed by the thread that completes it
+        :param steps: A protocol generator, it yields the steps of chord.steps and returns its result
+        :return: A Future whose result is the value returned by the generator
+        """
+        result = Future()
+        result.set_running_or_notify_cancel()
+        trace = self.tracer.current.get() # The generator keeps the trace of the request it was started by
+
+        def advance(value, error):
+            while True:
+                token = self.tracer.enter(trace)
+                try:
+                    step = steps.throw(error) if error else steps.send(value)
+                    pending = self._perform(step)
+                except StopIteration as stop:
+                    result.set_result(stop.value)
+                    return
+                except Exception as e:
+                    result.set_exception(e)
+                    return
+                finally:
+                    self.tracer.leave(token)
+                if not pending.done():
+                    pending.add_done_callback(lambda done: self._resume(advance, done))
+                    return
+                # Steps answered at once (shortcuts, virtual nodes) are resumed in a loop instead of recursively
+                value, error = self._outcome(pending)
+
+        advance(None, None)
+        return result
+
+    def _resume(self, advance, done):
+        """
+        Resumes a protocol generator with the outcome of its step in the worker pool, ahead of the new requests
+        so the requests already started are finished first. The step is usually completed by the thread that
+        reads a connection, it is resumed there only when the pool is not running or its queue is full
+        """
+        workers = self.server.workers
+        if not (workers.running and workers.submit(self.CONTINUATION_PRIORITY, advance, *self._outcome(done))):
+            advance(*self._outcome(done))
+
+    @staticmethod
+    def _outcome(future):
+        """
+        :return: A tuple (result, exception) of a completed Future
+        """
+        error = future.exception()
+        return (None, error) if error else (future.result(), None)
+
+    def _perform(self, step):
+        """
+        Starts a step yielded by a protocol generator
+        :return: A Future whose result is the value the generator is resumed with
+        """
+        if isinstance(step, Send):
+            return self.send_request_future(step.type, step.key, step.node, step.data, step.timeout)
+        if isinstance(step, (Gather, FirstOf)):
+            return self._perform_many(step)
+        if isinstance(step, Sleep):
+            result = Future()
+            result.set_running_or_notify_cancel()
+            timer = threading.Timer(step.seconds, result.set_result, (None,))
+            timer.daemon = True
+            timer.start()
+            return result
+        return self._drive(step)
+
+    def _perform_many(self, step):
+        """
+        Starts the steps of a Gather or a FirstOf at once
+        :return: A Future whose result is the list of results of a Gather, or the value accepted by a FirstOf
+        """
+        result = Future()
+        result.set_running_or_notify_cancel()
+        first_of = isinstance(step, FirstOf)
+        futures = [self._perform(child) for child in step.steps]
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(future):
+            # The outcome is decided under the lock, the generator is resumed outside of it
+            with lock:
+                if result.done() or remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+                value, error = self._outcome(future)
+                if first_of and not error:
+                    try:
+                        value = step.accept(value)
+                    except Exception as e:
+                        value, error = None, e
+                if error:
+                    remaining[0] = 0
+                elif first_of and value is not None:
+                    remaining[0] = 0
+                elif remaining[0]:
+                    return
+                elif not first_of:
+                    value = [child.result() for child in futures]
+            if error:
+                result.set_exception(error)
+            else:
+                result.set_result(value)
+
+        if not futures:
+            result.set_result(None if first_of else [])
+        for future in futures:
+            future.add_done_callback(done)
+        return result
+
+    def _local_sibling(self, node):
+        """
+        :return: The virtual node of this process that is the node, None if the node is remote
+        """
+        if self.siblings and node.port == self.port and node.host == self.host:
+            return self.siblings.get(node.id)
+        return None
+
+    def _send_local(self, sibling, message):
+        """
+        Handles a request sent to a virtual node of this process in the calling thread, without using the socket
+        :return: A Future whose result is the server Response, as the transport would complete it
+        """
+        request = Future()
+        request.set_running_or_notify_cancel()
+
+        def done(handled):
+            server_response = Response(payload=handled.result())
+            server_response.success = True
+            request.set_result(server_response)
+
+        sibling.process_message_future(sibling.decode_message(message)).add_done_callback(done)
+        return request
+
+    def _sibling_owner(self, k):
+        """
+        :return: The virtual node of this process responsible for the key, None if no one is
+        """
+        for sibling in self.siblings.values():
+            if sibling._is_local_key(k):
+                return Node(sibling.id, sibling.host, sibling.port)
+        return None
+
+    def _build_request(self, type, key, node, data = None, trace = None):
+        """
+        Builds the request message sent by send_request
+        :param trace: The trace of the request, from Tracer.propagate
+        :return: The RequestMessage object as a dict, it is encoded by the codec of the connection
+        """
+        message = RequestMessage(type, key, self.id, node.id, data, trace=trace)
+        return vars(message)
         
     
     def _get_keys_in_interval(self, start, end, data_from, data_to, ignore_key = False):
         """ 
         Obtains all the keys in the range of (start, end] from 'data_from' 
         and passests it to 'data_to' if 'ignore_key' its false
+        The range is found in the sorted index of the storage, only the k keys moved are visited
 
         :param start: Start of the key range
         :param end: End of the key range
-        :param data_from: The data structure from where the keys are obtained
-        :param data_to: The data structure from where the keys are stored
+        :param data_from: The Storage from where the keys are obtained
+        :param data_to: The Storage where the keys are stored
         :param ignore_key: A boolean used to ignore the key if its in 'data_from'
         :return: A dict object containing the keys requested
         """
         try:
-            response_data = {}
-            for key,value in data_from.copy().items():
+            max_nodes = 2**self.mbits
+            start, end = start % max_nodes, end % max_nodes
+            if ignore_key:
                 # data_to already have the key
-                if ignore_key and data_to.get(key, None):
-                    continue 
-
-                if (self.interval(start, key, end, True)):
-                    data_k = data_from.pop(key)
-                    response_data[key] = data_k
-                    data_to[key] = data_k 
+                keys = [key for key in data_from.keys_in_range(start, end) if not data_to.get_key(key)]
+                response_data = data_from.pop_keys(keys)
+            else:
+                response_data = data_from.pop_range(start, end)
+            data_to.update_store_data(response_data)
             return response_data
         except Exception as e:
             print("ERROR _get_keys_in_interval: ", e)
@@ -209,7 +672,6 @@ class ChordNode(Node):
         i = start 
         while True:
             data_k = self.search(i)  
-            print(f"node: {self.id} - i: {i}, data: {data_k}")
             if data_k:
                 response_data[i] = data_k
             if i == end:
@@ -226,35 +688,87 @@ class ChordNode(Node):
 
     def _get_keys(self, keys):
         """ 
-        Obtains the keys in a range requested by other node when joins the chord network
-        :param keys: A dict object containing the range of the requested keys
-        :return: A dict object with the keys requested
+        Obtains a chunk of the keys in a range requested by other node when joins the chord network
+        The keys up to 'after', already stored by the joining node, are moved to the replicated data first,
+        so a chunk whose response is lost is sent again when the transfer resumes from the last key received
+        The keys are read from both storages: a node that restarts before it is replaced as predecessor
+        requests a range this node only has in its replicated data
+        :param keys: A dict object containing the range of the requested keys, the last key received ('after')
+                     and the chunk size ('limit'). The first request may carry the digests of the keys the node
+                     already has, the following ones the buckets that differ
+        :return: A dict object with the (key, value) pairs of the chunk, the last key scanned and
+                 whether the range is done. The response to the digests also has the buckets that differ
         """
         max_nodes = 2**self.mbits
-        key_start = keys['start'] % max_nodes
+        key_start = (keys['start'] - 1) % max_nodes
         key_end   = keys['end'] % max_nodes
-       
-        number_dict_data = len(self.own_data.get_store())
-        number_beetween_nodes = self._nodes_between(key_start, key_end, max_nodes)
-        
-        return self._get_keys_in_interval((key_start-1) % max_nodes, key_end,
-                                            self.own_data.get_store(), self.replicated_data.get_store())
-
-        # if number_dict_data < number_beetween_nodes:
-        #     return self._get_keys_in_interval((key_start-1) % max_nodes, key_end,
-        #                                         self.own_data, self.replicated_data)
-        # else:
-        #     return self._get_keys_only_nodes(key_start, key_end, max_nodes)
-        
+        after     = keys.get('after')
+
+        response = {"items": [], "last": after, "done": after == key_end}
+        if after is not None:
+            self._get_keys_in_interval(key_start, after, self.own_data, self.replicated_data)
+        if 'digests' in keys:
+            digests = self._range_digests(self._scan_stored_range(key_start, key_end), key_start, key_end)
+            response['buckets'] = [i for i, digest in enumerate(digests) if digest != keys['digests'][i]]
+        if response['done']:
+            return response
+
+        chunk = self._cut_chunk(self._stored_range(key_start, key_end, after, min(keys['limit'], self.KEY_CHUNK_SIZE)))
+        buckets = response.get('buckets', keys.get('buckets'))
+        if buckets is not None:
+            differing = set(buckets)
+            response['items'] = [[key, value] for key, value in chunk
+                                 if self._digest_bucket(key, key_start, key_end) in differing]
+        else:
+            response['items'] = [[key, value] for key, value in chunk]
+        response['last'] = chunk[-1][0] if chunk else after
+        response['done'] = not chunk
+        return response
+
+    def _stored_range(self, start, end, after, limit):
+        """
+        Obtains the first (key, value) pairs of the ring interval (start, end] after a key from the own data and
+        the replicated data, the own data value of a key in both is used
+        :return: A list of at most 'limit' pairs in ring order
+        """
+        items = dict(self.replicated_data.iter_range(start, end, after=after, limit=limit))
+        items.update(self.own_data.iter_range(start, end, after=after, limit=limit))
+        max_nodes = 2**self.mbits
+        origin = start if after is None else after
+        return sorted(items.items(), key=lambda item: (item[0] - origin - 1) % max_nodes)[:limit]
+
+    def _scan_stored_range(self, start, end):
+        """
+        Iterates over the (key, value) pairs of the ring interval (start, end] of the own data and the replicated
+        data, a chunk at a time. The own data value of a key in both is used
+        """
+        yield from self.own_data.scan_range(start, end, self.KEY_CHUNK_SIZE)
+        for key, value in self.replicated_data.scan_range(start, end, self.KEY_CHUNK_SIZE):
+            if self.own_data.get_key(key) is None:
+                yield key, value
+
+    def _cut_chunk(self, chunk):
+        """
+        :return: The first pairs of the chunk whose values fit in KEY_CHUNK_BYTES, at least one
+        """
+        size = 0
+        for i, (key, value) in enumerate(chunk):
+            size += len(value) if isinstance(value, (str, bytes)) else sys.getsizeof(value)
+            if size > self.KEY_CHUNK_BYTES and i:
+                return chunk[:i]
+        return chunk
         
     def search(self, k):
         """ 
-        Search for the value of a key in the cache and then in the own_data storage
+        Search for the value of a key in the own_data storage and then in the cache
         :param k: The key to search
         :return: The value of the key or None if not exists
         """
-        data = self.cache.get_key(k)
-        return data if data else self.own_data.get_key(k)
+        data = self.own_data.get_key(k)
+        if data is None:
+            entry = self.cache.get_key(k)
+            data = entry[0] if entry else None
+        return data
     
 
     def interval(self, a, k, b, equal):
@@ -265,7 +779,7 @@ class ChordNode(Node):
         :param equal: Boolean used to check if 'k' is in (a,b]
         :return: True if 'k' is in (a,b) / (a,b], False otherwise
         """
-        max_nodes = self.mbits**2
+        max_nodes = 2**self.mbits
         a = a % max_nodes
         k = k % max_nodes
         b = b % max_nodes
@@ -275,7 +789,7 @@ class ChordNode(Node):
         else: # a > b
             return not ( k <= a and (k > b if equal else k >= b))
 
-    def _set_data(self, data):
+    def _set_data_steps(self, data):
         """
         Set a (key,value) in the node data storage only if the node id is the successor of the key
         otherwise searches for the successor of the key and send a request message with the data to be saved
@@ -286,19 +800,22 @@ class ChordNode(Node):
             key   = data['key'] % 2**self.mbits
             value = data['value']
             set_response = GetSetResponse(key, value)
-            print(f"data: {data}")
+            self.cache.invalidate(key)
             
             if self.predecessor and self.interval(self.predecessor.id, key, self.id, True):
                 # data key in (pred, n]
                 self.own_data.set_key_value(key, value)
+                self._data_changed()
                 set_response.success = True
                 set_response.node_reached = self.id
+                set_response.version = self.own_data.version
+                self._invalidate_pushed([key])
             else:
-                successor = self.find_successor(key)
+                successor, request_response = yield from self._send_to_owner_steps(Type.SET_DATA, key, data)
                 if successor:
-                    request_response = self.send_request(Type.SET_DATA, key, successor, data)
                     if request_response:
                         set_response.update(request_response)
+                        self._learn_path(key, successor, set_response)
                 else:
                     set_response.success = False
                     set_response.error = "Successor not found"
@@ -312,28 +829,54 @@ class ChordNode(Node):
             set_response.error = "Error _set_data exception"
             return vars(set_response)
 
-    def get(self, k):
+    def get(self, k, read = None):
+        return self._run_steps(self._get_steps(k, read))
+
+    def _get_steps(self, k, read = None):
         """ 
         Searches for the value of a key in the node data storages 
         If the key does not exists and the current node id it's not his successor 
         sends a request message to the successor node of the key asking for his value
+        Unless the read asks for owner consistency, the replicated data also answers the keys of the predecessor
+        and the cache answers the keys of other nodes, they answer as a replica with the version of their copy
         :param k: The key to search
+        :param read: A dict object with the 'consistency' of the read and the minimum 'version' of the owner data,
+                     the 'path' of nodes that forwarded the request, and the 'owner' of the key when the request
+                     is sent to its replica. The node consistency by default
         :return: A GetSetResponse object with the status of the operation 
         """
+        read = read or {}
+        consistency = read.get('consistency') or self.read_consistency
         get_response = GetSetResponse(k)
-        data = self.search(k)
-        if (data or self.id == k or (self.predecessor and self.interval(self.predecessor.id, k, self.id, True))):
+        local = self.id == k or self._is_local_key(k)
+        copy = None if local else (self._replica_read(k, consistency, read.get('version')) or
+                                   self._cached_read(k, consistency, read.get('version')))
+        if local:
+            version = self.own_data.version # Read before the value, a copy is never newer than its version
+            data = self.own_data.get_key(k)
             get_response.payload = data
             get_response.node_reached = self.id
+            get_response.version = version
+            get_response.success = True
+            self._track_hot_key(k, data, version, consistency, read.get('path'))
+        elif copy:
+            get_response.payload, get_response.version = copy
+            get_response.node_reached = self.id
+            get_response.replica = True
             get_response.success = True
         else:
-            successor_k = self.find_successor(k)
-            if successor_k:       
-                request_response = self.send_request(Type.GET_DATA, k, successor_k)
+            owner = read.get('owner')
+            if owner:
+                # Sent to this node as the replica of the key, its copy can not answer so the owner is asked
+                self._learn_location(k, Node(owner['id'], owner['host'], owner['port']))
+                consistency = Consistency.OWNER
+            successor_k, request_response = yield from self._read_remote_steps(k, self._forward_read(read, consistency))
+            if successor_k:
                 if request_response:
                     get_response.update(request_response)
+                    self._learn_path(k, successor_k, get_response)
                     if get_response.success and get_response.payload:
-                        self.cache.set_key_value(get_response.key, get_response.payload)
+                        self.cache.set_key_value(get_response.key, (get_response.payload, get_response.version))
                     
             else:
                 get_response.success = False
@@ -343,64 +886,569 @@ class ChordNode(Node):
         get_response.nodes_visited.insert(0, vars(node))
         return vars(get_response)
 
+    def _replica_read(self, k, consistency, version = None):
+        """
+        Reads a key of the predecessor from the replicated data, if the consistency of the read allows it
+        The replica must come from the current predecessor, and with NEAREST consistency it must have the version
+        :return: A tuple (value, version of the replica), or None if the replica can not answer
+        """
+        source = self.replica_source
+        if not source or not self.predecessor or source[0] != self.predecessor.id:
+            return None
+        if not self._copy_answers(consistency, source[1], version):
+            return None
+        value = self.replicated_data.get_key(k)
+        if value is None:
+            return None
+        self.metrics.inc("replica_reads_total")
+        return value, source[1]
+
+    def _cached_read(self, k, consistency, version = None):
+        """
+        Reads a key of other node from the cache, a copy of a GET response or pushed by the owner of a hot key
+        The copy answers as a replica does, if the consistency of the read allows it
+        :return: A tuple (value, version of the owner data the copy was read at), or None if the cache can not answer
+        """
+        entry = self.cache.get_key(k)
+        if entry is None or not self._copy_answers(consistency, entry[1], version):
+            return None
+        self.metrics.inc("cache_reads_total")
+        return entry
+
+    @staticmethod
+    def _copy_answers(consistency, copy_version, version):
+        """
+        :return: True if a copy of the owner data at 'copy_version' can answer a read, never with OWNER consistency
+                 and with NEAREST only if it has the version requested
+        """
+        if consistency == Consistency.OWNER:
+            return False
+        return consistency != Consistency.NEAREST or version is None or (copy_version is not None and
+                                                                          copy_version >= version)
+
+    def _replica_of(self, owner):
+        """
+        :return: The Node object that keeps the replica of the data of a node, its successor,
+                 or None if it is not in the successor list
+        """
+        for previous, following in zip(self.successor_list, self.successor_list[1:]):
+            if previous.id == owner.id:
+                return following if following.id != self.id else None
+        return None
 
-    def find_successor(self, k):
+    def _read_target(self, owner, consistency):
+        """
+        Chooses whether a GET is sent to the replica of the owner of the key instead of the owner
+        ANY chooses one of them at random to spread the load, NEAREST the one with the lowest round trip time
+        :return: The Node object of the replica, or None if the GET is sent to the owner
+        """
+        replica = self._replica_of(owner) if consistency != Consistency.OWNER else None
+        if not replica:
+            return None
+        if consistency == Consistency.ANY:
+            return replica if random.random() < 0.5 else None
+        owner_rtt, replica_rtt = self.latencies.rtt(owner.id), self.latencies.rtt(replica.id)
+        if replica_rtt is not None and (owner_rtt is None or replica_rtt < owner_rtt):
+            return replica
+        return None
+
+    def _forward_read(self, read, consistency):
+        """
+        :return: The read dict object sent with a GET forwarded by this node, this node is added to the path
+        """
+        path = (read.get('path') or []) + [{"id": self.id, "host": self.host, "port": self.port}]
+        return {"consistency": consistency, "version": read.get('version'), "path": path}
+
+    def _read_remote_steps(self, k, read):
+        """
+        Sends a GET to the owner of a key or to its replica, depending on the consistency of the read
+        The replica is told the owner, so it forwards the request at once if its copy can not answer
+        :param read: The read dict object sent with the GET
+        :return: A tuple (owner, response), the owner is None if it was not found
+        """
+        if read['consistency'] == Consistency.OWNER:
+            return (yield from self._send_to_owner_steps(Type.GET_DATA, k, read))
+        owner = yield from self._find_successor_steps(k)
+        if not owner:
+            return None, None
+        replica = self._read_target(owner, read['consistency'])
+        if replica:
+            owner_address = {"id": owner.id, "host": owner.host, "port": owner.port}
+            response = yield Send(Type.GET_DATA, k, replica, dict(read, owner=owner_address))
+            if response is not None:
+                return owner, response
+        return (yield from self._send_to_owner_steps(Type.GET_DATA, k, read))
+
+    def _track_hot_key(self, k, value, version, consistency, path):
+        """
+        Counts a GET answered by this node as the owner of the key
+        Once the key is hot its value is pushed to the cache of the nodes that forwarded the request,
+        so they answer the next requests for the key without reaching this node
+        :param version: The version of the own data read before the value, the value is not pushed
+                        if the key has changed since. The copies answer with this version
+        :param consistency: The consistency of the read, the value is not pushed for OWNER reads as
+                            only the owner answers them
+        :param path: A list with the nodes that forwarded the request as dicts, None if it came from a client
+        """
+        if value is None or not self._is_local_key(k) or not self.hot_keys.record(k) or not path:
+            return
+        if consistency == Consistency.OWNER:
+            return
+        nodes = [Node(n['id'], n['host'], n['port']) for n in path if n['id'] != self.id]
+        for node in self.hot_keys.new_holders(k, nodes, version):
+            self.send_request_future(Type.CACHE_PUSH, k, node, {"key": k, "value": value, "version": version,
+                                                                "ttl": self.hot_keys.ttl})
+
+    def _invalidate_pushed(self, keys):
+        """
+        Removes the copies of the keys pushed to other nodes, used when the keys change
+        Every node receives a single CACHE_INVALIDATE with its keys, the responses are not waited
+        """
+        nodes = dict()
+        version = self.own_data.version
+        for key in keys:
+            for node in self.hot_keys.pop_holders(key, version):
+                nodes.setdefault(node.id, (node, []))[1].append(key)
+        for node, node_keys in nodes.values():
+            self.send_request_future(Type.CACHE_INVALIDATE, None, node, {"keys": node_keys})
+
+    def _send_to_owner_steps(self, type, k, data = None):
+        """
+        Sends a GET or SET request to the successor of a key, found in the location cache or by a lookup
+        If the successor does not answer its location is invalidated and the key is looked up again
+        :return: A tuple (successor, response), the successor is None if it was not found
+        """
+        successor_k = yield from self._find_successor_steps(k)
+        if not successor_k:
+            return None, None
+        response = yield Send(type, k, successor_k, data)
+        if response is None and self.locations.invalidate(successor_k.id):
+            successor_k = yield from self._find_successor_steps(k, cached=False)
+            response = (yield Send(type, k, successor_k, data)) if successor_k else None
+        return successor_k, response
+
+    def _learn_location(self, k, node):
+        """
+        Caches a node as the successor of a key, unless it is this node or this node lies between them
+        """
+        if node and node.id != self.id and not self.interval(k - 1, self.id, node.id, False):
+            self.locations.learn(k, node)
+
+    def _learn_path(self, k, contacted, response):
+        """
+        Caches the locations of the nodes visited by a GET or SET request sent to other node
+        The node reached owns the key, the other visited nodes own at least their own id
+        If the contacted node forwarded the request it does not own the key, its location is invalidated
+        :param contacted: The Node object the request was sent to
+        :param response: The GetSetResponse object received
+        """
+        if not response.success or response.node_reached is None:
+            return
+        if response.node_reached != contacted.id and not response.replica:
+            self.locations.invalidate(contacted.id)
+        for n in response.nodes_visited:
+            key = k if n['id'] == response.node_reached and not response.replica else n['id']
+            self._learn_location(key, Node(n['id'], n['host'], n['port']))
+
+
+    def _is_local_key(self, k):
+        """
+        :return: True if the key is in (pred, n], so this node is responsible for it
+        """
+        return bool(self.predecessor and self.interval(self.predecessor.id, k, self.id, True))
+
+    def _group_keys_steps(self, keys):
+        """
+        Groups keys by the node responsible for them
+        The keys are visited in ring order from this node, so the successor is searched once per group:
+        every key between a key and its successor belongs to the same node
+        :param keys: A list of keys
+        :return: A tuple (local, groups, unresolved) with the keys of this node, a dict of
+                 owner id -> (owner Node, keys) and the keys whose successor was not found
+        """
+        local, groups, unresolved = [], dict(), []
+        owner = None
+        for key in sorted(keys, key=lambda key: self._distance(self.id, key)):
+            if self._is_local_key(key):
+                local.append(key)
+                continue
+            if not owner or not self.interval(self.id, key, owner.id, True):
+                owner = yield from self._find_successor_steps(key)
+            if not owner:
+                unresolved.append(key)
+            elif owner.id == self.id:
+                local.append(key)
+            else:
+                groups.setdefault(owner.id, (owner, []))[1].append(key)
+        return local, groups, unresolved
+
+    def _batch_result(self, key, success, payload = None, error = ''):
+        """
+        :return: The result of a key of a GET_MANY or SET_MANY request, a GetSetResponse object as a dict
+        """
+        result = GetSetResponse(key, payload)
+        result.success = success
+        result.error = error
+        result.node_reached = self.id if success else None
+        return vars(result)
+
+    def _batch_results(self, keys, response, owner):
+        """
+        Obtains the results of the keys sent in a batch to other node
+        :param response: The GET_MANY or SET_MANY response, None if the node did not answer
+        :return: A dict of key -> result, every key fails if there is no response
+        """
+        if response is None:
+            self.locations.invalidate(owner.id)
+        results = {result['key']: result for result in response} if response is not None else dict()
+        error = f"Node {owner.id} did not answer"
+        return {key: results.get(key) or self._batch_result(key, False, error=error) for key in keys}
+
+    def _split_cached_keys(self, keys):
+        """
+        Answers the keys of a GET_MANY request owned by this node or, for the keys of other nodes, found in the cache
+        A cached key answers as a replica with the version of its copy
+        :return: A tuple (results, remote) with a dict of key -> result and the keys not answered
+        """
+        results, remote = dict(), []
+        version = self.own_data.version
+        for key, data in self.own_data.get_keys(keys).items():
+            if self.id == key or self._is_local_key(key):
+                results[key] = self._batch_result(key, True, data)
+                results[key]['version'] = version
+                continue
+            entry = self.cache.get_key(key)
+            if entry:
+                results[key] = self._batch_result(key, True, entry[0])
+                results[key].update(version=entry[1], replica=True)
+            else:
+                remote.append(key)
+        return results, remote
+
+    def _store_keys(self, data, keys):
+        """
+        Saves the keys of a SET_MANY request owned by this node
+        :param data: A dict of key -> value
+        :return: A dict of key -> result
+        """
+        for key in keys:
+            self.cache.invalidate(key)
+        self.own_data.update_store_data({key: data[key] for key in keys})
+        if keys:
+            self._data_changed()
+            self._invalidate_pushed(keys)
+        return {key: self._batch_result(key, True, data[key]) for key in keys}
+
+    def _get_many_steps(self, keys):
+        """
+        Searches for the values of several keys, the keys of other nodes are grouped by successor
+        and every group is requested in a single GET_MANY message, the groups are requested at once
+        :param keys: A list of keys
+        :return: A list with a GetSetResponse object as a dict per key, in the order of the keys
+        """
+        keys = list(dict.fromkeys(key % 2**self.mbits for key in keys))
+        results, remote = self._split_cached_keys(keys)
+        local, groups, unresolved = yield from self._group_keys_steps(remote)
+        results.update({key: self._batch_result(key, True, value) for key, value in self.own_data.get_keys(local).items()})
+        groups = list(groups.values())
+        responses = yield Gather(Send(Type.GET_MANY, None, owner, {"keys": owner_keys}) for owner, owner_keys in groups)
+        for (owner, owner_keys), response in zip(groups, responses):
+            for key, result in self._batch_results(owner_keys, response, owner).items():
+                if result['success'] and result['payload']:
+                    self.cache.set_key_value(key, (result['payload'], result.get('version')))
+                results[key] = result
+        for key in unresolved:
+            results[key] = self._batch_result(key, False, error="Successor not found")
+        return [results[key] for key in keys]
+
+    def _set_many_steps(self, items):
+        """
+        Sets several (key, value) pairs, the keys of other nodes are grouped by successor
+        and every group is sent in a single SET_MANY message, the groups are sent at once
+        :param items: A list of (key, value) pairs, the last value of a repeated key is saved
+        :return: A list with a GetSetResponse object as a dict per key, in the order of the keys
+        """
+        data = {key % 2**self.mbits: value for key, value in items}
+        local, groups, unresolved = yield from self._group_keys_steps(list(data))
+        results = self._store_keys(data, local)
+        groups = list(groups.values())
+        for owner, owner_keys in groups:
+            for key in owner_keys:
+                self.cache.invalidate(key)
+        responses = yield Gather(Send(Type.SET_MANY, None, owner, {"items": [[key, data[key]] for key in owner_keys]})
+                                 for owner, owner_keys in groups)
+        for (owner, owner_keys), response in zip(groups, responses):
+            results.update(self._batch_results(owner_keys, response, owner))
+        for key in unresolved:
+            results[key] = self._batch_result(key, False, error="Successor not found")
+        return [results[key] for key in data]
+
+    def find_successor(self, k, cached = True):
+        return self._run_steps(self._find_successor_steps(k, cached))
+
+    def _find_successor_steps(self, k, cached = True):
         """ 
         Searches for the successor of a key
+        The location cache is checked before routing the lookup, and the successor found is cached
         :param k: The key used in the search
+        :param cached: A boolean used to skip the location cache, set when its entry has failed
         :return: A Node object representing the successor of the key, None otherwise
         """
         try:
-            if(self.interval(self.id, k, self.successor.id, True)):
-                return self.successor
+            successor_k = self._successor_shortcut(k) or self._sibling_owner(k)
+            if not successor_k and cached:
+                successor_k = self.locations.lookup(k)
+            if successor_k:
+                return successor_k
+            elif self.lookup_iterative:
+                successor_k = yield from self._find_successor_iterative_steps(k)
+                self._learn_location(k, successor_k)
+                return successor_k
             else:
                 cpn = self.closest_precedent_node(k)
-                successor_k = self.send_request(Type.FIND_SUCCESSOR, k, cpn)
+                successor_k = yield Send(Type.FIND_SUCCESSOR, k, cpn)
+                if not successor_k and cpn.id != self.successor.id:
+                    # The finger may have failed and not been refreshed yet, the successor is checked by stabilize
+                    successor_k = yield Send(Type.FIND_SUCCESSOR, k, self.successor)
                 if successor_k:
                     successor_k = Node(successor_k['id'], successor_k['host'], successor_k['port'])  
+                    self._learn_location(k, successor_k)
                 return successor_k   
         except Exception as e:
             logger.exception(" ERROR find_successor")
                                 
         
+    def _successor_shortcut(self, k):
+        """
+        Resolves the successor of a key without contacting other nodes if it is in the successor list
+        :return: The Node object successor of the key, None if the key is beyond the successor list
+        """
+        if(self.interval(self.id, k, self.successor.id, True)):
+            return self.successor
+        for previous, following in zip(self.successor_list, self.successor_list[1:]):
+            if self.interval(previous.id, k, following.id, True):
+                return following
+        return None
+
     def closest_precedent_node(self, k):
-        for i in range(self.mbits-1, -1, -1):
-            if (self.finger_table[i] and self.interval(self.id, self.finger_table[i].id, k, False)):
-                return self.finger_table[i]
-                        
-        return self
+        """
+        Searches the finger, successor or successor list entry that most closely precedes a key
+        With proximity routing a nearer node that makes almost the same progress may be chosen instead
+        :param k: The key used in the search
+        :return: The closest preceding Node, or this node if there is none
+        """
+        closest = None
+        candidates = []
+        for finger in self.finger_table.distinct_nodes():
+            if self.interval(self.id, finger.id, k, False):
+                closest = closest or finger
+                candidates.append(finger)
+
+        for node in [self.successor] + self.successor_list:
+            if self.interval(self.id, node.id, k, False):
+                candidates.append(node)
+                if not closest or self.interval(closest.id, node.id, k, False):
+                    closest = node
+
+        if not closest:
+            return self
+        if self.proximity_routing:
+            return self._proximity_choice(k, closest, candidates)
+        return closest
+
+    def _proximity_choice(self, k, closest, candidates):
+        """
+        Chooses the candidate with the lowest estimated cost: its round trip time plus the mean round trip time
+        of the extra hops. Every hop halves at least the distance to the key, so a candidate whose distance to the key
+        is r times the one of the closest node costs about log2(r) extra hops
+        :param closest: The preceding node closest to the key
+        :param candidates: The preceding nodes, only those close enough to the key are considered
+        :return: The Node chosen, the closest one if no node has been measured
+        """
+        mean = self.latencies.mean()
+        if mean is None:
+            return closest
+        closest_distance = self._distance(closest.id, k)
+        best, best_cost = closest, None
+        for node in candidates:
+            distance = self._distance(node.id, k)
+            if distance > closest_distance * self.PROXIMITY_PROGRESS:
+                continue
+            rtt = self.latencies.rtt(node.id)
+            cost = (mean if rtt is None else rtt) + mean * math.log2(distance / closest_distance)
+            if best_cost is None or cost < best_cost:
+                best, best_cost = node, cost
+        return best
+
+    def _closest_preceding_nodes(self, k, count):
+        """
+        Searches the fingers and successor list entries that precede a key
+        :param k: The key used in the search
+        :param count: The maximum number of nodes returned
+        :return: A list of Node objects, the closest to the key first
+        """
+        nodes = dict()
+        for node in self.finger_table.distinct_nodes() + [self.successor] + self.successor_list:
+            if node.id not in nodes and self.interval(self.id, node.id, k, False):
+                nodes[node.id] = Node(node.id, node.host, node.port)
+        return sorted(nodes.values(), key=lambda node: self._distance(node.id, k))[:count]
+
+    def _distance(self, a, b):
+        """
+        :return: The clockwise distance from 'a' to 'b' in the ring
+        """
+        return (b - a) % 2**self.mbits
+
+    def _closest_preceding_state(self, k, count):
+        """
+        Answers a GET_CPF request, a hop of an iterative lookup
+        :param k: The key searched
+        :param count: The maximum number of preceding nodes returned
+        :return: A dict object with the successor of the key if this node knows it,
+                 otherwise with the nodes that precede the key, the closest first
+        """
+        successor = self._successor_shortcut(k) or self._sibling_owner(k)
+        nodes = [] if successor else self._closest_preceding_nodes(k, count)
+        if not successor and not nodes:
+            # No known node is closer to the key, so it belongs to the successor
+            successor = self.successor
+        return {"successor": {"id": successor.id, "host": successor.host, "port": successor.port} if successor else None,
+                "nodes": [{"id": n.id, "host": n.host, "port": n.port} for n in nodes]}
+
+    def _next_probes(self, k, candidates, visited):
+        """
+        Selects the next nodes asked by an iterative lookup and marks them as visited
+        :param candidates: A dict object with the Node objects known to precede the key
+        :param visited: A set with the ids of the nodes already asked
+        :return: The lookup_parallelism closest candidates not asked yet
+        """
+        pending = [node for node in candidates.values() if node.id not in visited]
+        probes = sorted(pending, key=lambda node: self._distance(node.id, k))[:self.lookup_parallelism]
+        visited.update(node.id for node in probes)
+        return probes
+
+    def _merge_probe(self, state, candidates):
+        """
+        Adds the nodes returned by a GET_CPF request to the candidates of the lookup
+        :param state: The GET_CPF response, None if the node did not answer
+        :return: The Node object successor of the key if the node knew it, None otherwise
+        """
+        if not state:
+            return None
+        if state['successor']:
+            successor = state['successor']
+            return Node(successor['id'], successor['host'], successor['port'])
+        for n in state['nodes']:
+            candidates.setdefault(n['id'], Node(n['id'], n['host'], n['port']))
+        return None
+
+    def _find_successor_iterative_steps(self, k):
+        """
+        Searches for the successor of a key asking every hop for its closest preceding nodes,
+        instead of forwarding the request. The closest candidates are asked in parallel with
+        a timeout per hop, a node that does not answer is skipped in favour of the next candidate
+        :param k: The key used in the search
+        :return: A Node object representing the successor of the key, None otherwise
+        """
+        candidates = {n.id: n for n in self._closest_preceding_nodes(k, self.lookup_parallelism)}
+        visited = {self.id}
+        data = {"count": self.lookup_parallelism}
+        probes = self._next_probes(k, candidates, visited)
+        while probes:
+            successor_k = yield FirstOf((Send(Type.GET_CPF, k, node, data, self.LOOKUP_HOP_TIMEOUT) for node in probes),
+                                        lambda state: self._merge_probe(state, candidates))
+            if successor_k:
+                return successor_k
+            probes = self._next_probes(k, candidates, visited)
+        return None
 
 
     def create(self):
         self.predecessor = None
-        self.successor = self.finger_table[0]
+        self.successor = FingerNode(self.id, self.host, self.port)
 
 
-    def _ask_keys(self):
+    def _ask_keys_steps(self):
         """ 
         Tries to get the keys corresponding to the node when it joins to a chord network 
-        Sends a request message to the successor node with his predecessor node id and his own id
-        :return: True if the request has been successful, False otherwise
+        Requests the keys to the successor node chunk by chunk, from his predecessor node id to his own id
+        A failed chunk is requested again from the last key received
+        :return: True if the transfer has been completed, False otherwise
         """
-        MAX_TRIES = 10
         TRY_TIME = 1
-        for i in range(MAX_TRIES):
-            print(f"Node :{self.id} - Pred: {self.predecessor.id if self.predecessor else None} Asking for keys to successor node: {self.successor.id} - Try: {i+1}/{MAX_TRIES}")
-            if (self.predecessor and (self.predecessor.id != self.id)):
-                keys = self.send_request(Type.GET_KEYS, self.id, self.successor,
-                                        {"start": self.predecessor.id + 1, "end": self.id})
-                # Clear keys if they don't belong to the node
-                for key,value in self.own_data.get_store().copy().items():
-                    if (not self.interval(self.predecessor.id, key, self.id, True)):
-                        data_k = self.own_data.get_store().pop(key)
-                        
-                self.own_data.update_store_data(ast.literal_eval(keys))
-                return True    
-            time.sleep(TRY_TIME)
+        tries = 0
+        request = None
+        while tries < self.KEY_TRANSFER_TRIES:
+            logger.debug(f"Node :{self.id} - Pred: {self.predecessor.id if self.predecessor else None} Asking for keys to successor node: {self.successor.id} - Try: {tries+1}/{self.KEY_TRANSFER_TRIES}")
+            if not (self.predecessor and (self.predecessor.id != self.id)):
+                tries += 1
+                yield Sleep(TRY_TIME)
+                continue
+            request = request or self._keys_request()
+            chunk = yield Send(Type.GET_KEYS, self.id, self.successor, request)
+            if chunk is None:
+                tries += 1
+                yield Sleep(TRY_TIME)
+                continue
+            if self._apply_keys_chunk(request, chunk):
+                return True
         return False
 
+    def _keys_request(self):
+        """
+        Builds the first GET_KEYS request of a joining node, the keys that do not belong to the node are cleared first
+        If the node kept keys of its range from a previous run, the digests of its buckets are sent
+        :return: A dict object with the range of the requested keys and the chunk size
+        """
+        self.own_data.pop_range(self.id, self.predecessor.id)
+        request = {"start": self.predecessor.id + 1, "end": self.id, "limit": self.KEY_CHUNK_SIZE}
+        if self.own_data.keys:
+            request["digests"] = self._range_digests(self.own_data.scan_range(self.predecessor.id, self.id,
+                                                                              self.KEY_CHUNK_SIZE),
+                                                     self.predecessor.id, self.id)
+        return request
+
+    def _apply_keys_chunk(self, request, chunk):
+        """
+        Stores a chunk of keys received from the successor and prepares the request of the next one
+        The keys kept from a previous run are only replaced by the values received, the successor does not send
+        the keys it does not have so a kept key is never removed
+        :param request: The GET_KEYS request, it is updated to resume after the last key received
+        :param chunk: The GET_KEYS response
+        :return: True if the transfer is done, False otherwise
+        """
+        if 'buckets' in chunk:
+            request.pop('digests', None)
+            request['buckets'] = chunk['buckets']
+        if chunk['items']:
+            self.own_data.update_store_data(dict(chunk['items']))
+        request['after'] = chunk['last']
+        return chunk['done']
+
+    def _digest_bucket(self, key, start, end):
+        """
+        :return: The bucket of a key of the ring interval (start, end], the interval is split in KEY_DIGEST_BUCKETS
+        """
+        size = (end - start) % 2**self.mbits or 2**self.mbits
+        return ((key - start - 1) % 2**self.mbits) * self.KEY_DIGEST_BUCKETS // size
+
+    def _range_digests(self, items, start, end):
+        """
+        Summarizes the (key, value) pairs of the ring interval (start, end]
+        :param items: An iterable of the pairs, consumed once so it can be read from the storage a chunk at a time
+        :return: A list with the xor of the hashes of the pairs of every bucket
+        """
+        digests = [0] * self.KEY_DIGEST_BUCKETS
+        for key, value in items:
+            pair = repr((key, value)).encode('utf-8')
+            digests[self._digest_bucket(key, start, end)] ^= int.from_bytes(hashlib.blake2b(pair, digest_size=8).digest(), 'big')
+        return digests
+
     
     def join(self, p):
+        return self._run_steps(self._join_steps(p))
+
+    def _join_steps(self, p):
         """ 
         Sends a request message to a node asking for his successor and proceed to update it
         Performs the search of the keys that belong to the node
@@ -410,33 +1458,107 @@ class ChordNode(Node):
         try:
             self.predecessor = None
             success = False
-            response = self.send_request(Type.FIND_SUCCESSOR, self.id, p)
+            response = yield Send(Type.FIND_SUCCESSOR, self.id, p)
+            if response and response['id'] == self.id and p.id != self.id:
+                # A node that restarts quickly is still in the ring, its successor is the successor of the next key
+                response = yield Send(Type.FIND_SUCCESSOR, (self.id + 1) % 2**self.mbits, p)
             logger.info(f"Response: {response}")
             if response:
                 self.successor.update(response)
-                success = self._ask_keys()
+                self._topology_changed()
+                success = yield from self._ask_keys_steps()
             return success
         except Exception as e:
             logger.exception(f" ERROR join")
         
     
     def stabilize(self):
+        return self._run_steps(self._stabilize_steps())
+
+    def _stabilize_steps(self):
         """ 
-        Verifies if his successor node has changed and proceed to update it
+        Verifies if his successor node has changed and proceed to update it and the successor list
         Sends a notify message to his successor node for update his predecessor with this node
+        :return: True if the successor or the successor list has changed, False otherwise
         """
-        x = self.send_request(Type.GET_PREDECESSOR, self.successor.id, self.successor)
+        successor_id = self.successor.id
+        successor_ids = [node.id for node in self.successor_list]
+        state = yield Send(Type.GET_SUCCESSOR_LIST, self.successor.id, self.successor)
+        if successor_id != self.successor.id:
+            # The successor was updated by a join while waiting the response
+            return False
 
+        # Successor has failed, replace with the first live entry in its successor list
+        if state is None:
+            state = yield from self._promote_successor_steps()
+
+        self._apply_successor_state(state)
+
+        # The notify response is not needed, it is not waited
+        self.send_request_future(Type.NOTIFY, self.id, self.successor,
+                                 {"id": self.id, "host": self.host, "port": self.port})
+        return successor_id != self.successor.id or successor_ids != [node.id for node in self.successor_list]
+
+    def _successor_state(self):
+        """
+        :return: A dict object with the predecessor and the successor list of this node, requested by GET_SUCCESSOR_LIST
+        """
+        successors = self.successor_list or [self.successor]
+        return {"predecessor": vars(self.predecessor) if self.predecessor else None,
+                "successors": [{"id": n.id, "host": n.host, "port": n.port} for n in successors]}
+
+    def _apply_successor_state(self, state):
+        """
+        Updates the successor with the predecessor of the successor if it is closer,
+        and rebuilds the successor list from the successor list of the successor
+        :param state: The GET_SUCCESSOR_LIST response of the successor, None if no successor answered
+        """
+        if not state:
+            return
+        successors = state['successors']
+        x = state['predecessor']
         if ( x and self.interval(self.id, x['id'], self.successor.id, False)):
+            # A copy, the successor is updated in place
+            successors = [{"id": self.successor.id, "host": self.successor.host, "port": self.successor.port}] + successors
             self.successor.update(x)
 
-        # Successor has failed, replace with the first live entry in its successor list
-        # Or predecessor its None...
-        if (not x):
-            self.successor.update(vars(self))
+        successor_list = [Node(self.successor.id, self.successor.host, self.successor.port)]
+        for n in successors:
+            # The list wraps around the ring when there are few nodes
+            if len(successor_list) >= self.SUCCESSOR_LIST_SIZE or n['id'] == self.id:
+                break
+            if n['id'] != successor_list[-1].id:
+                successor_list.append(Node(n['id'], n['host'], n['port']))
+        self.successor_list = successor_list
+
+    def _promote_successor_steps(self):
+        """
+        Replaces a failed successor with the next live entry of the successor list
+        If every entry has failed the node becomes his own successor
+        :return: The GET_SUCCESSOR_LIST response of the new successor, None if no entry answered
+        """
+        failed_id = self.successor.id
+        for node in self.successor_list[1:]:
+            if node.id == failed_id or node.id == self.id:
+                continue
+            state = yield Send(Type.GET_SUCCESSOR_LIST, node.id, node)
+            if state is not None:
+                self.successor.update(vars(node))
+                return state
+
+        self.successor.update(vars(self))
+        self.successor_list = []
+        return None
 
-        self.send_request(Type.NOTIFY, self.id, self.successor,
-                        {"id": self.id, "host": self.host, "port": self.port})
+    def _failover_successor_steps(self):
+        """
+        Verifies the successor after a failed request and promotes the next entry of the successor list if it is down
+        :return: True if the successor has been replaced, False otherwise
+        """
+        if (yield Send(Type.CHECK_STATUS, self.id, self.successor)):
+            return False
+        self._apply_successor_state((yield from self._promote_successor_steps()))
+        return True
 
 
     def notify(self, n):
@@ -446,60 +1568,272 @@ class ChordNode(Node):
         Before the update, verifies whose keys in replicated data should be stored in own data
         :param n: The node who sends the notification
         """
+        if n and n['id'] != self.id:
+            self._learn_location(n['id'], Node(n['id'], n['host'], n['port']))
         if (n and self.predecessor == None or self.interval(self.predecessor.id, n['id'], self.id, False)):
             # Predecessor update, first move replicated_data to own_data
-            self._get_keys_in_interval(n['id'], self.id, self.replicated_data.get_store(), self.own_data.get_store(), True)
+            self._get_keys_in_interval(n['id'], self.id, self.replicated_data, self.own_data, True)
         
             # Update predecessor
             self.predecessor = Node(n['id'], n['host'], n['port'])
+            self._topology_changed()
                 
     
     def fix_fingers(self):
+        return self._run_steps(self._fix_fingers_steps())
+
+    def _fix_fingers_steps(self):
         """ 
         Updates the fingers nodes with his actuals successors
+        In bulk mode the whole table is refreshed, otherwise a single level
+        :return: True if a finger has changed, False otherwise
         """
+        if self.bulk_finger_refresh:
+            return (yield from self._refresh_fingers_steps())
+
         self.next = (self.next + 1) % self.mbits
-        level = (self.id + 2**self.next) % 2**self.mbits
-        finger = self.find_successor(level)
+        finger = yield from self._find_successor_steps(self.finger_table.start(self.next), cached=False)
         if finger:
-            self.finger_table[self.next].update(vars(finger))
-            self.finger_table[self.next].level = level
-            
-    
+            return self.finger_table.set_range(self.next, self.next, finger)
+        return False
+
+    def _refresh_fingers_steps(self):
+        """
+        Refreshes the whole finger table in rounds of concurrent lookups
+        Every round looks up the first level of the ranges not resolved yet, the following levels
+        that start before the successor found point to the same node and are filled without a lookup
+        The first levels of the current entries are looked up in the first round, so a stable ring needs a single round
+        :return: True if a finger has changed, False otherwise
+        """
+        resolved = [None] * self.mbits
+        pending = self._first_refresh_levels()
+        for _ in range(self.FINGER_REFRESH_ROUNDS):
+            if not pending:
+                break
+            successors = yield Gather(self._find_successor_steps(self.finger_table.start(level), cached=False)
+                                      for level in pending)
+            for level, successor in zip(pending, successors):
+                self._resolve_levels(resolved, level, successor)
+            pending = self._unresolved_levels(resolved)
+        return self._apply_fingers(resolved)
+
+    def _first_refresh_levels(self):
+        """
+        :return: The levels looked up in the first round of a refresh, sorted
+        """
+        levels = {first for first, _, _ in self.finger_table.entries()}
+        levels.update(range(max(0, self.mbits - self.FINGER_REFRESH_PROBES), self.mbits))
+        return sorted(levels)
+
+    def _resolve_levels(self, resolved, level, successor):
+        """
+        Fills the level and the following levels whose start is in (n, successor]
+        A level whose lookup failed is marked as False, it keeps its current finger
+        """
+        if not successor:
+            resolved[level] = False
+            return
+        i = level
+        while i < self.mbits and resolved[i] is None and (
+                i == level or self.interval(self.id, self.finger_table.start(i), successor.id, True)):
+            resolved[i] = successor
+            i += 1
+
+    def _unresolved_levels(self, resolved):
+        """
+        :return: The first level of every range of levels not resolved yet
+        """
+        return [i for i in range(self.mbits) if resolved[i] is None and (i == 0 or resolved[i - 1] is not None)]
+
+    def _apply_fingers(self, resolved):
+        """
+        Stores the resolved levels in the finger table
+        :return: True if a finger has changed, False otherwise
+        """
+        changed = False
+        first = 0
+        for i in range(1, self.mbits + 1):
+            if i == self.mbits or not resolved[i] or not resolved[first] or resolved[i].id != resolved[first].id:
+                if resolved[first]:
+                    changed = self.finger_table.set_range(first, i - 1, resolved[first]) or changed
+                first = i
+        return changed
+
     def print_fingers(self):
-        for i, f in enumerate(self.finger_table):
-            print(i, vars(f) if f else None)
+        for first, last, f in self.finger_table.entries():
+            print(f"{first}-{last}", vars(f))
 
 
     def check_predecessor(self):
+        return self._run_steps(self._check_predecessor_steps())
+
+    def _check_predecessor_steps(self):
         """
         Verifies that the predecessor nodo has not failed, sets it to None if its has fail
+        :return: True if the predecessor has failed, False otherwise
         """
         if self.predecessor:
-            predecessor_status = self.send_request(Type.CHECK_STATUS, self.id, self.predecessor)                                  
+            predecessor_status = yield Send(Type.CHECK_STATUS, self.id, self.predecessor)
             if(not predecessor_status):
                 self.predecessor = None
+                return True
+        return False
 
     def replication(self):
+        return self._run_steps(self._replication_steps())
+
+    def _replication_steps(self):
         """ 
-        Sends a message containing the data from the node to his successor
+        Sends a message containing the changes of the node data since the version acknowledged by his successor
+        The whole data is sent when the successor changes or it does not have the base version of the changes
+        :return: True if some data has been sent, False if the successor was up to date
         """
         if self.successor.id != self.id:
-            self.send_request(Type.REPLICATION, self.id, self.successor, str(self.own_data.get_store()))
+            successor = Node(self.successor.id, self.successor.host, self.successor.port)
+            payload = self._replication_payload(successor)
+            response = yield Send(Type.REPLICATION, self.id, successor, payload)
+            if response is None and (yield from self._failover_successor_steps()) and self.successor.id != self.id:
+                # The replica is sent at once to the next entry of the successor list
+                successor = Node(self.successor.id, self.successor.host, self.successor.port)
+                payload = self._replication_payload(successor, full=True)
+                response = yield Send(Type.REPLICATION, self.id, successor, payload)
+            if self._replication_ack(successor, payload, response):
+                payload = self._replication_payload(successor, full=True)
+                response = yield Send(Type.REPLICATION, self.id, successor, payload)
+                self._replication_ack(successor, payload, response)
+            return payload['mode'] == 'full' or bool(payload['changes'])
+        return False
+
+    def _replication_payload(self, successor, full = False):
+        """
+        Builds the REPLICATION payload, a delta since the acknowledged version when possible
+        :param successor: The node that receives the replica
+        :param full: A boolean used to force a full copy of the data
+        :return: A dict object with the replication mode, the versions and the data
+        """
+        if not full and self.replica_acked and self.replica_acked[0] == successor.id:
+            base = self.replica_acked[1]
+            delta = self.own_data.changes_since(base)
+            if delta is not None:
+                version, changes = delta
+                return {"mode": "delta", "base": base, "version": version, "changes": changes}
+
+        version, items = self.own_data.snapshot()
+        return {"mode": "full", "version": version, "items": items}
+
+    def _replication_ack(self, successor, payload, response):
+        """
+        Records the version acknowledged by the successor
+        :return: True if the successor asks for a full copy of the data, False otherwise
+        """
+        if response and response.get('version') == payload['version']:
+            self.replica_acked = (successor.id, payload['version'])
+            return False
+        self.replica_acked = None
+        return bool(response and response.get('resync') and payload['mode'] == 'delta')
+
+    def _latency_targets(self):
+        """
+        :return: A list with the distinct fingers and successor list entries, the nodes a lookup may be sent to
+        """
+        nodes = dict()
+        for node in self.finger_table.distinct_nodes() + [self.successor] + self.successor_list:
+            if node.id != self.id and node.id not in nodes:
+                nodes[node.id] = Node(node.id, node.host, node.port)
+        return list(nodes.values())
+
+    def measure_latency(self):
+        return self._run_steps(self._measure_latency_steps())
+
+    def _measure_latency_steps(self):
+        """
+        Sends a CHECK_STATUS to every finger and successor list entry at once, the round trip time
+        of the responses is recorded by send_request
+        :return: True if a node has been measured for the first time, False otherwise
+        """
+        nodes = self._latency_targets()
+        new = [node for node in nodes if self.latencies.rtt(node.id) is None]
+        yield Gather(Send(Type.CHECK_STATUS, self.id, node) for node in nodes)
+        return any(self.latencies.rtt(node.id) is not None for node in new)
 
     def clear_cache(self):
-        self.cache.clear_store()
+        """
+        Removes the expired entries of the cache and the location cache, and decays the request rate of the keys
+        """
+        self.cache.evict_expired()
+        self.locations.evict_expired()
+        self.hot_keys.decay()
 
-    def _run_function_thread(self, func, sleep_time):
-        """ 
-        Runs a function passed by parameter every certain time while the server is running
-        :param func: The function to be executed
-        :param sleep_time: The time between the function invocation
-        """
-        while self.server_started:
-            try:
-                func()
-                time.sleep(sleep_time)
-            except Exception as e:
-                logger.exception(f" ERROR _run_function_thread")
-            
\ No newline at end of file
+    def stats(self, format = None):
+        """
+        Answers a STATS request
+        :param format: 'text' for the text exposition format, a dict object otherwise
+        :return: The metrics of the node
+        """
+        if format == 'text':
+            return self.metrics.exposition()
+        return self.metrics.collect()
+
+    @staticmethod
+    def _type_label(type):
+        return type.value if isinstance(type, Type) else str(type)
+
+    @staticmethod
+    def _request_succeeded(server_response):
+        return bool(server_response.success and server_response.payload and server_response.payload.get('success'))
+
+    def _observe_handled(self, type, start, response):
+        """
+        Records the duration of a message handled by this node, the histogram also counts the messages
+        """
+        labels = (("type", self._type_label(type)),)
+        self.metrics.observe("message_handle_seconds", time.perf_counter() - start, labels)
+        if not response.get('success'):
+            self.metrics.inc("messages_failed_total", labels)
+
+    def _observe_sent(self, type, start, success):
+        """
+        Records the time until the response of a request sent by this node
+        """
+        labels = (("type", self._type_label(type)),)
+        self.metrics.observe("request_seconds", time.perf_counter() - start, labels)
+        if not success:
+            self.metrics.inc("requests_failed_total", labels)
+
+    def _observe_rtt(self, type, node, start, success):
+        """
+        Records the round trip time to a node from the requests it answers without contacting other nodes
+        A node that does not answer is forgotten, so it is not preferred by the proximity routing
+        """
+        if type in self.RTT_TYPES:
+            if success:
+                self.latencies.observe(node.id, time.perf_counter() - start)
+            else:
+                self.latencies.forget(node.id)
+
+    def _observe_maintenance(self, name, duration, changed):
+        self.metrics.observe("maintenance_seconds", duration, (("job", name),))
+
+    def _metric_gauges(self):
+        """
+        :return: A list of (name, labels, value) with the current state of the node, read when the metrics are collected
+        """
+        gauges = [
+            ("own_keys", (), len(self.own_data.keys)),
+            ("replicated_keys", (), len(self.replicated_data.keys)),
+            ("threads", (), threading.active_count()),
+            ("finger_entries", (), len(self.finger_table.entries())),
+            ("successor_list_size", (), len(self.successor_list)),
+        ]
+        gauges.extend((f"cache_{name}", (), value) for name, value in self.cache.stats().items())
+        gauges.extend((f"location_cache_{name}", (), value) for name, value in self.locations.stats().items())
+        gauges.extend((f"latency_{name}", (), value) for name, value in self.latencies.stats().items())
+        gauges.extend((f"hot_keys_{name}", (), value) for name, value in self.hot_keys.stats().items())
+        gauges.extend((f"tracing_{name}", (), value) for name, value in self.tracer.stats().items())
+        gauges.extend((f"transport_{name}", (), value) for name, value in self.server.stats().items())
+        if self.scheduler:
+            for job, job_stats in self.scheduler.stats().items():
+                if not job.endswith(self.job_suffix) or job[:len(job) - len(self.job_suffix)] not in self.MAINTENANCE_INTERVALS:
+                    continue # A job of other virtual node
+                gauges.extend((f"maintenance_{name}", (("job", job),), value) for name, value in job_stats.items())
+        return gauges
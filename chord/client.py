@@ -9,9 +9,9 @@ class Client:
     GET_SET_WAIT_TIME = 1
     MBITS = 160
 
-    def __init__(self, id, host, port):
+    def __init__(self, id, host, port, node_class=ChordNode, data_dir=None):
         super().__init__()
-        self.chord_client = ChordNode(id, host, port, self.MBITS)
+        self.chord_client = node_class(id, host, port, self.MBITS, data_dir)
         self.node_joined = None
 
     def start(self):
@@ -43,13 +43,31 @@ class Client:
         if self.server_started:
             self.chord_client.stop()
 
-    # client consult node n for key k
-    def get(self, key, node):
-        return self.get_set_data(Type.GET_DATA, node, key=key)
+    # client consult node n for key k, a replica may answer if the consistency is not 'owner'
+    # with 'nearest' the replica must have the version returned by a previous SET of the key
+    def get(self, key, node, consistency=None, version=None):
+        data = {"consistency": consistency, "version": version} if consistency else None
+        return self.get_set_data(Type.GET_DATA, node, key=key, data=data)
     
     # client set data (key:value)
     def set(self, data, node):
         return self.get_set_data(Type.SET_DATA, node, data=data)
+
+    # client consult node n for several keys
+    def get_many(self, keys, node):
+        return self.get_set_many(Type.GET_MANY, node, [[key, None] for key in keys])
+
+    # client set several data {key: value}
+    def set_many(self, data, node):
+        return self.get_set_many(Type.SET_MANY, node, [[key, value] for key, value in data.items()])
+
+    # client consult the metrics of node n, as a dict or as text if format is 'text'
+    def stats(self, node, format=None):
+        return self.chord_client.send_request(Type.STATS, None, node, {"format": format})
+
+    # client consult the spans of the sampled requests recorded by node n, only the ones of a trace if trace_id is set
+    def traces(self, node, trace_id=None):
+        return self.chord_client.send_request(Type.TRACES, None, node, {"trace_id": trace_id})
         
 
     def get_set_data(self, type, node, key=None, data=None):
@@ -62,4 +80,38 @@ class Client:
                 return get_set_response
             time.sleep(self.GET_SET_WAIT_TIME)
             tries = tries - 1
-        
\ No newline at end of file
+
+    def get_set_many(self, type, node, items):
+        """
+        Sends several keys in a single GET_MANY or SET_MANY request, only the keys that failed are sent again
+        :param items: A list of [key, value] pairs, the value is None for GET_MANY
+        :return: A list with a GetSetResponse object per key, in the order of the items
+        """
+        max_keys = 2**self.MBITS
+        results = dict()
+        pending = items
+        tries = self.GET_SET_DATA_TRIES
+        while pending and tries > 0:
+            if type == Type.GET_MANY:
+                payload = {"keys": [key for key, _ in pending]}
+            else:
+                payload = {"items": pending}
+            response = self.chord_client.send_request(type, None, node, payload)
+            for result in response or []:
+                get_set_response = GetSetResponse()
+                get_set_response.update(result)
+                results[get_set_response.key] = get_set_response
+            pending = [item for item in pending
+                       if not (item[0] % max_keys in results and results[item[0] % max_keys].success)]
+            if pending:
+                time.sleep(self.GET_SET_WAIT_TIME)
+                tries = tries - 1
+
+        responses = []
+        for key, value in items:
+            get_set_response = results.get(key % max_keys)
+            if not get_set_response:
+                get_set_response = GetSetResponse(key)
+                get_set_response.error = "No response"
+            responses.append(get_set_response)
+        return responses
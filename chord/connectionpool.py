@@ -0,0 +1,168 @@
+import socket, threading, time, itertools
+
+
+class PooledConnection:
+    """
+    A long-lived tcp connection shared by every request sent to a server node
+    Each request is registered with a request id, the responses may arrive in any order
+    and are matched with their request by the id
+    """
+
+    def __init__(self, sock, address):
+        super().__init__()
+        self.sock = sock
+        self.address = address
+        self.codec = None # Negotiated by TCPClientServer on first use
+        self.compressor = None # Negotiated with the codec, None if the frames are not compressed
+        self.last_used = time.monotonic()
+        self.pending = dict() # request id -> (Future, deadline)
+        self.request_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock() # A frame must be written at once by a single thread
+        self.closed = False
+
+    def is_alive(self):
+        return not self.closed
+
+    def add_request(self, future, timeout):
+        """
+        Registers a request waiting for its response
+        :param future: The Future completed with the response
+        :param timeout: The time after which the request expires
+        :return: The request id, or None if the connection has been closed
+        """
+        with self.lock:
+            if self.closed:
+                return None
+            request_id = next(self.request_ids)
+            self.last_used = time.monotonic()
+            self.pending[request_id] = (future, self.last_used + timeout)
+            return request_id
+
+    def pop_request(self, request_id):
+        """
+        :return: The Future of the request, or None if it is not pending (expired or unknown)
+        """
+        with self.lock:
+            entry = self.pending.pop(request_id, None)
+            return entry[0] if entry else None
+
+    def expired_requests(self):
+        """
+        Removes the requests whose timeout has expired
+        :return: A list with the Futures of the expired requests
+        """
+        now = time.monotonic()
+        with self.lock:
+            expired = [request_id for request_id, (_, deadline) in self.pending.items() if deadline < now]
+            return [self.pending.pop(request_id)[0] for request_id in expired]
+
+    def close_if_idle(self, idle_timeout):
+        """
+        Closes the connection if it has no pending requests and has not been used for idle_timeout
+        Both are checked under the lock that registers the requests, so a request is never added
+        to a connection that is being closed, add_request returns None instead
+        :return: True if the connection has been closed
+        """
+        with self.lock:
+            if self.pending or time.monotonic() - self.last_used <= idle_timeout:
+                return False
+            self.closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        return True
+
+    def close(self):
+        """
+        Closes the connection
+        :return: A list with the Futures of the requests that were still pending
+        """
+        with self.lock:
+            self.closed = True
+            futures = [future for future, _ in self.pending.values()]
+            self.pending.clear()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        return futures
+
+
+class ConnectionPool:
+    """
+    Keeps one long-lived tcp connection to every server node keyed by (host, port)
+    The connection is not checked out, every thread sends its requests over it at the same time
+    """
+
+    IDLE_TIMEOUT = 30
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        super().__init__()
+        self.idle_timeout = idle_timeout
+        self.connections = dict() # (host, port) -> PooledConnection
+        self.opening = dict() # (host, port) -> Lock, a single connection is opened at a time
+        self.lock = threading.Lock()
+
+    def acquire(self, host, port, timeout=None, setup=None):
+        """
+        Obtains the connection to the peer or opens a new one
+        :param host: The server node host
+        :param port: The server node port
+        :param timeout: The timeout used to connect a new socket
+        :param setup: A function called with a new PooledConnection before it is shared
+        :return: A tuple (PooledConnection, reused) where reused its True if the connection was already open
+        """
+        address = (host, port)
+        with self.lock:
+            conn = self.connections.get(address)
+            if conn and conn.is_alive():
+                return conn, True
+            opening = self.opening.setdefault(address, threading.Lock())
+
+        with opening:
+            with self.lock:
+                conn = self.connections.get(address)
+            if conn and conn.is_alive():
+                return conn, True
+
+            sock = socket.create_connection(address, timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = PooledConnection(sock, address)
+            if setup:
+                try:
+                    setup(conn)
+                except Exception:
+                    conn.close()
+                    raise
+            with self.lock:
+                self.connections[address] = conn
+            return conn, False
+
+    def discard(self, conn):
+        """
+        Closes a connection that failed or has been idle for too long, it is not used anymore
+        :return: A list with the Futures of the requests that were still pending
+        """
+        with self.lock:
+            if self.connections.get(conn.address) is conn:
+                del self.connections[conn.address]
+        return conn.close()
+
+    def connection_count(self):
+        with self.lock:
+            return len(self.connections)
+
+    def close_all(self):
+        """
+        Closes every connection of the pool
+        :return: A list with the Futures of the requests that were still pending
+        """
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+        futures = []
+        for conn in connections:
+            futures.extend(conn.close())
+        return futures
@@ -0,0 +1,6 @@
+import enum
+
+class Consistency(str, enum.Enum):
+    OWNER   = 'owner'   # Only the node responsible for the key answers
+    ANY     = 'any'     # The owner or its replica, whichever the request reaches
+    NEAREST = 'nearest' # The one with the lowest round trip time, the replica only if it has the version requested
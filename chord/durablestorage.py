@@ -0,0 +1,409 @@
+import os, mmap, struct, threading, zlib, contextlib
+from concurrent.futures import Future
+from chord.storage import Storage
+from chord.sortedkeys import SortedKeys
+from chord.logger import logger
+from utils.codec import BinaryCodec
+
+
+class DurableStorage(Storage):
+    """
+    Storage whose content survives a restart of the node
+    Every modification is appended to a write log. A single commit thread writes and syncs every record
+    appended since its last write at once (group commit), so concurrent writers share the cost of a fsync
+    When the log grows over 'snapshot_log_bytes' the content is written to a compacted snapshot and a new log
+    segment is started, the older segments are removed once the snapshot is on disk
+    At startup the snapshot is read through mmap and the log segments written after it are replayed
+    """
+
+    SNAPSHOT_LOG_BYTES = 64 * 1024 * 1024
+
+    SET, DELETE, CLEAR = b'sdc'
+
+    RECORD_HEADER = struct.Struct('!BI') # Operation, payload length
+    RECORD_CRC = struct.Struct('!I')
+    SNAPSHOT_HEADER = struct.Struct('!8sQQ') # Magic, first log segment not included, number of records
+    SNAPSHOT_MAGIC = b'CHORDSN1'
+
+    SNAPSHOT_FILE = 'snapshot'
+    LOG_PREFIX = 'log.'
+
+    def __init__(self, path, log_size=0, sync=True, snapshot_log_bytes=SNAPSHOT_LOG_BYTES):
+        """
+        :param path: The directory of the snapshot and the log segments, it is created if not exists
+        :param log_size: The size of the change log, see Storage
+        :param sync: If True a modification returns once its record is synced to disk,
+                     otherwise it returns at once and the records are synced in the background
+        :param snapshot_log_bytes: The size of the log that triggers a new snapshot
+        """
+        super().__init__(log_size)
+        self.path = path
+        self.sync = sync
+        self.snapshot_log_bytes = snapshot_log_bytes
+        self.codec = BinaryCodec()
+        self.commit = threading.Condition()
+        self.pending = [] # Encoded records not written yet
+        self.appended = 0 # Number of records appended
+        self.committed = 0 # Number of records written and synced
+        self.waiters = [] # (number of records, Future) completed once the records are synced
+        self.deferring = threading.local() # The threads whose modifications do not wait for their commit
+        self.error = None
+        self.closed = False
+        self.compact_requested = False
+        self.snapshotting = False # A snapshot is being written, a new one is not started until it ends
+        self.snapshot_thread = None
+
+        os.makedirs(path, exist_ok=True)
+        self.segment, self.log_bytes = self._recover()
+        self.log_file = open(self._segment_path(self.segment), 'ab')
+        self.commit_thread = threading.Thread(target=self._run_commits, name=f"commit-{path}", daemon=True)
+        self.commit_thread.start()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, f"{self.LOG_PREFIX}{segment:012d}")
+
+    def _segments(self):
+        """
+        :return: A sorted list with the numbers of the log segments on disk
+        """
+        return sorted(int(name[len(self.LOG_PREFIX):]) for name in os.listdir(self.path)
+                      if name.startswith(self.LOG_PREFIX) and name[len(self.LOG_PREFIX):].isdigit())
+
+    # Records
+
+    def _encode_record(self, op, key=None, value=None):
+        payload = self.codec.encode([key, value]) if op != self.CLEAR else b''
+        header = self.RECORD_HEADER.pack(op, len(payload))
+        return header + payload + self.RECORD_CRC.pack(zlib.crc32(header + payload))
+
+    def _decode_records(self, data, offset):
+        """
+        Decodes the records of a buffer from an offset
+        The records stop at the first incomplete or corrupt one, a write interrupted by a crash
+        :return: A generator of (op, key, value, end offset of the record)
+        """
+        size = len(data)
+        header_size, crc_size = self.RECORD_HEADER.size, self.RECORD_CRC.size
+        while offset + header_size + crc_size <= size:
+            op, length = self.RECORD_HEADER.unpack_from(data, offset)
+            end = offset + header_size + length
+            if end + crc_size > size:
+                return
+            record = data[offset:end]
+            if zlib.crc32(record) != self.RECORD_CRC.unpack_from(data, end)[0]:
+                return
+            key, value = self.codec.decode(record[header_size:]) if length else (None, None)
+            offset = end + crc_size
+            yield op, key, value, offset
+
+    # Recovery
+
+    def _recover(self):
+        """
+        Loads the snapshot and replays the log segments written after it
+        :return: A tuple (segment, size) with the log segment where the new records are appended and its size
+        """
+        segment = self._load_snapshot()
+        segments = [number for number in self._segments() if number >= segment]
+        for number in self._segments():
+            if number < segment:
+                # Left by a crash after the snapshot was written
+                os.remove(self._segment_path(number))
+
+        size = 0
+        for number in segments:
+            size = self._replay_segment(number)
+            segment = number
+        self.keys = SortedKeys(self.store)
+        if self.store:
+            logger.info(f"DurableStorage {self.path}: {len(self.store)} keys recovered")
+        return segment, size
+
+    def _load_snapshot(self):
+        """
+        Reads the snapshot through mmap, the pages are loaded on demand by the operating system
+        :return: The first log segment not included in the snapshot
+        """
+        path = os.path.join(self.path, self.SNAPSHOT_FILE)
+        if not os.path.exists(path) or os.path.getsize(path) < self.SNAPSHOT_HEADER.size:
+            return 0
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, segment, count = self.SNAPSHOT_HEADER.unpack_from(data, 0)
+            if magic != self.SNAPSHOT_MAGIC:
+                raise ValueError(f"DurableStorage {self.path}: {path} is not a snapshot")
+            loaded = 0
+            for _, key, value, _ in self._decode_records(data, self.SNAPSHOT_HEADER.size):
+                self.store[key] = value
+                loaded += 1
+            if loaded != count:
+                # The snapshot is replaced atomically, a short one is a damaged disk
+                raise ValueError(f"DurableStorage {self.path}: snapshot has {loaded} of {count} records")
+            return segment
+
+    def _replay_segment(self, number):
+        """
+        Applies the records of a log segment, an incomplete record at the end is truncated
+        :return: The size of the valid part of the segment
+        """
+        path = self._segment_path(number)
+        with open(path, 'rb') as f:
+            data = f.read()
+        valid = 0
+        for op, key, value, valid in self._decode_records(data, 0):
+            if op == self.SET:
+                self.store[key] = value
+            elif op == self.DELETE:
+                self.store.pop(key, None)
+            elif op == self.CLEAR:
+                self.store.clear()
+        if valid < len(data):
+            logger.warning(f"DurableStorage {self.path}: truncating {len(data) - valid} bytes of {path}")
+            with open(path, 'r+b') as f:
+                f.truncate(valid)
+        return valid
+
+    # Write log
+
+    def _log(self, key, value, deleted=False):
+        super()._log(key, value, deleted)
+        self._append(self._encode_record(self.DELETE if deleted else self.SET, key, value))
+
+    def _reset(self):
+        super()._reset()
+        self._append(self._encode_record(self.CLEAR))
+        for key, value in self.store.items():
+            self._append(self._encode_record(self.SET, key, value))
+
+    def _append(self, record):
+        """
+        Queues a record for the commit thread, the caller must hold the lock so the records keep the order of the changes
+        """
+        with self.commit:
+            self.pending.append(record)
+            self.appended += 1
+            self.commit.notify_all()
+
+    def _wait_commit(self):
+        """
+        Waits until every record appended so far has been synced, if the storage is synchronous
+        and the calling thread does not defer its commits
+        """
+        if not self.sync or getattr(self.deferring, 'active', False):
+            return
+        with self.commit:
+            target = self.appended
+            while self.committed < target and not self.error and not self.closed:
+                self.commit.wait()
+            if self.error:
+                raise OSError(f"DurableStorage {self.path}: write log failed: {self.error!r}")
+
+    @contextlib.contextmanager
+    def deferred_commits(self):
+        """
+        The modifications made by the calling thread inside the context return without waiting for their commit,
+        the caller waits for the Future of commit_future instead. Used by an event loop, which must not block
+        """
+        self.deferring.active = True
+        try:
+            yield
+        finally:
+            self.deferring.active = False
+
+    def commit_future(self):
+        """
+        :return: A Future completed once every record appended so far has been synced, at once if there is
+                 nothing to sync. Its exception is the error of the write log if the records could not be written
+        """
+        future = Future()
+        with self.commit:
+            if self.sync and self.committed < self.appended and not self.error and not self.closed:
+                self.waiters.append((self.appended, future))
+                return future
+        self._complete_waiters([future])
+        return future
+
+    def _complete_waiters(self, futures):
+        for future in futures:
+            if not future.set_running_or_notify_cancel():
+                # The waiter has given up
+                continue
+            if self.error:
+                future.set_exception(OSError(f"DurableStorage {self.path}: write log failed: {self.error!r}"))
+            else:
+                future.set_result(None)
+
+    def _run_commits(self):
+        while True:
+            with self.commit:
+                # A compaction requested while a snapshot is written waits for the snapshot thread to notify its end
+                while not self.pending and not self.closed and not (self.compact_requested and not self.snapshotting):
+                    self.commit.wait()
+                if self.closed and not self.pending:
+                    waiters, self.waiters = self.waiters, []
+                    break
+                compact = (self.compact_requested or self.log_bytes > self.snapshot_log_bytes) and not self.snapshotting
+                if compact:
+                    self.compact_requested = False
+                    self.snapshotting = True
+                records, self.pending = self.pending, []
+                target = self.appended
+            started = False
+            try:
+                self._write_records(records)
+                if compact:
+                    self.snapshot_thread = threading.Thread(target=self._run_snapshot, args=self._rotate(),
+                                                            name=f"snapshot-{self.path}", daemon=True)
+                    self.snapshot_thread.start()
+                    started = True
+            except OSError as e:
+                logger.exception(f"DurableStorage {self.path}: write log failed")
+                self.error = e
+            with self.commit:
+                if compact and not started:
+                    self.snapshotting = False
+                self.committed = max(self.committed, target)
+                self.commit.notify_all()
+                waiters = [future for appended, future in self.waiters if appended <= self.committed]
+                self.waiters = [waiter for waiter in self.waiters if waiter[0] > self.committed]
+            self._complete_waiters(waiters)
+        self._complete_waiters(waiters)
+
+    def _write_records(self, records):
+        """
+        Writes and syncs records in the current log segment, only called by the commit thread
+        """
+        if not records:
+            return
+        data = b''.join(records)
+        self.log_file.write(data)
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+        self.log_bytes += len(data)
+
+    # Snapshots
+
+    def _rotate(self):
+        """
+        Copies the content and starts a new log segment, the records appended after the copy go to the new segment
+        Only called by the commit thread, or by close once the commit thread has finished
+        :return: A tuple (segment, items) with the new segment and the content to write in the snapshot
+        """
+        with self.lock:
+            items = list(self.store.items())
+            with self.commit:
+                records, self.pending = self.pending, []
+                target = self.appended
+        self._write_records(records)
+        with self.commit:
+            self.committed = max(self.committed, target)
+            self.commit.notify_all()
+
+        self.log_file.close()
+        self.segment += 1
+        self.log_file = open(self._segment_path(self.segment), 'ab')
+        self.log_bytes = 0
+        return self.segment, items
+
+    def _run_snapshot(self, segment, items):
+        """
+        Runs in the snapshot thread, the commit thread is notified when the snapshot ends
+        """
+        try:
+            self._write_snapshot(segment, items)
+        finally:
+            with self.commit:
+                self.snapshotting = False
+                self.commit.notify_all()
+
+    def _write_snapshot(self, segment, items):
+        """
+        Writes the snapshot of the content copied before 'segment' started, and removes the older segments
+        The snapshot is written in a temporary file and renamed, a crash leaves the previous snapshot untouched
+        """
+        path = os.path.join(self.path, self.SNAPSHOT_FILE)
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(self.SNAPSHOT_HEADER.pack(self.SNAPSHOT_MAGIC, segment, len(items)))
+                for key, value in items:
+                    f.write(self._encode_record(self.SET, key, value))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self._sync_directory()
+            for number in self._segments():
+                if number < segment:
+                    os.remove(self._segment_path(number))
+            logger.info(f"DurableStorage {self.path}: snapshot of {len(items)} keys")
+        except OSError:
+            logger.exception(f"DurableStorage {self.path}: snapshot failed")
+
+    def _sync_directory(self):
+        if hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def compact(self):
+        """
+        Writes a new snapshot in the background, the log written so far is removed
+        """
+        with self.commit:
+            self.compact_requested = True
+            self.commit.notify_all()
+
+    def close(self, compact=True):
+        """
+        Syncs the pending records and stops the commit thread
+        :param compact: If True a snapshot is written, so the next start does not replay the log
+        """
+        with self.commit:
+            if self.closed:
+                return
+            self.closed = True
+            self.commit.notify_all()
+        self.commit_thread.join()
+        if self.snapshot_thread:
+            self.snapshot_thread.join()
+        if compact and not self.error:
+            self._write_snapshot(*self._rotate())
+        self.log_file.close()
+
+    # Modifications, they return once their records are synced
+
+    def set_key_value(self, key, value):
+        super().set_key_value(key, value)
+        self._wait_commit()
+
+    def pop_key(self, key):
+        value = super().pop_key(key)
+        self._wait_commit()
+        return value
+
+    def set_store_data(self, data):
+        super().set_store_data(data)
+        self._wait_commit()
+
+    def update_store_data(self, data):
+        super().update_store_data(data)
+        self._wait_commit()
+
+    def clear_store(self):
+        super().clear_store()
+        self._wait_commit()
+
+    def apply_changes(self, changes):
+        super().apply_changes(changes)
+        self._wait_commit()
+
+    def pop_range(self, start, end):
+        removed = super().pop_range(start, end)
+        self._wait_commit()
+        return removed
+
+    def pop_keys(self, keys):
+        removed = super().pop_keys(keys)
+        self._wait_commit()
+        return removed
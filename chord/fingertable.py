@@ -0,0 +1,79 @@
+import threading, bisect
+from chord.fingernode import FingerNode
+
+
+class FingerTable:
+    """
+    Finger table stored as a list of distinct entries
+    Consecutive levels that point to the same node are kept as a single entry with the first level it covers,
+    in a ring of N nodes the table has about log N entries instead of mbits
+    """
+
+    def __init__(self, id, mbits, node):
+        """
+        :param id: The id of the node owning the table
+        :param mbits: The number of levels
+        :param node: The node every level points to at first
+        """
+        super().__init__()
+        self.id = id
+        self.mbits = mbits
+        self.lock = threading.Lock()
+        self.levels = [0] # First level of every entry, sorted
+        self.nodes = [FingerNode(node.id, node.host, node.port, self.start(0))]
+
+    def start(self, i):
+        """
+        :return: The first key covered by the level i, (n + 2^i) mod 2^m
+        """
+        return (self.id + 2**i) % 2**self.mbits
+
+    def __getitem__(self, i):
+        with self.lock:
+            return self.nodes[bisect.bisect_right(self.levels, i) - 1]
+
+    def entries(self):
+        """
+        :return: A list of (first level, last level, FingerNode) with the levels covered by every entry
+        """
+        with self.lock:
+            ends = self.levels[1:] + [self.mbits]
+            return [(first, end - 1, node) for first, end, node in zip(self.levels, ends, self.nodes)]
+
+    def distinct_nodes(self):
+        """
+        :return: A list with the distinct nodes of the table, from the highest level to the lowest
+        """
+        with self.lock:
+            return self.nodes[::-1]
+
+    def set_range(self, first, last, node):
+        """
+        Points the levels [first, last] to a node, merging the entries that point to the same node
+        :return: True if some level has changed, False otherwise
+        """
+        with self.lock:
+            ends = self.levels[1:] + [self.mbits]
+            changed = False
+            runs = []
+            for start, end, current in zip(self.levels, ends, self.nodes):
+                if end <= first or start > last:
+                    runs.append((start, end, current))
+                    continue
+                if current.id != node.id:
+                    changed = True
+                if start < first:
+                    runs.append((start, first, current))
+                if end > last + 1:
+                    runs.append((last + 1, end, current))
+            runs.append((first, last + 1, FingerNode(node.id, node.host, node.port, self.start(first))))
+            runs.sort(key=lambda run: run[0])
+
+            levels, nodes = [], []
+            for start, _, current in runs:
+                if nodes and nodes[-1].id == current.id:
+                    continue
+                levels.append(start)
+                nodes.append(current)
+            self.levels, self.nodes = levels, nodes
+            return changed
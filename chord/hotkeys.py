@@ -0,0 +1,139 @@
+import threading, collections, time
+
+
+class CountMinSketch:
+    """
+    Estimates the number of times every key has been added in a fixed amount of memory
+    Every key increments a counter per row, the estimation is the lowest of its counters so it never counts less.
+    The counters are halved by decay, so the estimations follow the recent request rate
+    """
+
+    WIDTH = 2048
+    DEPTH = 4
+
+    def __init__(self, width=WIDTH, depth=DEPTH):
+        super().__init__()
+        self.width = width
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def add(self, key):
+        """
+        :return: The estimated count of the key, including this one
+        """
+        estimate = None
+        for seed, row in enumerate(self.rows):
+            i = hash((seed, key)) % self.width
+            row[i] += 1
+            estimate = row[i] if estimate is None else min(estimate, row[i])
+        return estimate
+
+    def estimate(self, key):
+        return min(row[hash((seed, key)) % self.width] for seed, row in enumerate(self.rows))
+
+    def decay(self):
+        for row in self.rows:
+            for i, count in enumerate(row):
+                if count:
+                    row[i] = count >> 1
+
+
+class HotKeys:
+    """
+    Thread safe detector of the keys of a node that receive most of the requests
+    A key is hot once its estimated request count crosses the threshold. The nodes a hot key has been pushed to
+    are remembered for the time the pushed copies live, so they can be invalidated when the key changes.
+    A copy whose key is evicted from the table, past MAX_KEYS, is only removed when it expires.
+    The version of the data of the last invalidation is kept per slot of keys, so a value read before a change
+    is not pushed after the change has invalidated the copies
+    """
+
+    THRESHOLD = 50
+    TTL = 10
+    MAX_KEYS = 1024
+    INVALIDATION_SLOTS = 4096
+
+    def __init__(self, threshold=THRESHOLD, ttl=TTL, max_keys=MAX_KEYS, invalidation_slots=INVALIDATION_SLOTS):
+        super().__init__()
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.sketch = CountMinSketch()
+        self.holders = collections.OrderedDict() # key -> (dict of node id -> Node, expires)
+        self.invalidated = [0] * invalidation_slots # Version of the last invalidation of the keys of every slot
+        self.lock = threading.Lock()
+        self.pushes = 0
+        self.invalidations = 0
+        self.stale_pushes = 0
+
+    def record(self, key):
+        """
+        Counts a request of a key
+        :return: True if the key is hot
+        """
+        with self.lock:
+            return self.sketch.add(key) >= self.threshold
+
+    def new_holders(self, key, nodes, version=0):
+        """
+        Registers the nodes a hot key is pushed to
+        :param nodes: A list of Node objects
+        :param version: The version of the data when the pushed value was read, read before the value
+        :return: The nodes that do not have a copy of the key yet, none if the key has been invalidated
+                 since the version
+        """
+        now = time.monotonic()
+        with self.lock:
+            if version < self.invalidated[hash(key) % len(self.invalidated)]:
+                self.stale_pushes += 1
+                return []
+            holders, expires = self.holders.get(key, (dict(), 0))
+            if expires < now:
+                holders = dict()
+            new = [node for node in nodes if node.id not in holders]
+            if not new:
+                return []
+            holders.update((node.id, node) for node in new)
+            self.holders[key] = (holders, now + self.ttl)
+            self.holders.move_to_end(key)
+            while len(self.holders) > self.max_keys:
+                self.holders.popitem(last=False)
+            self.pushes += len(new)
+            return new
+
+    def pop_holders(self, key, version=0):
+        """
+        Forgets the copies of a key, used when the key changes
+        :param version: The version of the data after the change, the values read before it are not pushed
+        :return: A list with the Node objects that may still have a copy
+        """
+        with self.lock:
+            slot = hash(key) % len(self.invalidated)
+            self.invalidated[slot] = max(self.invalidated[slot], version)
+            holders, expires = self.holders.pop(key, (dict(), 0))
+            if expires < time.monotonic():
+                return []
+            self.invalidations += len(holders)
+            return list(holders.values())
+
+    def decay(self):
+        """
+        Halves the request counts and forgets the copies that have expired
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.sketch.decay()
+            expired = [key for key, (_, expires) in self.holders.items() if expires < now]
+            for key in expired:
+                del self.holders[key]
+
+    def stats(self):
+        """
+        :return: A dict with the hot keys pushed and the copies pushed and invalidated
+        """
+        with self.lock:
+            return {
+                "pushed_keys": len(self.holders),
+                "pushes": self.pushes,
+                "invalidations": self.invalidations,
+                "stale_pushes": self.stale_pushes,
+            }
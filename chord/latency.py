@@ -0,0 +1,69 @@
+import threading, collections
+
+
+class LatencyTable:
+    """
+    Thread safe table of the round trip time to other nodes
+    Every sample is smoothed with an exponentially weighted moving average, so a single slow response
+    does not move the estimation much. The least recently measured nodes are forgotten when there are too many
+    """
+
+    ALPHA = 0.2
+    MAX_NODES = 1024
+
+    def __init__(self, alpha=ALPHA, max_nodes=MAX_NODES):
+        super().__init__()
+        self.alpha = alpha
+        self.max_nodes = max_nodes
+        self.rtts = collections.OrderedDict() # node id -> smoothed round trip time in seconds
+        self.total = 0.0 # Sum of the smoothed times, so the mean is read without visiting every node
+        self.lock = threading.Lock()
+        self.samples = 0
+
+    def observe(self, node_id, rtt):
+        """
+        Records a round trip time to a node
+        """
+        with self.lock:
+            previous = self.rtts.pop(node_id, None)
+            smoothed = rtt if previous is None else previous + self.alpha * (rtt - previous)
+            self.rtts[node_id] = smoothed
+            self.total += smoothed - (previous or 0.0)
+            self.samples += 1
+            while len(self.rtts) > self.max_nodes:
+                _, oldest = self.rtts.popitem(last=False)
+                self.total -= oldest
+
+    def rtt(self, node_id):
+        """
+        :return: The smoothed round trip time to the node, or None if it has not been measured
+        """
+        with self.lock:
+            return self.rtts.get(node_id)
+
+    def mean(self):
+        """
+        :return: The mean round trip time of the measured nodes, or None if no node has been measured
+        """
+        with self.lock:
+            return self.total / len(self.rtts) if self.rtts else None
+
+    def forget(self, node_id):
+        """
+        Removes the time of a node, used when it does not answer
+        """
+        with self.lock:
+            rtt = self.rtts.pop(node_id, None)
+            if rtt is not None:
+                self.total -= rtt
+
+    def stats(self):
+        """
+        :return: A dict with the number of nodes measured, the samples recorded and the mean round trip time
+        """
+        with self.lock:
+            return {
+                "nodes": len(self.rtts),
+                "samples": self.samples,
+                "mean_rtt_seconds": self.total / len(self.rtts) if self.rtts else 0.0,
+            }
@@ -0,0 +1,156 @@
+import threading, collections, bisect, time
+from chord.node import Node
+
+
+class LocationCache:
+    """
+    Thread safe cache of the ring locations learned from the traffic of a node
+    Every entry is a node with the lowest key known to belong to it, so it covers the ring interval [low, node id]
+    A lookup finds the first cached node that follows the key and checks that the key is in its interval
+    The entries expire after a time to live, and the least recently used are evicted when there are too many
+    """
+
+    MAX_ENTRIES = 4096
+    TTL = 30
+
+    def __init__(self, mbits, max_entries=MAX_ENTRIES, ttl=TTL):
+        super().__init__()
+        self.ring = 2**mbits
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict() # node id -> (low, Node, expires)
+        self.ids = [] # Sorted node ids of the entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _distance(self, a, b):
+        return (b - a) % self.ring
+
+    def _following(self, key):
+        """
+        The caller must hold the lock, and there must be some entry
+        :return: The first cached node id that follows the key, the key itself if it is cached
+        """
+        return self.ids[bisect.bisect_left(self.ids, key) % len(self.ids)]
+
+    def _ids_between(self, low, high):
+        """
+        The caller must hold the lock
+        :return: A list with the cached node ids of the ring interval [low, high)
+        """
+        first = bisect.bisect_left(self.ids, low)
+        last = bisect.bisect_left(self.ids, high)
+        if low <= high:
+            return self.ids[first:last]
+        return self.ids[first:] + self.ids[:last]
+
+    def lookup(self, key):
+        """
+        :return: The Node object successor of the key, or None if no entry covers the key or it has expired
+        """
+        key %= self.ring
+        with self.lock:
+            if not self.ids:
+                self.misses += 1
+                return None
+            node_id = self._following(key)
+            low, node, expires = self.entries[node_id]
+            if expires < time.monotonic():
+                self._remove(node_id)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            if self._distance(key, node_id) > self._distance(low, node_id):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(node_id)
+            self.hits += 1
+            return node
+
+    def learn(self, key, node):
+        """
+        Records that a node is the successor of a key, so every key of [key, node id] belongs to it
+        The entries of the nodes inside the interval are removed, they are not in the ring anymore,
+        and the interval of the following entry is trimmed if it covered the node
+        :param node: A Node object
+        """
+        key %= self.ring
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(node.id)
+            low = key
+            if entry and entry[2] >= now and self._distance(entry[0], node.id) > self._distance(key, node.id):
+                low = entry[0]
+            for other in self._ids_between(low, node.id):
+                self._remove(other)
+                self.invalidations += 1
+
+            if node.id not in self.entries:
+                bisect.insort(self.ids, node.id)
+            self.entries[node.id] = (low, Node(node.id, node.host, node.port), now + self.ttl)
+            self.entries.move_to_end(node.id)
+
+            following = self._following((node.id + 1) % self.ring)
+            if following != node.id:
+                following_low, following_node, expires = self.entries[following]
+                if self._distance(following_low, following) >= self._distance(node.id, following):
+                    self.entries[following] = ((node.id + 1) % self.ring, following_node, expires)
+
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, node_id):
+        """
+        Removes the entry of a node, used when the node fails or does not own a key it was cached for
+        :return: True if the node was cached, False otherwise
+        """
+        with self.lock:
+            if node_id not in self.entries:
+                return False
+            self._remove(node_id)
+            self.invalidations += 1
+            return True
+
+    def _remove(self, node_id):
+        """
+        The caller must hold the lock
+        """
+        del self.entries[node_id]
+        del self.ids[bisect.bisect_left(self.ids, node_id)]
+
+    def evict_expired(self):
+        """
+        Removes every expired entry
+        """
+        now = time.monotonic()
+        with self.lock:
+            expired = [node_id for node_id, (_, _, expires) in self.entries.items() if expires < now]
+            for node_id in expired:
+                self._remove(node_id)
+            self.expirations += len(expired)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.ids.clear()
+
+    def stats(self):
+        """
+        :return: A dict with the number of entries and the hit, miss and invalidation counters
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
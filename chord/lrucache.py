@@ -0,0 +1,119 @@
+import threading, collections, time, sys
+
+
+class LRUCache:
+    """
+    Thread safe lookup cache with a time to live per entry
+    The least recently used entries are evicted when the number of entries or their size exceed the budget
+    """
+
+    MAX_ENTRIES = 10000
+    MAX_BYTES = 64 * 1024 * 1024
+    TTL = 10
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl=TTL):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = collections.OrderedDict() # key -> (value, expires, size)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _sizeof(key, value):
+        if isinstance(value, (str, bytes, bytearray)):
+            return len(value) + 64
+        return sys.getsizeof(value) + 64
+
+    def get_key(self, key):
+        """
+        :return: The cached value of the key, or None if it is not cached or has expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires, size = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set_key_value(self, key, value, ttl=None):
+        """
+        Caches a value, evicting the least recently used entries if the budget is exceeded
+        :param ttl: The time to live of the entry, the cache ttl by default
+        """
+        size = self._sizeof(key, value)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, expires, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        Removes a key from the cache, used when the value of the key changes
+        """
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def _remove(self, key):
+        """
+        The caller must hold the lock
+        """
+        _, _, size = self.entries.pop(key)
+        self.size -= size
+
+    def evict_expired(self):
+        """
+        Removes every expired entry
+        """
+        now = time.monotonic()
+        with self.lock:
+            expired = [key for key, (_, expires, _) in self.entries.items() if expires < now]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+
+    def clear_store(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        :return: A dict with the size of the cache and its hit, miss and eviction counters
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
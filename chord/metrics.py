@@ -0,0 +1,139 @@
+import threading, bisect, time
+
+
+class Histogram:
+    """
+    Counts the observed values in fixed buckets, the buckets are cumulative only when they are collected
+    """
+
+    # Seconds, from half a millisecond to the longest timeouts of the node
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=BUCKETS):
+        super().__init__()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # The last one counts the values over the highest bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        :return: The upper bound of the bucket that contains the quantile q, an estimation of the quantile
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def collect(self):
+        cumulative, seen = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            cumulative.append([bound, seen])
+        return {"buckets": cumulative, "sum": self.sum, "count": self.count,
+                "p50": self.quantile(0.5), "p99": self.quantile(0.99)}
+
+
+class Metrics:
+    """
+    Thread safe registry of the counters and histograms of a node
+    A sample is identified by its name and a tuple of (label, value) pairs
+    Gauges are not stored, they are read from the collectors when the metrics are collected,
+    so the values that already exist in other objects (store sizes, cache stats) cost nothing until then
+    """
+
+    def __init__(self, prefix="chord"):
+        super().__init__()
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = dict() # (name, labels) -> value
+        self.histograms = dict() # (name, labels) -> Histogram
+        self.collectors = [] # Functions returning a list of (name, labels, value) gauge samples
+        self.started = time.time()
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def _gauges(self):
+        gauges = [("uptime_seconds", (), time.time() - self.started)]
+        for collector in self.collectors:
+            gauges.extend(collector())
+        return gauges
+
+    def collect(self):
+        """
+        :return: A dict object with the counters, histograms and gauges, every sample with its labels as a dict
+        """
+        with self.lock:
+            counters = [(name, labels, value) for (name, labels), value in self.counters.items()]
+            histograms = [(name, labels, histogram.collect()) for (name, labels), histogram in self.histograms.items()]
+        return {
+            "counters": [{"name": name, "labels": dict(labels), "value": value} for name, labels, value in counters],
+            "histograms": [dict(sample, name=name, labels=dict(labels)) for name, labels, sample in histograms],
+            "gauges": [{"name": name, "labels": dict(labels), "value": value} for name, labels, value in self._gauges()],
+        }
+
+    def exposition(self, metrics=None):
+        """
+        Formats the metrics as text, one sample per line in the Prometheus exposition format
+        :param metrics: The metrics returned by collect, the current ones by default
+        :return: A str with the metrics
+        """
+        metrics = metrics or self.collect()
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for sample in sorted(metrics["counters"], key=lambda sample: sample["name"]):
+            name = f"{self.prefix}_{sample['name']}"
+            declare(name, "counter")
+            lines.append(f"{name}{self._labels(sample['labels'])} {sample['value']}")
+
+        for sample in sorted(metrics["histograms"], key=lambda sample: sample["name"]):
+            name = f"{self.prefix}_{sample['name']}"
+            declare(name, "histogram")
+            for bound, count in sample["buckets"]:
+                lines.append(f"{name}_bucket{self._labels(sample['labels'], le=bound)} {count}")
+            lines.append(f"{name}_bucket{self._labels(sample['labels'], le='+Inf')} {sample['count']}")
+            lines.append(f"{name}_sum{self._labels(sample['labels'])} {sample['sum']}")
+            lines.append(f"{name}_count{self._labels(sample['labels'])} {sample['count']}")
+
+        for sample in sorted(metrics["gauges"], key=lambda sample: sample["name"]):
+            name = f"{self.prefix}_{sample['name']}"
+            declare(name, "gauge")
+            lines.append(f"{name}{self._labels(sample['labels'])} {sample['value']}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(labels, **extra):
+        labels = dict(labels, **extra)
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
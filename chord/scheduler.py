@@ -0,0 +1,252 @@
+import threading, heapq, itertools, random, time, asyncio
+from concurrent.futures import Future
+from chord.logger import logger
+
+
+class MaintenanceJob:
+    """
+    A periodic maintenance function of a node
+    The interval grows from min_interval to max_interval while the function reports no changes,
+    and returns to min_interval as soon as it reports one
+    A job is not started again while it is running, the next run is scheduled when it ends
+    """
+
+    BACKOFF = 1.5
+
+    def __init__(self, name, func, min_interval, max_interval, jitter=0.0, backoff=BACKOFF, tightens=()):
+        """
+        :param name: The name of the job
+        :param func: The function executed, it returns True if it has detected a change, or a Future or
+                     a coroutine with that result if the job waits for other nodes
+        :param min_interval: The interval used after a change
+        :param max_interval: The interval reached when nothing changes
+        :param jitter: The random fraction added or subtracted to every interval, so the nodes do not run in lockstep
+        :param backoff: The factor applied to the interval when nothing changes
+        :param tightens: The names of other jobs that are also tightened when this job detects a change
+        """
+        super().__init__()
+        self.name = name
+        self.func = func
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.backoff = backoff
+        self.tightens = tightens
+        self.interval = min_interval
+        self.generation = 0 # Incremented when the job is rescheduled, older heap entries are ignored
+        self.running = False
+        self.tightened = False # Tightened while running, it is run again as soon as it ends
+        self.runs = 0
+        self.changes = 0
+
+    def update_interval(self, changed):
+        if changed:
+            self.interval = self.min_interval
+            self.changes += 1
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    def delay(self):
+        """
+        :return: The time until the next run, the interval with jitter
+        """
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+
+class MaintenanceScheduler:
+    """
+    Runs every maintenance job of a node from a single timer heap
+    It runs in its own thread (start), or as a task of an event loop (run_async) if the jobs are coroutines
+    The timer loop never waits for a job: the jobs that contact other nodes return a Future or a coroutine
+    and are rescheduled when it completes, so a slow job does not delay the rest
+    """
+
+    def __init__(self, name="maintenance"):
+        super().__init__()
+        self.name = name
+        self.jobs = dict() # name -> MaintenanceJob
+        self.heap = [] # (due, seq, generation, job)
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.loop = None
+        self.async_wakeup = None
+        self.running = False
+        self.tasks = set() # The coroutine jobs running in the event loop
+        self.observer = None # Called with (job name, duration, changed) after every run
+
+    def add_job(self, job):
+        with self.lock:
+            self.jobs[job.name] = job
+            # The first run is not delayed, a new node finds its predecessor before it handles the first requests
+            self._push(job, time.monotonic())
+
+    def _push(self, job, due):
+        """
+        The caller must hold the lock
+        """
+        job.generation += 1
+        heapq.heappush(self.heap, (due, next(self.counter), job.generation, job))
+
+    def tighten(self, *names):
+        """
+        Runs the jobs as soon as possible and resets their interval to the minimum
+        Used when other part of the node detects a change, it can be called from any thread
+        """
+        with self.lock:
+            now = time.monotonic()
+            for name in names:
+                job = self.jobs.get(name)
+                if job:
+                    self._tighten(job, now)
+        self._wake()
+
+    def _tighten(self, job, now):
+        """
+        The caller must hold the lock
+        """
+        if job.interval <= job.min_interval:
+            return
+        job.interval = job.min_interval
+        if job.running:
+            job.tightened = True
+        else:
+            self._push(job, now)
+
+    def _wake(self):
+        self.wakeup.set()
+        if self.loop and self.async_wakeup:
+            self.loop.call_soon_threadsafe(self.async_wakeup.set)
+
+    def _next(self):
+        """
+        :return: A tuple (job, delay) with the job to run now, or None and the time until the next job
+        """
+        with self.lock:
+            while self.heap:
+                due, _, generation, job = self.heap[0]
+                if generation != job.generation:
+                    heapq.heappop(self.heap)
+                    continue
+                delay = due - time.monotonic()
+                if delay > 0:
+                    return None, delay
+                heapq.heappop(self.heap)
+                job.running = True
+                return job, 0
+            return None, None
+
+    def _reschedule(self, job, changed):
+        with self.lock:
+            now = time.monotonic()
+            job.running = False
+            job.runs += 1
+            job.update_interval(changed)
+            if job.tightened:
+                job.tightened = False
+                job.interval = job.min_interval
+                self._push(job, now)
+            else:
+                self._push(job, now + job.delay())
+            if changed:
+                for name in job.tightens:
+                    other = self.jobs.get(name)
+                    if other and other is not job:
+                        self._tighten(other, now)
+        self._wake()
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, name=self.name, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self._wake()
+
+    def _run(self):
+        while self.running:
+            self.wakeup.clear()
+            job, delay = self._next()
+            if job is None:
+                self.wakeup.wait(delay)
+                continue
+            self._launch(job)
+
+    def _launch(self, job):
+        """
+        Starts a job without waiting for it, it is rescheduled by _finish when it ends
+        """
+        start = time.perf_counter()
+        try:
+            result = job.func()
+        except Exception as e:
+            self._finish(job, start, None, e)
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(lambda done: self._done(job, start, done))
+        elif asyncio.iscoroutine(result):
+            task = asyncio.ensure_future(result)
+            self.tasks.add(task)
+            task.add_done_callback(lambda done: self._done(job, start, done))
+        else:
+            self._finish(job, start, result)
+
+    def _done(self, job, start, done):
+        """
+        Finishes a job that returned a Future or a coroutine, called when it completes
+        """
+        self.tasks.discard(done)
+        if done.cancelled():
+            # The scheduler has been stopped
+            return
+        error = done.exception()
+        self._finish(job, start, None if error else done.result(), error)
+
+    def _finish(self, job, start, result, error = None):
+        if error is not None:
+            logger.error(f" ERROR {self.name} job {job.name}: {repr(error)}", exc_info=error)
+            # Errors are usually failed nodes, the job is retried soon
+            changed = True
+        else:
+            changed = bool(result)
+        self._observe(job, start, changed)
+        self._reschedule(job, changed)
+
+    async def run_async(self):
+        """
+        Runs the jobs in the current event loop until the task is cancelled or stop is called
+        """
+        self.loop = asyncio.get_running_loop()
+        self.async_wakeup = asyncio.Event()
+        self.running = True
+        try:
+            while self.running:
+                self.async_wakeup.clear()
+                job, delay = self._next()
+                if job is None:
+                    try:
+                        await asyncio.wait_for(self.async_wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                self._launch(job)
+        finally:
+            tasks = list(self.tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _observe(self, job, start, changed):
+        if self.observer:
+            try:
+                self.observer(job.name, time.perf_counter() - start, changed)
+            except Exception:
+                logger.exception(f" ERROR {self.name} observer")
+
+    def stats(self):
+        """
+        :return: A dict with the current interval, runs and changes detected of every job
+        """
+        with self.lock:
+            return {name: {"interval": job.interval, "runs": job.runs, "changes": job.changes}
+                    for name, job in self.jobs.items()}
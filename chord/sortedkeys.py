@@ -0,0 +1,152 @@
+import bisect, itertools
+
+
+class SortedKeys:
+    """
+    Sorted set of keys kept in blocks of up to 2 * LOAD keys, the approach of the sortedcontainers list
+    Adding or removing a key only moves the keys of its block, and the block of a key is found with a binary
+    search of the last key of every block. A range is read or removed a block at a time
+    Not thread safe, the storage holds its lock
+    """
+
+    LOAD = 512
+
+    def __init__(self, keys=(), load=LOAD):
+        super().__init__()
+        self.load = load
+        self._build(sorted(keys))
+
+    def _build(self, keys):
+        self.blocks = [keys[i:i + self.load] for i in range(0, len(keys), self.load)]
+        self.maxes = [block[-1] for block in self.blocks] # The last key of every block
+        self.size = len(keys)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.blocks)
+
+    def __contains__(self, key):
+        i = bisect.bisect_left(self.maxes, key)
+        if i == len(self.maxes):
+            return False
+        block = self.blocks[i]
+        return block[bisect.bisect_left(block, key)] == key
+
+    def clear(self):
+        self._build([])
+
+    def add(self, key):
+        if not self.blocks:
+            self._build([key])
+            return
+        i = bisect.bisect_left(self.maxes, key)
+        if i == len(self.maxes):
+            i -= 1
+            self.blocks[i].append(key)
+            self.maxes[i] = key
+        else:
+            block = self.blocks[i]
+            j = bisect.bisect_left(block, key)
+            if block[j] == key:
+                return
+            block.insert(j, key)
+        self.size += 1
+        block = self.blocks[i]
+        if len(block) > 2 * self.load:
+            self.blocks[i:i + 1] = [block[:self.load], block[self.load:]]
+            self.maxes[i:i + 1] = [block[self.load - 1], block[-1]]
+
+    def discard(self, key):
+        i = bisect.bisect_left(self.maxes, key)
+        if i == len(self.maxes):
+            return
+        block = self.blocks[i]
+        j = bisect.bisect_left(block, key)
+        if block[j] != key:
+            return
+        del block[j]
+        self.size -= 1
+        self._shrunk(i)
+
+    def _shrunk(self, i):
+        """
+        Updates a block that has lost keys, an empty block is removed and a small one is merged with the next
+        """
+        block = self.blocks[i]
+        if not block:
+            del self.blocks[i]
+            del self.maxes[i]
+            return
+        self.maxes[i] = block[-1]
+        if len(block) < self.load // 2 and i + 1 < len(self.blocks):
+            merged = block + self.blocks[i + 1]
+            if len(merged) > 2 * self.load:
+                half = len(merged) // 2
+                self.blocks[i:i + 2] = [merged[:half], merged[half:]]
+                self.maxes[i:i + 2] = [merged[half - 1], merged[-1]]
+            else:
+                self.blocks[i:i + 2] = [merged]
+                self.maxes[i:i + 2] = [merged[-1]]
+
+    def _spans(self, low, high):
+        """
+        Finds the keys of the interval (low, high], None is unbounded
+        :return: A generator of (block index, first, last) with the slice of every block in the interval
+        """
+        i = 0 if low is None else bisect.bisect_right(self.maxes, low)
+        while i < len(self.blocks):
+            block = self.blocks[i]
+            first = 0 if low is None or block[0] > low else bisect.bisect_right(block, low)
+            if high is not None and block[-1] > high:
+                yield i, first, bisect.bisect_right(block, high)
+                return
+            yield i, first, len(block)
+            i += 1
+
+    def irange(self, low, high, limit=None):
+        """
+        :return: A list with the keys of the interval (low, high] in ascending order, at most 'limit' keys.
+                 None is unbounded
+        """
+        keys = []
+        for i, first, last in self._spans(low, high):
+            if limit is not None:
+                last = min(last, first + limit - len(keys))
+            keys.extend(self.blocks[i][first:last])
+            if limit is not None and len(keys) >= limit:
+                break
+        return keys
+
+    def remove_range(self, low, high):
+        """
+        Removes the keys of the interval (low, high], None is unbounded
+        :return: A list with the removed keys in ascending order
+        """
+        spans = list(self._spans(low, high))
+        removed = []
+        for i, first, last in spans:
+            removed.extend(self.blocks[i][first:last])
+            del self.blocks[i][first:last]
+        # The blocks are updated from the last one, so the indexes of the previous ones remain valid
+        for i, _, _ in reversed(spans):
+            self._shrunk(i)
+        self.size -= len(removed)
+        return removed
+
+    def remove_many(self, keys):
+        """
+        Removes several keys at once, every block is rebuilt once whatever the number of its keys removed
+        """
+        groups = dict() # block index -> keys to remove
+        for key in keys:
+            i = bisect.bisect_left(self.maxes, key)
+            if i < len(self.maxes):
+                groups.setdefault(i, set()).add(key)
+        for i in sorted(groups, reverse=True):
+            block = self.blocks[i]
+            kept = [key for key in block if key not in groups[i]]
+            self.size -= len(block) - len(kept)
+            self.blocks[i] = kept
+            self._shrunk(i)
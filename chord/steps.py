@@ -0,0 +1,59 @@
+"""
+The steps yielded by the protocol generators of ChordNode
+A protocol generator holds the logic of an operation that contacts other nodes without sending anything itself:
+it yields the requests it needs and the engine of the node, threaded or asyncio, sends them and resumes it
+with their results. Both engines run the same generators, so the protocol is written once
+"""
+
+
+class Send:
+    """
+    A request that a protocol generator asks its engine to send
+    The generator is resumed with the result of the operation performed by the node, or None in case of error
+    """
+
+    __slots__ = ('type', 'key', 'node', 'data', 'timeout')
+
+    def __init__(self, type, key, node, data=None, timeout=None):
+        self.type = type
+        self.key = key
+        self.node = node
+        self.data = data
+        self.timeout = timeout
+
+
+class Gather:
+    """
+    Runs several steps at once, Send objects or protocol generators
+    The generator is resumed with the list of their results, in the order of the steps
+    """
+
+    __slots__ = ('steps',)
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+
+
+class FirstOf:
+    """
+    Runs several steps at once and stops waiting as soon as one of them is accepted
+    accept is called with every result as it arrives, the generator is resumed with the first value it returns
+    that is not None, or with None if no result is accepted. The results are never accepted concurrently
+    """
+
+    __slots__ = ('steps', 'accept')
+
+    def __init__(self, steps, accept):
+        self.steps = list(steps)
+        self.accept = accept
+
+
+class Sleep:
+    """
+    Resumes the generator with None after a number of seconds
+    """
+
+    __slots__ = ('seconds',)
+
+    def __init__(self, seconds):
+        self.seconds = seconds
@@ -1,20 +1,71 @@
-import threading
+import threading, collections
+from chord.sortedkeys import SortedKeys
 
 class Storage:
-    
-    def __init__(self):
+    """
+    Thread safe key value store
+    Every modification increments the version of the store, the last 'log_size' modifications
+    are kept in a change log so other nodes can obtain only the changes since a version they already have
+    The keys are also kept sorted in blocks (SortedKeys), so the keys of a ring interval are found with a binary search
+    and a key is added or removed without moving every key
+    """
+
+    def __init__(self, log_size=0):
         super().__init__()
         self.store = dict()
+        self.keys = SortedKeys() # Sorted keys of the store
         self.lock = threading.Lock()
+        self.version = 0
+        self.changes = collections.deque(maxlen=log_size) if log_size else None
+
+    def _log(self, key, value, deleted=False):
+        """
+        Increments the version and records the change, the caller must hold the lock
+        """
+        self.version += 1
+        if self.changes is not None:
+            self.changes.append((self.version, key, value, deleted))
+
+    def _reset(self):
+        """
+        Increments the version after the whole content has been replaced, the caller must hold the lock
+        """
+        self.version += 1
+        if self.changes is not None:
+            # The old changes do not lead to the new content anymore
+            self.changes.clear()
 
     def get_key(self, key):
         with self.lock:
             return self.store.get(key, None)
 
+    def get_keys(self, keys):
+        """
+        :return: A dict with the value of every key, None for the keys that not exist
+        """
+        with self.lock:
+            return {key: self.store.get(key, None) for key in keys}
+
     def set_key_value(self, key, value):
         with self.lock:
+            if key not in self.store:
+                self.keys.add(key)
             self.store[key] = value
-    
+            self._log(key, value)
+
+    def pop_key(self, key):
+        """
+        Removes a key from the store
+        :return: The value of the key or None if not exists
+        """
+        with self.lock:
+            if key not in self.store:
+                return None
+            value = self.store.pop(key)
+            self.keys.discard(key)
+            self._log(key, None, True)
+            return value
+
     def get_store(self):
         with self.lock:
             return self.store
@@ -22,11 +73,148 @@ class Storage:
     def set_store_data(self, data):
         with self.lock:
             self.store = data
-    
+            self.keys = SortedKeys(data)
+            self._reset()
+
     def update_store_data(self, data):
         with self.lock:
-            self.store.update(data)
-    
+            for key, value in data.items():
+                if key not in self.store:
+                    self.keys.add(key)
+                self.store[key] = value
+                self._log(key, value)
+
     def clear_store(self):
         with self.lock:
-            self.store.clear()
\ No newline at end of file
+            self.store.clear()
+            self.keys.clear()
+            self._reset()
+
+    def snapshot(self):
+        """
+        :return: A tuple (version, items) where items is a list of (key, value) pairs of the store at that version
+        """
+        with self.lock:
+            return self.version, list(self.store.items())
+
+    def changes_since(self, version):
+        """
+        Obtains the changes made after a version, only the last change of every key is returned
+        :param version: The version already known by the caller
+        :return: A tuple (version, changes) where changes is a list of (key, value, deleted),
+                 or None if the change log does not cover every change since 'version'
+        """
+        with self.lock:
+            if self.changes is None or version > self.version:
+                return None
+            if version == self.version:
+                return self.version, []
+            if not self.changes or self.changes[0][0] > version + 1:
+                return None
+
+            latest = dict()
+            for change_version, key, value, deleted in reversed(self.changes):
+                if change_version <= version:
+                    break
+                if key not in latest:
+                    latest[key] = (key, value, deleted)
+            return self.version, list(latest.values())
+
+    def apply_changes(self, changes):
+        """
+        Applies a list of (key, value, deleted) changes obtained with changes_since
+        """
+        with self.lock:
+            for key, value, deleted in changes:
+                if deleted:
+                    if key in self.store:
+                        del self.store[key]
+                        self.keys.discard(key)
+                        self._log(key, None, True)
+                else:
+                    if key not in self.store:
+                        self.keys.add(key)
+                    self.store[key] = value
+                    self._log(key, value)
+
+    @staticmethod
+    def _range_bounds(start, end):
+        """
+        Splits the ring interval (start, end] in intervals of the sorted keys
+        If start >= end the interval wraps around the end of the ring, start == end is the whole ring
+        :return: A list of (low, high) intervals (low, high] in ring order, None is unbounded
+        """
+        if start < end:
+            return [(start, end)]
+        return [(start, None), (None, min(start, end))]
+
+    def keys_in_range(self, start, end):
+        """
+        :return: A list with the keys of the ring interval (start, end], in ring order
+        """
+        with self.lock:
+            return [key for low, high in self._range_bounds(start, end) for key in self.keys.irange(low, high)]
+
+    def iter_range(self, start, end, after = None, limit = None):
+        """
+        Obtains the (key, value) pairs of the ring interval (start, end], in ring order
+        :param after: A key of the interval, only the keys that follow it are returned. Used to resume a transfer
+        :param limit: The maximum number of pairs returned
+        :return: A list of (key, value) pairs
+        """
+        if after is not None:
+            start = after
+        with self.lock:
+            items = []
+            for low, high in self._range_bounds(start, end):
+                keys = self.keys.irange(low, high, None if limit is None else limit - len(items))
+                items.extend((key, self.store[key]) for key in keys)
+            return items
+
+    def scan_range(self, start, end, chunk_size):
+        """
+        Iterates over the (key, value) pairs of the ring interval (start, end] in ring order, reading a chunk
+        of pairs at a time so the whole interval is not copied at once nor the store locked while it is scanned
+        The changes made during the scan may or may not be seen
+        :param chunk_size: The number of pairs read at a time
+        """
+        after = None
+        while True:
+            chunk = self.iter_range(start, end, after=after, limit=chunk_size)
+            yield from chunk
+            if len(chunk) < chunk_size or chunk[-1][0] == end:
+                return
+            after = chunk[-1][0]
+
+    def pop_range(self, start, end):
+        """
+        Removes the keys of the ring interval (start, end] from the store
+        :return: A dict with the removed keys and their values
+        """
+        with self.lock:
+            removed = dict()
+            for low, high in self._range_bounds(start, end):
+                for key in self.keys.remove_range(low, high):
+                    removed[key] = self.store.pop(key)
+                    self._log(key, None, True)
+            return removed
+
+    def pop_keys(self, keys):
+        """
+        Removes a list of keys from the store, the sorted keys are updated once for all of them
+        :return: A dict with the removed keys and their values
+        """
+        with self.lock:
+            removed = dict()
+            for key in keys:
+                if key in self.store:
+                    removed[key] = self.store.pop(key)
+                    self._log(key, None, True)
+            self.keys.remove_many(removed)
+            return removed
+
+    def close(self):
+        """
+        Releases the resources of the storage, the in memory store has none
+        """
+        pass
@@ -1,13 +1,33 @@
-import socket, select, threading, time, sys, logging
+import socket, select, threading, time, sys, logging, struct
 from socket import SHUT_RDWR
+from concurrent.futures import Future
 from chord.logger import logger
+from chord.connectionpool import ConnectionPool
+from chord.workerpool import WorkerPool
 from utils.response import Response
+from utils.codec import CODECS, CODECS_BY_NAME, DEFAULT_CODEC, JsonCodec
+from utils.compression import COMPRESSORS, COMPRESSED
 
 
 class TCPClientServer:
     
     MAX_CONNECTIONS = 100
     RESPONSE_TIMEOUT = 3
+    FRAME_HEADER = struct.Struct('!BI')
+    HANDSHAKE = 0
+    # Codecs proposed in the handshake, in order of preference. The binary codec is implemented in Python
+    # and is slower than the C json module, it is only accepted from the peers that propose it
+    PREFERRED_CODECS = (JsonCodec.name,)
+    MAX_FRAME_SIZE = 256 * 1024 * 1024
+    # The received requests are decoded by the worker pool with this priority, then queued with their own priority
+    DECODE_PRIORITY = 0
+    # How often the reader of a client connection checks the timeouts of the pending requests
+    SWEEP_INTERVAL = 0.1
+    # Compression proposed in the handshake, None to disable it. The bodies smaller than COMPRESSION_THRESHOLD
+    # are sent as they are, and the level is the default of the algorithm if it is None
+    COMPRESSION = 'zlib'
+    COMPRESSION_LEVEL = None
+    COMPRESSION_THRESHOLD = 4096
 
     def __init__(self, host, port, node):
         super().__init__()
@@ -16,7 +36,20 @@ class TCPClientServer:
         self.node = node
         self.server_sock = None
         self.connections = []
+        self.connections_lock = threading.Lock() # The workers close connections while the select loop accepts them
+        self.write_locks = dict() # Accepted socket -> Lock, responses are sent by several workers
+        self.compressors = dict() # Accepted socket -> Compressor negotiated by the client
+        self.compression = self.COMPRESSION
+        self.compression_level = self.COMPRESSION_LEVEL
+        self.compression_threshold = self.COMPRESSION_THRESHOLD
         self.signal_thread = True
+        self.pool = ConnectionPool()
+        self.workers = WorkerPool(name=f"worker-{port}")
+        self.bytes_sent = 0 # Frames sent and received, headers included
+        self.bytes_received = 0
+        self.frames_compressed = 0
+        self.bytes_before_compression = 0 # Bodies of the compressed frames, before and after the compression
+        self.bytes_after_compression = 0
 
     def init_server(self):
         """
@@ -26,6 +59,8 @@ class TCPClientServer:
         try:
             server_response = Response()
             self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # A restarted node binds its port again while the old connections are in TIME_WAIT
+            self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_sock.bind((self.host, self.port))
             self.server_sock.listen(self.MAX_CONNECTIONS)
             self.connections.append(self.server_sock)
@@ -38,93 +73,321 @@ class TCPClientServer:
             return server_response
 
         
-    def _handle_data(self, data, sock):
+    def _handle_data(self, message, codec, sock, queued_at):
         """ 
-        Handles the message requests sent by other nodes
-        :param data: The message sended by other node
-        :return: A Response object in json format containing the result of the operation requested
+        Handles the message requests sent by other nodes, runs in a thread of the worker pool
+        The worker does not wait for the nodes contacted to handle the request, the response is sent
+        by the thread that completes it
+        :param message: The decoded message sended by other node
+        :param codec: The codec used to encode the response, the same of the request
+        :param sock: The socket where the response is sent
+        :param queued_at: The perf_counter time the message was queued
         """
         try:
-            message = data
-            logger.info(f"Message: {message}  -  From: {sock.getpeername()}")
-            response = self.node.handle_message(message)
-            sock.send(response.encode('utf-8'))
-        except Exception as e:
+            request = self.node.process_message_future(message, time.perf_counter() - queued_at)
+            request.add_done_callback(lambda handled: self._respond(sock, codec, message, handled))
+        except Exception:
             logger.exception(f" ERROR SERVER ID: {self.node.id} _handle_data")
-            sock.close()
-        
+            self._close_client(sock)
+
+    def _respond(self, sock, codec, message, handled):
+        """
+        Sends the response of a handled request
+        :param handled: The Future returned by process_message_future
+        """
+        try:
+            self._send_response(sock, codec, message, handled.result())
+        except Exception:
+            logger.exception(f" ERROR SERVER ID: {self.node.id} _respond")
+            self._close_client(sock)
+
+    def _dispatch(self, frame, sock):
+        """
+        Queues a received frame in the worker pool to be decoded, so the select loop only reads the sockets
+        If the queue is full the request is decoded here to answer right away that the node is busy
+        Handshakes are answered right away
+        :param frame: A tuple (codec id, body) with the frame sended by other node
+        :param sock: The socket where the response is sent
+        """
+        codec_id, body = frame
+        if codec_id == self.HANDSHAKE:
+            self._answer_handshake(body, sock)
+            return
+
+        compressor = self.compressors.get(sock)
+        queued_at = time.perf_counter()
+        if not self.workers.submit(self.DECODE_PRIORITY, self._queue_request, codec_id, body, compressor, sock,
+                                   queued_at):
+            codec, message = self._decode_request(codec_id, body, compressor)
+            self._send_response(sock, codec, message, self.node.reject_message(message))
+
+    def _queue_request(self, codec_id, body, compressor, sock, queued_at):
+        """
+        Decodes a received request and queues it in the worker pool according to its priority,
+        runs in a thread of the worker pool. If the queue is full the node answers that it is busy
+        :param compressor: The Compressor negotiated by the connection when the frame was received
+        :param queued_at: The perf_counter time the frame was queued
+        """
+        try:
+            codec, message = self._decode_request(codec_id, body, compressor)
+            priority = self.node.message_priority(message)
+            if not self.workers.submit(priority, self._handle_data, message, codec, sock, queued_at):
+                self._send_response(sock, codec, message, self.node.reject_message(message))
+        except Exception:
+            logger.exception(f" ERROR SERVER ID: {self.node.id} _queue_request")
+            self._close_client(sock)
+
+    def _decode_request(self, codec_id, body, compressor):
+        """
+        :return: A tuple (codec, message) with the codec of a request frame and the decoded RequestMessage
+        """
+        codec, body = self._unpack_body(codec_id, body, compressor)
+        return codec, self.node.decode_message(codec.decode(body))
+
+    def _send_response(self, sock, codec, message, response):
+        """
+        Sends the response of a request, tagged with the request id so the client can match it
+        The responses of a connection are sent in the order they are ready, not in the order of the requests
+        :param message: The RequestMessage answered
+        :param response: The response as a dict
+        """
+        response['request_id'] = message.request_id
+        codec_id, body = self._pack_body(codec, codec.encode(response), self.compressors.get(sock))
+        lock = self.write_locks.get(sock)
+        if lock is None:
+            # The connection has been closed while the request was handled
+            return
+        with lock:
+            self._send_frame(sock, codec_id, body)
+
+    def _answer_handshake(self, body, sock):
+        """
+        Chooses the first codec and the first compression proposed by the client that this node supports
+        The compression is only accepted if this node has it enabled
+        """
+        proposal = DEFAULT_CODEC.decode(body)
+        chosen = next((name for name in proposal.get('codecs', []) if name in CODECS_BY_NAME), DEFAULT_CODEC.name)
+        compression = self._choose_compression(proposal.get('compression', []))
+        if compression:
+            self.compressors[sock] = self._compressor(compression)
+        with self.write_locks[sock]:
+            self._send_frame(sock, self.HANDSHAKE, DEFAULT_CODEC.encode({"codec": chosen, "compression": compression}))
+
+    def _choose_compression(self, proposal):
+        """
+        :return: The first algorithm of the proposal that this node supports, None if it has compression disabled
+        """
+        if not self.compression:
+            return None
+        return next((name for name in proposal if name in COMPRESSORS), None)
+
+    def _compression_proposal(self):
+        return [self.compression] if self.compression else []
+
+    def _compressor(self, name):
+        """
+        :return: The Compressor of an algorithm, with the configured level if it is the algorithm of this node
+        """
+        return COMPRESSORS[name](self.compression_level if name == self.compression else None)
+
+    def _pack_body(self, codec, body, compressor):
+        """
+        Compresses the body of a frame if the connection has negotiated a compression and the body is large enough
+        The body is sent as it is if it does not get smaller
+        :return: A tuple (codec id of the header, body)
+        """
+        if compressor and len(body) >= self.compression_threshold:
+            compressed = compressor.compress(body)
+            if len(compressed) < len(body):
+                self.frames_compressed += 1
+                self.bytes_before_compression += len(body)
+                self.bytes_after_compression += len(compressed)
+                return codec.id | COMPRESSED, compressed
+        return codec.id, body
+
+    def _unpack_body(self, codec_id, body, compressor):
+        """
+        :return: A tuple (codec, body) with the codec of a received frame and its body decompressed
+        """
+        if codec_id & COMPRESSED:
+            if not compressor:
+                raise ValueError("Compressed frame on a connection without compression")
+            body = compressor.decompress(body, self.MAX_FRAME_SIZE)
+            codec_id &= ~COMPRESSED
+        return CODECS[codec_id], body
+
+    def _open_connection(self, conn):
+        """
+        Prepares a new client connection before it is shared: negotiates the codec and starts its reader
+        :param conn: The new PooledConnection
+        """
+        self._handshake(conn)
+        threading.Thread(target=self._read_responses, args=(conn,), daemon=True).start()
+
+    def _handshake(self, conn):
+        """
+        Negotiates the codec of a new client connection, JSON is used if the peer does not answer a known codec
+        :param conn: The PooledConnection to negotiate
+        """
+        conn.codec = DEFAULT_CODEC
+        proposal = {"codecs": list(self.PREFERRED_CODECS), "compression": self._compression_proposal()}
+        self._send_frame(conn.sock, self.HANDSHAKE, DEFAULT_CODEC.encode(proposal))
+        frame_response = self._recv_frame(conn.sock, self.RESPONSE_TIMEOUT)
+        if not frame_response.success or not frame_response.payload:
+            raise ConnectionError(f"Handshake failed: {frame_response.error}")
+        codec_id, body = frame_response.payload
+        if codec_id == self.HANDSHAKE:
+            answer = DEFAULT_CODEC.decode(body)
+            conn.codec = CODECS_BY_NAME.get(answer.get('codec'), DEFAULT_CODEC)
+            if answer.get('compression') in COMPRESSORS:
+                conn.compressor = self._compressor(answer['compression'])
+
+    def stats(self):
+        """
+        :return: A dict with the open connections, the bytes transferred, the compression and the state of the worker pool
+        """
+        stats = {
+            "connections_in": len([sock for sock in self.connections if sock is not self.server_sock]),
+            "connections_out": self.pool.connection_count(),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "frames_compressed": self.frames_compressed,
+            "bytes_before_compression": self.bytes_before_compression,
+            "bytes_after_compression": self.bytes_after_compression,
+        }
+        stats.update((f"workers_{name}", value) for name, value in self.workers.stats().items())
+        return stats
+
+    def _send_frame(self, sock, codec_id, body):
+        """
+        Sends a message as a single frame: a header with the codec id and the body length followed by the body
+        :param sock: The connected socket
+        :param codec_id: The id of the codec used to encode the body, HANDSHAKE for the codec negotiation
+        :param body: The encoded message
+        """
+        sock.sendall(self.FRAME_HEADER.pack(codec_id, len(body)) + body)
+        self.bytes_sent += self.FRAME_HEADER.size + len(body)
+
+    def _recv_exactly(self, sock, size):
+        """
+        Reads exactly 'size' bytes from the socket using as few recv calls as possible
+        :return: A bytearray with the data read, or None if the peer closed the connection before the first byte
+        """
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            n = sock.recv_into(view[received:], size - received)
+            if not n:
+                if received == 0:
+                    return None
+                raise ConnectionError(f"Connection closed after {received} of {size} bytes")
+            received += n
+        return buffer
 
-    # sock.setblocking(True) is equivalent to sock.settimeout(None)
-    # sock.setblocking(False) is equivalent to sock.settimeout(0.0)
-    def _recv_alldata(self, sock, timeout, end_time):
+    def _recv_frame(self, sock, timeout):
         """
-        Receives all the data sended by other servers node
-        :return: A Response object containing the data received
+        Receives one framed message sended by other server node
+        :param sock: The connected socket
+        :param timeout: The maximum time to wait for the frame
+        :return: A Response object whose payload is a tuple (codec id, body), or None if the peer closed the connection
         """
+        data_response = Response()
         try:
-            data_response = Response()
-            fragments = []
-            max_buff = 1024
-            #sock.setblocking(True)
             sock.settimeout(timeout)
-            while True: 
-                chunk = sock.recv(max_buff).decode('utf-8')
-                fragments.append(chunk)
-                #sock.setblocking(False)
-                sock.settimeout(end_time)
-                if not chunk: #len(chunk) < max_buff:
-                    break
-            
+            header = self._recv_exactly(sock, self.FRAME_HEADER.size)
+            if header is None:
+                data_response.success = True
+                return data_response
+
+            codec_id, size = self.FRAME_HEADER.unpack(header)
+            if size > self.MAX_FRAME_SIZE:
+                raise ValueError(f"Frame of {size} bytes exceeds MAX_FRAME_SIZE")
+            if codec_id != self.HANDSHAKE and codec_id & ~COMPRESSED not in CODECS:
+                raise ValueError(f"Unknown codec {codec_id}")
+
+            body = self._recv_exactly(sock, size) if size else bytearray()
+            if body is None:
+                raise ConnectionError("Connection closed before the frame body")
+            self.bytes_received += self.FRAME_HEADER.size + size
+            data_response.payload = (codec_id, body)
+            data_response.success = True
+            return data_response
+
         except socket.timeout as e:
-            logger.exception(f" ERROR SERVER ID: {self.node.id} TIMEOUT _recv_alldata")
+            logger.exception(f" ERROR SERVER ID: {self.node.id} TIMEOUT _recv_frame")
             data_response.success = False
-            data_response.error = f"ERROR _recv_alldata TIMEOUT: {e}"
+            data_response.error = f"ERROR _recv_frame TIMEOUT: {e}"
+            return data_response
+        except (OSError, ValueError) as e:
+            if self.signal_thread:
+                # The sockets closed by stop_server are not an error
+                logger.error(f" ERROR SERVER ID: {self.node.id} _recv_frame: {e}")
+            data_response.success = False
+            data_response.error = f"ERROR _recv_frame: {e}"
             return data_response
-        except socket.error as e:
-            # 10035: Windows
-            # 11: Linux
-            # Code 10035 or 11: recv has no data available to read, the message has ended
-            errno = e.errno
-            # EAGAIN or EWOULDBLOCK codes
-            if errno != 10035 and errno != 11:
-                logger.error(f" ERROR SERVER ID: {self.node.id} _recv_alldata: {e}")
-                data_response.success = False
-                data_response.error = f"ERROR _recv_alldata: {e}"
-                return data_response
-        
-        data = ''.join(fragments)
-        data_response.payload = data
-        data_response.success = True
-        return data_response   
 
     def _handle_requests(self):
         """ 
         Manages the connections with others servers and handle the data received
-        Runs a thread per every request sended by other server node
+        Every request sended by other server node is queued in the worker pool
         """
         while self.signal_thread:
             
-            read_sockets,write_sockets,error_sockets = select.select(self.connections,[],[])
+            try:
+                read_sockets,write_sockets,error_sockets = select.select(self.connections,[],[])
+            except (OSError, ValueError) as e:
+                # The sockets are closed by stop_server while waiting
+                if not self.signal_thread:
+                    break
+                # A connection has been closed after it was passed to select, it is removed and the loop goes on
+                logger.error(f" ERROR SERVER ID: {self.node.id} _handle_requests: {e}")
+                self._close_bad_sockets()
+                continue
 
             for sock in read_sockets:
+                if not self.signal_thread:
+                    break
                 try:
                     if sock == self.server_sock:
                         sockfd, address = self.server_sock.accept()
-                        self.connections.append(sockfd)
+                        with self.connections_lock:
+                            self.write_locks[sockfd] = threading.Lock()
+                            self.connections.append(sockfd)
                         logger.info(f"Client connected {address} on {self.host}:{self.port}")
                     else:
-                        data_response = self._recv_alldata(sock, None, 0.0)
+                        data_response = self._recv_frame(sock, self.RESPONSE_TIMEOUT)
                         if data_response.success and data_response.payload:
-                            threading.Thread(target=self._handle_data, args=(data_response.payload, sock, )).start()
+                            self._dispatch(data_response.payload, sock)
                         else:
-                            if sock in self.connections:
-                                self.connections.remove(sock)
-                            sock.close()
+                            self._close_client(sock)
                 except Exception as e:
                     logger.exception(f" ERROR SERVER ID: {self.node.id} _handle_requests")
-                    sock.close()
-                    if sock in self.connections:
-                        self.connections.remove(sock)
+                    self._close_client(sock)
+
+    def _close_client(self, sock):
+        """
+        Closes a connection accepted by the server
+        It is called by the select loop and by the workers
+        """
+        with self.connections_lock:
+            if sock in self.connections:
+                self.connections.remove(sock)
+            self.write_locks.pop(sock, None)
+            self.compressors.pop(sock, None)
+        sock.close()
+
+    def _close_bad_sockets(self):
+        """
+        Removes the accepted connections that select does not accept, the sockets closed or in error
+        """
+        for sock in list(self.connections):
+            if sock is self.server_sock:
+                continue
+            try:
+                select.select([sock], [], [], 0)
+            except (OSError, ValueError):
+                self._close_client(sock)
 
     def start_server(self):
         """ 
@@ -134,6 +397,7 @@ class TCPClientServer:
         server_status = self.init_server()
         if server_status.success:
             self.signal_thread = True
+            self.workers.start()
             threading.Thread(target=self._handle_requests).start()
         return server_status
 
@@ -144,7 +408,16 @@ class TCPClientServer:
         try:
             print(f"stop server 0: {self.node.id}")
             self.signal_thread = False
+            # Closing the accepted sockets lets the peers notice the stop instead of waiting for a response
+            for sock in list(self.connections):
+                if sock is not self.server_sock:
+                    sock.close()
             self.connections.clear()
+            self.write_locks.clear()
+            self.compressors.clear()
+            for future in self.pool.close_all():
+                self._complete(future, success=False, error="ERROR send_message: server stopped")
+            self.workers.stop()
             if self.server_sock:
                 #self.server_sock.close()
                 self.server_sock.shutdown(SHUT_RDWR)
@@ -156,26 +429,98 @@ class TCPClientServer:
             if self.server_sock:
                 self.server_sock.close()
         
-    def send_message(self, host, port, message):
-        """ 
-        Establish a tcp connection with other server node and tries to sends a message 
+    def submit_message(self, host, port, message, timeout=None):
+        """
+        Sends a message to other server node without waiting for its response
+        Every request to a node shares the same connection, it is tagged with a request id
+        and its response is matched by the reader of the connection, in any order
         :param host: The server node host
         :param port: The server node port
-        :param message: The String message to be send
-        :return: A Response object with the result of the operation sended by the node contacted
+        :param message: The message as a dict, it is encoded with the codec negotiated for the connection
+        :param timeout: The maximum time to wait for the connection and the response, RESPONSE_TIMEOUT by default
+        :return: A Future whose result is a Response object with the decoded response sended by the node contacted
         """
+        timeout = timeout or self.RESPONSE_TIMEOUT
+        future = Future()
+        conn = None
+        request_id = None
         try:
-            server_response = Response()
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            sock.sendall(message.encode('utf-8'))
-            server_response = self._recv_alldata(sock, self.RESPONSE_TIMEOUT, 0.0)
-            return server_response
+            conn, _ = self.pool.acquire(host, port, timeout, self._open_connection)
+            request_id = conn.add_request(future, timeout)
+            if request_id is None:
+                # The connection has been closed as idle after it was acquired, a new one is opened
+                self.pool.discard(conn)
+                conn, _ = self.pool.acquire(host, port, timeout, self._open_connection)
+                request_id = conn.add_request(future, timeout)
+            if request_id is None:
+                raise ConnectionError("Connection closed")
+            codec_id, body = self._pack_body(conn.codec, conn.codec.encode(dict(message, request_id=request_id)),
+                                             conn.compressor)
+            with conn.send_lock:
+                self._send_frame(conn.sock, codec_id, body)
         except Exception as e:
-            logger.exception(f" ERROR SERVER ID: {self.node.id} send_message")
-            server_response.success = False
-            server_response.error = f"ERROR send_message: {e}"
-            return server_response
-        finally:
-            sock.close()
-            
\ No newline at end of file
+            logger.error(f" ERROR SERVER ID: {self.node.id} send_message to {host}:{port}: {repr(e)}")
+            # The future may have been completed by the reader of the connection already
+            if request_id is None or conn.pop_request(request_id):
+                self._complete(future, success=False, error=f"ERROR send_message: {e}")
+            if request_id is not None:
+                # The frame may have been partially written, the connection can not be used anymore
+                self._close_connection(conn, f"ERROR send_message: {e}")
+        return future
+
+    def send_message(self, host, port, message, timeout=None):
+        """ 
+        Sends a message to other server node and waits for its response
+        :return: A Response object whose payload is the decoded response sended by the node contacted
+        """
+        return self.submit_message(host, port, message, timeout).result()
+
+    def _read_responses(self, conn):
+        """
+        Reads the responses of a client connection and completes the Future of their request
+        Runs in a thread per connection, it also expires the requests whose timeout has passed
+        and closes the connection when it has been idle for too long
+        :param conn: The PooledConnection
+        """
+        error = "ERROR send_message: connection closed by the peer"
+        try:
+            while conn.is_alive():
+                readable, _, _ = select.select([conn.sock], [], [], self.SWEEP_INTERVAL)
+                for future in conn.expired_requests():
+                    self._complete(future, success=False, error="ERROR send_message TIMEOUT")
+                if not readable:
+                    if conn.close_if_idle(self.pool.idle_timeout):
+                        break
+                    continue
+
+                frame_response = self._recv_frame(conn.sock, self.RESPONSE_TIMEOUT)
+                if not frame_response.success or not frame_response.payload:
+                    error = frame_response.error or error
+                    break
+                codec, body = self._unpack_body(*frame_response.payload, conn.compressor)
+                response = codec.decode(body)
+                future = conn.pop_request(response.get('request_id'))
+                # A response without a pending request belongs to a request that has expired
+                if future:
+                    self._complete(future, success=True, payload=response)
+        except (OSError, ValueError) as e:
+            error = f"ERROR send_message: {e}"
+        self._close_connection(conn, error)
+
+    def _close_connection(self, conn, error):
+        """
+        Closes a client connection, failing every request still waiting for its response
+        """
+        for future in self.pool.discard(conn):
+            self._complete(future, success=False, error=error)
+
+    def _complete(self, future, success, payload=None, error=''):
+        """
+        Sets the Response object result of the Future of a request
+        """
+        if not future.set_running_or_notify_cancel():
+            return
+        server_response = Response(payload=payload)
+        server_response.success = success
+        server_response.error = error
+        future.set_result(server_response)
@@ -0,0 +1,99 @@
+import threading, collections, contextvars, random, time
+
+
+class Tracer:
+    """
+    Samples the requests of the ring and records the spans of the sampled ones in a ring buffer of fixed size
+    The trace of a request is a pair [trace id, sampled] decided by the node that starts it and sent with
+    every request made to handle it, so a request is traced in every hop or in none.
+    The trace of the request being handled is kept in a context variable, that follows the worker thread
+    or the event loop task handling it. An unsampled request only carries the pair, no span is recorded
+    """
+
+    SAMPLE_RATE = 0.01
+    CAPACITY = 4096
+    UNSAMPLED = (0, False)
+
+    def __init__(self, sample_rate=SAMPLE_RATE, capacity=CAPACITY):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.spans = collections.deque(maxlen=capacity) # The oldest spans are dropped when it is full
+        self.current = contextvars.ContextVar("trace", default=None)
+        self.lock = threading.Lock()
+        self.traces = 0 # Sampled traces started by this node
+        self.recorded = 0
+
+    def propagate(self):
+        """
+        :return: The trace sent with a request, the one of the request being handled or a new one if there is none
+        """
+        trace = self.current.get()
+        if trace is not None:
+            return trace
+        if random.random() >= self.sample_rate:
+            return self.UNSAMPLED
+        with self.lock:
+            self.traces += 1
+        return (random.getrandbits(63) or 1, True)
+
+    def enter(self, trace):
+        """
+        Makes a trace the one of the request being handled
+        :return: The token that restores the previous trace in leave
+        """
+        return self.current.set(trace)
+
+    def leave(self, token):
+        self.current.reset(token)
+
+    @staticmethod
+    def sampled(trace):
+        return bool(trace and trace[1])
+
+    def record(self, trace, kind, type, node, peer, start, success, queue_wait=0.0):
+        """
+        Records a span of a sampled trace, it ends now
+        :param kind: 'handle' for a request handled by the node, 'send' for a request sent to other node
+        :param type: The type of the request
+        :param node: The node id recording the span
+        :param peer: The node id that sent or received the request
+        :param start: The perf_counter time the span started
+        :param queue_wait: The time the request waited to be handled, only for the 'handle' spans
+        """
+        duration = time.perf_counter() - start
+        span = {
+            "trace_id": trace[0],
+            "kind": kind,
+            "type": str.__str__(type) if isinstance(type, str) else type,
+            "node": node,
+            "peer": peer,
+            "start": time.time() - duration,
+            "queue_wait": queue_wait,
+            "duration": duration,
+            "success": success,
+        }
+        with self.lock:
+            self.spans.append(span)
+            self.recorded += 1
+
+    def dump(self, trace_id=None):
+        """
+        :param trace_id: Only the spans of this trace are returned if it is set
+        :return: A list with the spans in the buffer, the oldest first
+        """
+        with self.lock:
+            spans = list(self.spans)
+        if trace_id is not None:
+            spans = [span for span in spans if span['trace_id'] == trace_id]
+        return spans
+
+    def stats(self):
+        """
+        :return: A dict with the sampled traces started, the spans recorded and the spans in the buffer
+        """
+        with self.lock:
+            return {
+                "sampled_traces": self.traces,
+                "spans_recorded": self.recorded,
+                "spans_buffered": len(self.spans),
+            }
@@ -1,14 +1,21 @@
 import enum
 
 class Type(str, enum.Enum):
-    NOTIFY           = 'NOTIFY'
-    GET_CPF          = 'GET_CPF'
-    GET_KEYS         = 'GET_KEYS'
-    SET_DATA         = 'SET_DATA'
-    GET_DATA         = 'GET_DATA'
-    REPLICATION      = 'REPLICATION'
-    CHECK_STATUS     = 'CHECK_STATUS'
-    GET_SUCCESSOR    = 'GET_SUCCESSOR'
-    FIND_SUCCESSOR   = 'FIND_SUCCESSOR'
-    GET_PREDECESSOR  = 'GET_PREDECESSOR'
-    FIND_PREDECESSOR = 'FIND_PREDECESSOR'
\ No newline at end of file
+    NOTIFY              = 'NOTIFY'
+    GET_CPF             = 'GET_CPF'
+    GET_KEYS            = 'GET_KEYS'
+    SET_DATA            = 'SET_DATA'
+    GET_DATA            = 'GET_DATA'
+    SET_MANY            = 'SET_MANY'
+    GET_MANY            = 'GET_MANY'
+    REPLICATION         = 'REPLICATION'
+    CHECK_STATUS        = 'CHECK_STATUS'
+    GET_SUCCESSOR       = 'GET_SUCCESSOR'
+    GET_SUCCESSOR_LIST  = 'GET_SUCCESSOR_LIST'
+    FIND_SUCCESSOR      = 'FIND_SUCCESSOR'
+    GET_PREDECESSOR     = 'GET_PREDECESSOR'
+    FIND_PREDECESSOR    = 'FIND_PREDECESSOR'
+    STATS               = 'STATS'
+    CACHE_PUSH          = 'CACHE_PUSH'
+    CACHE_INVALIDATE    = 'CACHE_INVALIDATE'
+    TRACES              = 'TRACES'
\ No newline at end of file
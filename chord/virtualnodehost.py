@@ -0,0 +1,119 @@
+import hashlib, os
+from chord.node import Node
+from chord.logger import logger
+from chord.chordnode import ChordNode
+from chord.scheduler import MaintenanceScheduler
+from chord.tcpclientserver import TCPClientServer
+
+
+class VirtualNodeHost:
+    """
+    Runs several ChordNode identities (virtual nodes) behind one listening socket
+    The virtual nodes share the server with its connection pool and worker pool, and a single maintenance scheduler
+    Every request is routed to the virtual node of its destination id, and the requests between virtual nodes
+    of the host are handled in the calling thread without using the socket
+    """
+
+    def __init__(self, host, port, count, mbits, data_dir=None, node_class=ChordNode):
+        """
+        :param count: The number of virtual nodes
+        :param data_dir: The directory of the durable storage, every virtual node uses a subdirectory
+        :param node_class: ChordNode or a subclass using the threaded TCPClientServer
+        """
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.nodes = []
+        for i in range(count):
+            node_data_dir = os.path.join(data_dir, f"vnode-{i}") if data_dir else None
+            node = node_class(self.virtual_id(host, port, i, mbits), host, port, mbits, node_data_dir)
+            node.job_suffix = f"#{i}"
+            self.nodes.append(node)
+        self.nodes_by_id = {node.id: node for node in self.nodes}
+        self.id = self.nodes[0].id # Used by the server in its log messages
+        self.server = TCPClientServer(host, port, self)
+        for node in self.nodes:
+            node.server = self.server
+            node.siblings = self.nodes_by_id
+        self.scheduler = None
+        self.job_nodes = dict() # Job name -> virtual node
+
+    @staticmethod
+    def virtual_id(host, port, index, mbits):
+        """
+        :return: The id of the virtual node 'index' of a host, the hash of 'host:port#index'
+        """
+        myhash = hashlib.sha1(f"{host}:{port}#{index}".encode())
+        return int(myhash.hexdigest(), 16) % 2**mbits
+
+    def node_for(self, message):
+        """
+        :return: The virtual node of the destination of the message
+                 The first one if the destination is unknown, any node can forward a request towards the key
+        """
+        return self.nodes_by_id.get(message.destination, self.nodes[0])
+
+    # Interface used by TCPClientServer
+
+    def decode_message(self, dict_message):
+        return self.nodes[0].decode_message(dict_message)
+
+    def message_priority(self, message):
+        return self.node_for(message).message_priority(message)
+
+    def reject_message(self, message):
+        return self.node_for(message).reject_message(message)
+
+    def process_message(self, message, queue_wait = 0.0):
+        return self.node_for(message).process_message(message, queue_wait)
+
+    def process_message_future(self, message, queue_wait = 0.0):
+        return self.node_for(message).process_message_future(message, queue_wait)
+
+    # Lifecycle
+
+    def start(self, node = None):
+        """
+        Starts the server and the scheduler, and creates a ring or joins the virtual nodes to one
+        :param node: A node of the ring to join, None to create a new ring
+        :return: True if every virtual node is part of the ring, False otherwise
+        """
+        server_status = self.server.start_server()
+        if not server_status.success:
+            logger.error(f"VirtualNodeHost {self.host}:{self.port}: {server_status.error}")
+            return False
+
+        self.scheduler = MaintenanceScheduler(name=f"maintenance-{self.port}")
+        self.scheduler.observer = self._observe_maintenance
+        for vnode in self.nodes:
+            vnode.server_started = True
+            vnode.scheduler = self.scheduler
+            vnode.create()
+            for name in vnode.add_jobs(self.scheduler, vnode.maintenance_functions()):
+                self.job_nodes[name] = vnode
+        self.scheduler.start()
+
+        # The first virtual node creates the ring or joins it, the rest join through it
+        entry = node or Node(self.nodes[0].id, self.host, self.port)
+        joined = True
+        for vnode in self.nodes:
+            if vnode is self.nodes[0] and not node:
+                continue
+            if not vnode.join(entry):
+                logger.error(f"VirtualNodeHost: virtual node {vnode.id} could not join {entry.host}:{entry.port}")
+                joined = False
+        return joined
+
+    def stop(self):
+        if self.scheduler:
+            self.scheduler.stop()
+        self.server.stop_server()
+        for vnode in self.nodes:
+            vnode.server_started = False
+            vnode.own_data.close()
+            vnode.replicated_data.close()
+
+    def _observe_maintenance(self, name, duration, changed):
+        vnode = self.job_nodes.get(name)
+        if vnode:
+            vnode._observe_maintenance(name, duration, changed)
@@ -0,0 +1,105 @@
+import queue, threading, time, itertools
+from chord.logger import logger
+
+
+class WorkerPool:
+    """
+    Fixed number of worker threads fed by a bounded priority queue
+    Lower priority values are served first, tasks with the same priority are served in arrival order
+    """
+
+    # The handlers of the node never wait for other nodes: a forwarded request releases its worker and is resumed
+    # by a new task when the response arrives. A worker is held only while a request runs locally, which includes
+    # waiting for the group commit of the durable storage, so WORKERS bounds the writes that share one commit
+    # rather than the requests in flight, those are bounded by MAX_QUEUE and the timeouts of the requests
+    WORKERS = 32
+    MAX_QUEUE = 1024
+
+    def __init__(self, workers=WORKERS, max_queue=MAX_QUEUE, name="worker"):
+        super().__init__()
+        self.workers = workers
+        self.name = name
+        self.tasks = queue.PriorityQueue(max_queue)
+        self.sequence = itertools.count()
+        self.threads = []
+        self.running = False
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.started = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.threads = [threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+                        for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stops the workers once they finish their current task, the queued tasks are discarded
+        """
+        self.running = False
+        while True:
+            try:
+                self.tasks.get_nowait()
+            except queue.Empty:
+                break
+        for _ in self.threads:
+            self.tasks.put((float('inf'), next(self.sequence), 0.0, None, ()))
+        self.threads = []
+
+    def submit(self, priority, func, *args):
+        """
+        Queues a task to be run by a worker
+        :param priority: The priority of the task, lower values run first
+        :param func: The function to run
+        :return: True if the task was queued, False if the queue is full
+        """
+        try:
+            self.tasks.put_nowait((priority, next(self.sequence), time.monotonic(), func, args))
+            with self.lock:
+                self.submitted += 1
+            return True
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+
+    def _work(self):
+        while self.running:
+            priority, _, queued_at, func, args = self.tasks.get()
+            if func is None:
+                break
+            wait = time.monotonic() - queued_at
+            with self.lock:
+                self.started += 1
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+            try:
+                func(*args)
+            except Exception as e:
+                logger.exception(f" ERROR {self.name} task")
+            finally:
+                with self.lock:
+                    self.completed += 1
+
+    def stats(self):
+        """
+        :return: A dict with the queue depth and the time the tasks waited in the queue
+        """
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.tasks.qsize(),
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "wait_avg": self.wait_total / self.started if self.started else 0.0,
+                "wait_max": self.wait_max,
+            }
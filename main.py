@@ -1,5 +1,6 @@
 from chord.client import Client
 from chord.node import Node
+from chord.virtualnodehost import VirtualNodeHost
 import sys, enum, hashlib
 
 class Command(str, enum.Enum):
@@ -7,6 +8,7 @@ class Command(str, enum.Enum):
     SET     = 'SET'
     JOIN    = 'JOIN'
     CREATE  = 'CREATE'
+    STATS   = 'STATS'
 
 class Flag(str, enum.Enum):
     NODEHOST  = "-nh"
@@ -14,6 +16,8 @@ class Flag(str, enum.Enum):
     PORT      = "-p"
     KEY       = "-k"
     VALUE     = "-v"
+    DATADIR   = "-d"
+    VNODES    = "-vn"
     HELP      = "-h"
 
 def hash_val(value):
@@ -24,7 +28,9 @@ def createUsage():
     return (f"\nCOMMAND: {Command.CREATE} [OPTIONS] \n" +
             " Starts a new chord network \n" +
             " OPTIONS: \n" +
-           f"   [{Flag.PORT}] <PORT> The port where you will listening. Default 5000 \n"
+           f"   [{Flag.PORT}] <PORT> The port where you will listening. Default 5000 \n" +
+           f"   [{Flag.DATADIR}] <DIR>  The directory where the data is kept between restarts. Default in memory \n" +
+           f"   [{Flag.VNODES}] <COUNT> The number of virtual nodes served by the port. Default 1 \n"
     )
 
 def joinUsage():
@@ -33,7 +39,9 @@ def joinUsage():
             " OPTIONS: \n" +
            f"  {Flag.NODEHOST}  <NODEHOST>   The node host to join \n" +
            f"  {Flag.NODEPORT}  <NODEPORT>   The node port to join \n" +
-           f"  [{Flag.PORT}] <PORT>       The port where you will listening. Default 5000 \n"
+           f"  [{Flag.PORT}] <PORT>       The port where you will listening. Default 5000 \n" +
+           f"  [{Flag.DATADIR}] <DIR>        The directory where the data is kept between restarts. Default in memory \n" +
+           f"  [{Flag.VNODES}] <COUNT>     The number of virtual nodes served by the port. Default 1 \n"
            )
 
 def getUsage():
@@ -55,12 +63,21 @@ def setUsage():
             f"  {Flag.VALUE}  <VALUE>    The value to set \n" 
            )
 
+def statsUsage():
+    return (f"\nCOMMAND: {Command.STATS} [OPTIONS] \n" +
+            " Shows the metrics of a node in text format \n" +
+            " OPTIONS: \n" +
+            f"  {Flag.NODEHOST} <NODEHOST> The node host \n" +
+            f"  {Flag.NODEPORT} <NODEPORT> The node port \n"
+           )
+
 def usage():
     print("USAGE: <COMMAND> [OPTIONS] \n" +
             createUsage(),
             joinUsage(),
             getUsage(),
-            setUsage()
+            setUsage(),
+            statsUsage()
         )
 
 def create_node(host, port):
@@ -98,6 +115,8 @@ def main():
     node_host   = None
     node_port   = None
     command     = None
+    data_dir    = None
+    vnodes      = 1
 
     orign_key   = None
 
@@ -128,6 +147,12 @@ def main():
         elif (argv[i] == Flag.VALUE and (argn-i) >= 2):
             i += 1
             value = str(argv[i])
+        elif (argv[i] == Flag.DATADIR and (argn-i) >= 2):
+            i += 1
+            data_dir = str(argv[i])
+        elif (argv[i] == Flag.VNODES and (argn-i) >= 2):
+            i += 1
+            vnodes = int(argv[i])
         else:
             pass
         i += 1
@@ -146,11 +171,20 @@ def main():
     try:
         client_address = client_host +':'+ str(client_port)
         client_id = hash_val(client_address)
-        client = Client(client_id, client_host, client_port)
+        client = Client(client_id, client_host, client_port, data_dir=data_dir)
 
         node = create_node(node_host, node_port)
 
-        if command == Command.CREATE:
+        if command in (Command.CREATE, Command.JOIN) and vnodes > 1:
+            if command == Command.JOIN and not node:
+                print(joinUsage())
+            else:
+                host = VirtualNodeHost(client_host, client_port, vnodes, Client.MBITS, data_dir)
+                if host.start(node if command == Command.JOIN else None):
+                    print(f"{vnodes} virtual nodes started at ({client_host}:{client_port})")
+                else:
+                    print(f"Fail to start the virtual nodes at ({client_host}:{client_port})")
+        elif command == Command.CREATE:
             client.start()
         elif command == Command.JOIN:
             if node:
@@ -170,6 +204,12 @@ def main():
                 handle_response(response, command, orign_key)
             else:
                 print(setUsage())
+        elif command == Command.STATS:
+            if node:
+                stats = client.stats(node, 'text')
+                print(stats if stats else "\nERROR: Response not provided \n")
+            else:
+                print(statsUsage())
         else:
             print(f"COMMAND: {command} NOT FOUND \n")
             usage()
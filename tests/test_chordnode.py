@@ -0,0 +1,149 @@
+import unittest
+from chord.chordnode import ChordNode
+from chord.consistency import Consistency
+from chord.node import Node
+from chord.steps import FirstOf, Send
+from chord.type import Type
+
+HOST  = '127.0.0.1'
+MBITS = 16
+
+
+def entry(id):
+    return {"id": id, "host": HOST, "port": id}
+
+
+class SuccessorListTest(unittest.TestCase):
+    """
+    The protocol state of a node that is not started, no message is sent
+    """
+
+    def setUp(self):
+        self.node = ChordNode(100, HOST, 100, MBITS)
+        self.node.create()
+        self.node.successor.update(entry(300))
+
+    def successor_ids(self):
+        return [node.id for node in self.node.successor_list]
+
+    def test_list_follows_the_successor(self):
+        self.node._apply_successor_state({"predecessor": entry(100), "successors": [entry(400), entry(500)]})
+        self.assertEqual(self.node.successor.id, 300)
+        self.assertEqual(self.successor_ids(), [300, 400, 500])
+
+    def test_closer_node_keeps_the_old_successor_in_the_list(self):
+        self.node._apply_successor_state({"predecessor": entry(200), "successors": [entry(400), entry(500)]})
+        self.assertEqual(self.node.successor.id, 200)
+        self.assertEqual(self.successor_ids(), [200, 300, 400, 500])
+        self.assertEqual(self.node.successor_list[1].port, 300)
+
+    def test_list_stops_at_the_node_and_its_size(self):
+        self.node._apply_successor_state({"predecessor": None, "successors": [entry(400), entry(100), entry(300)]})
+        self.assertEqual(self.successor_ids(), [300, 400])
+        self.node._apply_successor_state({"predecessor": entry(300),
+                                          "successors": [entry(id) for id in range(400, 1000, 100)]})
+        self.assertEqual(len(self.node.successor_list), ChordNode.SUCCESSOR_LIST_SIZE)
+        self.assertEqual(self.successor_ids(), [300, 400, 500, 600])
+
+
+class GetStepsTest(unittest.TestCase):
+    """
+    The answers of a node that is not started to the GET requests that reach it
+    """
+
+    def setUp(self):
+        self.node = ChordNode(100, HOST, 100, MBITS)
+        self.node.create()
+        self.node.successor.update(entry(300))
+        self.node.predecessor = Node(50, HOST, 50)
+        self.pushes = []
+        self.node.send_request_future = lambda type, key, node, data, **kwargs: self.pushes.append((type, node.id, data))
+
+    def answer(self, key, read=None):
+        """
+        :return: The response of the node, the test fails if it forwards the request
+        """
+        steps = self.node._get_steps(key, read)
+        try:
+            step = next(steps)
+        except StopIteration as stop:
+            return stop.value
+        self.fail(f"the request was forwarded: {step}")
+
+    def forwards(self, key, read=None):
+        return isinstance(next(self.node._get_steps(key, read)), Send)
+
+    def test_owner_answers_from_its_data_not_a_cached_copy(self):
+        self.node.own_data.set_key_value(80, "owned")
+        self.node.cache.set_key_value(80, ("cached", 0))
+        response = self.answer(80, {"consistency": Consistency.ANY})
+        self.assertEqual(response['payload'], "owned")
+        self.assertEqual(response['version'], self.node.own_data.version)
+        self.assertFalse(response['replica'])
+
+    def test_cached_copy_answers_as_a_replica(self):
+        self.node.cache.set_key_value(200, ("cached", 7))
+        response = self.answer(200, {"consistency": Consistency.ANY})
+        self.assertEqual((response['payload'], response['version'], response['replica']), ("cached", 7, True))
+        self.assertTrue(self.forwards(200, {"consistency": Consistency.OWNER}))
+
+    def test_nearest_read_checks_the_version_of_the_copy(self):
+        self.node.cache.set_key_value(200, ("cached", 7))
+        self.assertEqual(self.answer(200, {"consistency": Consistency.NEAREST, "version": 7})['payload'], "cached")
+        self.assertTrue(self.forwards(200, {"consistency": Consistency.NEAREST, "version": 8}))
+        # A copy without version does not answer a read that asks for one
+        self.node.cache.set_key_value(200, ("cached", None))
+        self.assertTrue(self.forwards(200, {"consistency": Consistency.NEAREST, "version": 1}))
+        self.assertEqual(self.answer(200, {"consistency": Consistency.NEAREST})['payload'], "cached")
+
+    def test_hot_key_is_pushed_with_its_version_only_for_copy_reads(self):
+        self.node.hot_keys.threshold = 1
+        self.node.own_data.set_key_value(80, "owned")
+        path = [entry(300)]
+        self.answer(80, {"consistency": Consistency.OWNER, "path": path})
+        self.assertEqual(self.pushes, [])
+        self.answer(80, {"consistency": Consistency.ANY, "path": path})
+        self.assertEqual(self.pushes, [(Type.CACHE_PUSH, 300, {"key": 80, "value": "owned",
+                                                              "version": self.node.own_data.version,
+                                                              "ttl": self.node.hot_keys.ttl})])
+
+
+class IterativeLookupStepsTest(unittest.TestCase):
+    """
+    The hops of an iterative lookup are answered by the test instead of other nodes
+    """
+
+    def setUp(self):
+        self.node = ChordNode(100, HOST, 100, MBITS)
+        self.node.create()
+        self.node.lookup_iterative = True
+        self.node._apply_successor_state({"predecessor": None, "successors": [entry(200), entry(300)]})
+        self.node.successor.update(entry(200))
+
+    def test_failed_probe_is_skipped(self):
+        steps = self.node._find_successor_iterative_steps(30000)
+        probes = next(steps)
+        self.assertIsInstance(probes, FirstOf)
+        self.assertEqual([send.node.id for send in probes.steps], [300, 200])
+        self.assertTrue(all(send.type == Type.GET_CPF for send in probes.steps))
+        # 300 does not answer, 200 knows a node closer to the key
+        self.assertIsNone(probes.accept(None))
+        self.assertIsNone(probes.accept({"successor": None, "nodes": [entry(20000), entry(300)]}))
+
+        probes = steps.send(None)
+        self.assertEqual([send.node.id for send in probes.steps], [20000])
+        successor = probes.accept({"successor": entry(30000), "nodes": []})
+        with self.assertRaises(StopIteration) as stop:
+            steps.send(successor)
+        self.assertEqual(stop.exception.value.id, 30000)
+
+    def test_lookup_fails_when_no_probe_answers(self):
+        steps = self.node._find_successor_iterative_steps(30000)
+        next(steps)
+        with self.assertRaises(StopIteration) as stop:
+            steps.send(None)
+        self.assertIsNone(stop.exception.value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import socket, threading, time, unittest
+from concurrent.futures import Future
+from chord.connectionpool import ConnectionPool
+
+HOST = '127.0.0.1'
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    """
+    The pool connects to a listening socket, nothing is sent over the connections
+    """
+
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind((HOST, 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        self.pool = ConnectionPool(idle_timeout=0.05)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.listener.close()
+
+    def test_connection_is_reused(self):
+        conn, reused = self.pool.acquire(HOST, self.port, 2)
+        self.assertFalse(reused)
+        self.assertEqual(self.pool.acquire(HOST, self.port, 2), (conn, True))
+        self.assertEqual(self.pool.connection_count(), 1)
+
+    def test_concurrent_acquires_open_a_single_connection(self):
+        setups = []
+        start = threading.Barrier(8)
+        acquired = []
+
+        def acquire():
+            start.wait()
+            acquired.append(self.pool.acquire(HOST, self.port, 2, setups.append)[0])
+        threads = [threading.Thread(target=acquire) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(setups), 1)
+        self.assertEqual({id(conn) for conn in acquired}, {id(setups[0])})
+
+    def test_failed_setup_does_not_share_the_connection(self):
+        def fail(conn):
+            raise ConnectionError("handshake failed")
+        with self.assertRaises(ConnectionError):
+            self.pool.acquire(HOST, self.port, 2, fail)
+        self.assertEqual(self.pool.connection_count(), 0)
+
+    def test_idle_connection_is_closed_only_without_pending_requests(self):
+        conn, _ = self.pool.acquire(HOST, self.port, 2)
+        request_id = conn.add_request(Future(), 10)
+        time.sleep(0.1)
+        self.assertFalse(conn.close_if_idle(self.pool.idle_timeout))
+        self.assertIsNotNone(conn.pop_request(request_id))
+        self.assertTrue(conn.close_if_idle(self.pool.idle_timeout))
+        # No request is added to the closed connection, a new one is opened
+        self.assertIsNone(conn.add_request(Future(), 10))
+        self.pool.discard(conn)
+        self.assertFalse(self.pool.acquire(HOST, self.port, 2)[1])
+
+    def test_requests_expire_and_close_returns_the_pending_ones(self):
+        conn, _ = self.pool.acquire(HOST, self.port, 2)
+        expiring, waiting = Future(), Future()
+        conn.add_request(expiring, 0.01)
+        conn.add_request(waiting, 10)
+        time.sleep(0.05)
+        self.assertEqual(conn.expired_requests(), [expiring])
+        self.assertEqual(self.pool.discard(conn), [waiting])
+        self.assertEqual(self.pool.connection_count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
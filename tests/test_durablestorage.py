@@ -0,0 +1,195 @@
+import os, shutil, tempfile, threading, time, unittest
+from chord.durablestorage import DurableStorage
+
+
+class DurableStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.storages = []
+
+    def tearDown(self):
+        for storage in self.storages:
+            storage.close(compact=False)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def open_storage(self, **kwargs):
+        storage = DurableStorage(self.path, **kwargs)
+        self.storages.append(storage)
+        return storage
+
+    def reopen(self, storage, compact=False, **kwargs):
+        storage.close(compact=compact)
+        self.storages.remove(storage)
+        return self.open_storage(**kwargs)
+
+    def segment_files(self):
+        return sorted(name for name in os.listdir(self.path) if name.startswith(DurableStorage.LOG_PREFIX))
+
+    def wait_snapshot(self, storage):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            with storage.commit:
+                if not storage.snapshotting and not storage.compact_requested:
+                    return
+            time.sleep(0.01)
+        self.fail("the snapshot did not finish")
+
+    def test_recovers_the_log(self):
+        storage = self.open_storage()
+        storage.set_key_value(30, "a")
+        storage.set_key_value(10, b"b")
+        storage.set_key_value(20, [1, 2])
+        storage.pop_key(30)
+        storage.update_store_data({40: "d", 10: "e"})
+        storage.pop_range(35, 45)
+
+        storage = self.reopen(storage)
+        self.assertEqual(storage.store, {10: "e", 20: [1, 2]})
+        self.assertEqual(list(storage.keys), [10, 20])
+
+    def test_recovers_a_clear(self):
+        storage = self.open_storage()
+        storage.set_key_value(1, "a")
+        storage.set_store_data({2: "b", 3: "c"})
+        storage.set_key_value(4, "d")
+
+        storage = self.reopen(storage)
+        self.assertEqual(storage.store, {2: "b", 3: "c", 4: "d"})
+
+    def test_truncates_a_torn_record(self):
+        storage = self.open_storage()
+        storage.set_key_value(1, "a")
+        storage.set_key_value(2, "b")
+        record = storage._encode_record(DurableStorage.SET, 3, "c")
+        storage.close(compact=False)
+        self.storages.remove(storage)
+
+        segment = os.path.join(self.path, self.segment_files()[-1])
+        valid = os.path.getsize(segment)
+        # A write interrupted by a crash: the header and part of the payload of a record
+        with open(segment, 'ab') as f:
+            f.write(record[:-6])
+
+        storage = self.open_storage()
+        self.assertEqual(storage.store, {1: "a", 2: "b"})
+        self.assertEqual(os.path.getsize(segment), valid)
+
+        # The new records follow the valid ones
+        storage.set_key_value(3, "c")
+        storage = self.reopen(storage)
+        self.assertEqual(storage.store, {1: "a", 2: "b", 3: "c"})
+
+    def test_stops_at_a_corrupt_record(self):
+        storage = self.open_storage()
+        storage.set_key_value(1, "a")
+        first = os.path.getsize(os.path.join(self.path, self.segment_files()[-1]))
+        storage.set_key_value(2, "b")
+        storage.set_key_value(3, "c")
+        storage.close(compact=False)
+        self.storages.remove(storage)
+
+        segment = os.path.join(self.path, self.segment_files()[-1])
+        with open(segment, 'r+b') as f:
+            f.seek(first + DurableStorage.RECORD_HEADER.size)
+            byte = f.read(1)
+            f.seek(first + DurableStorage.RECORD_HEADER.size)
+            f.write(bytes([byte[0] ^ 0xff]))
+
+        storage = self.open_storage()
+        self.assertEqual(storage.store, {1: "a"})
+        self.assertEqual(os.path.getsize(segment), first)
+
+    def test_rotates_the_log_into_a_snapshot(self):
+        storage = self.open_storage(snapshot_log_bytes=512)
+        for key in range(200):
+            storage.set_key_value(key, f"value-{key}")
+        storage.pop_key(0)
+        self.wait_snapshot(storage)
+
+        self.assertTrue(os.path.exists(os.path.join(self.path, DurableStorage.SNAPSHOT_FILE)))
+        segments = self.segment_files()
+        self.assertLess(len(segments), 3)
+        self.assertEqual(segments[-1], os.path.basename(storage._segment_path(storage.segment)))
+
+        storage = self.reopen(storage)
+        self.assertEqual(storage.store, {key: f"value-{key}" for key in range(1, 200)})
+        self.assertEqual(list(storage.keys), list(range(1, 200)))
+
+    def test_close_writes_a_snapshot(self):
+        storage = self.open_storage()
+        storage.update_store_data({key: key * 2 for key in range(50)})
+
+        storage = self.reopen(storage, compact=True)
+        self.assertEqual(storage.store, {key: key * 2 for key in range(50)})
+        # Every record is in the snapshot, the log segment of the new start is empty
+        self.assertEqual(self.segment_files(), [os.path.basename(storage._segment_path(storage.segment))])
+        self.assertEqual(storage.log_bytes, 0)
+
+    def test_snapshot_and_log_are_combined(self):
+        storage = self.open_storage()
+        storage.set_key_value(1, "a")
+        storage.set_key_value(2, "b")
+        storage.compact()
+        self.wait_snapshot(storage)
+        storage.set_key_value(2, "c")
+        storage.pop_key(1)
+
+        storage = self.reopen(storage)
+        self.assertEqual(storage.store, {2: "c"})
+
+    def test_compaction_waits_for_a_running_snapshot(self):
+        storage = self.open_storage()
+        release = threading.Event()
+        write_snapshot = storage._write_snapshot
+        storage._write_snapshot = lambda segment, items: (release.wait(5), write_snapshot(segment, items))
+        writes = []
+        write_records = storage._write_records
+        storage._write_records = lambda records: (writes.append(len(records)), write_records(records))
+
+        storage.set_key_value(1, "a")
+        storage.compact()
+        time.sleep(0.05)
+        storage.compact()
+        time.sleep(0.2)
+        # The second compaction does not make the commit thread spin while the first snapshot is written
+        self.assertLess(len(writes), 10)
+
+        release.set()
+        self.wait_snapshot(storage)
+        storage.set_key_value(2, "b")
+        storage = self.reopen(storage)
+        self.assertEqual(storage.store, {1: "a", 2: "b"})
+
+    def test_deferred_commits_complete_a_future(self):
+        storage = self.open_storage()
+        release = threading.Event()
+        write_records = storage._write_records
+        storage._write_records = lambda records: (release.wait(5), write_records(records))
+
+        with storage.deferred_commits():
+            storage.set_key_value(1, "a")
+            storage.update_store_data({2: "b", 3: "c"})
+        committed = storage.commit_future()
+        self.assertFalse(committed.done())
+        self.assertEqual(storage.get_key(2), "b")
+
+        release.set()
+        self.assertIsNone(committed.result(5))
+        self.assertTrue(storage.commit_future().done())
+        storage = self.reopen(storage)
+        self.assertEqual(storage.store, {1: "a", 2: "b", 3: "c"})
+
+    def test_commit_future_fails_with_the_write_log(self):
+        storage = self.open_storage()
+        def fail(records):
+            raise OSError("disk full")
+        storage._write_records = fail
+        with storage.deferred_commits():
+            storage.set_key_value(1, "a")
+        with self.assertRaises(OSError):
+            storage.commit_future().result(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import time, unittest
+from unittest import mock
+from chord.hotkeys import CountMinSketch, HotKeys
+from chord.node import Node
+
+
+def node(id):
+    return Node(id, '127.0.0.1', id)
+
+
+class CountMinSketchTest(unittest.TestCase):
+
+    def test_estimate_never_counts_less(self):
+        sketch = CountMinSketch(width=64)
+        counts = {key: key % 7 + 1 for key in range(200)}
+        for key, count in counts.items():
+            for _ in range(count):
+                sketch.add(key)
+        self.assertTrue(all(sketch.estimate(key) >= count for key, count in counts.items()))
+
+    def test_decay_halves_the_counts(self):
+        sketch = CountMinSketch()
+        for _ in range(9):
+            sketch.add("hot")
+        sketch.decay()
+        self.assertEqual(sketch.estimate("hot"), 4)
+
+
+class HotKeysTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hot_keys = HotKeys(threshold=3, ttl=10)
+
+    def test_key_is_hot_past_the_threshold(self):
+        self.assertEqual([self.hot_keys.record(7) for _ in range(4)], [False, False, True, True])
+
+    def test_copy_is_pushed_once_per_node(self):
+        self.assertEqual([n.id for n in self.hot_keys.new_holders(7, [node(1), node(2)], 5)], [1, 2])
+        self.assertEqual([n.id for n in self.hot_keys.new_holders(7, [node(2), node(3)], 5)], [3])
+        self.assertEqual(self.hot_keys.new_holders(7, [node(1)], 5), [])
+        self.assertEqual(self.hot_keys.stats()["pushes"], 3)
+
+    def test_change_returns_the_holders_and_rejects_older_values(self):
+        self.hot_keys.new_holders(7, [node(1), node(2)], 5)
+        self.assertEqual(sorted(n.id for n in self.hot_keys.pop_holders(7, 6)), [1, 2])
+        self.assertEqual(self.hot_keys.pop_holders(7, 6), [])
+        # A value read before the change is not pushed after it
+        self.assertEqual(self.hot_keys.new_holders(7, [node(1)], 5), [])
+        self.assertEqual(self.hot_keys.stats()["stale_pushes"], 1)
+        self.assertEqual([n.id for n in self.hot_keys.new_holders(7, [node(1)], 6)], [1])
+
+    def test_expired_copies_are_pushed_again(self):
+        now = time.monotonic()
+        self.hot_keys.new_holders(7, [node(1)], 5)
+        with mock.patch('chord.hotkeys.time.monotonic', return_value=now + 11):
+            self.assertEqual(self.hot_keys.pop_holders(8), [])
+            self.assertEqual([n.id for n in self.hot_keys.new_holders(7, [node(1)], 5)], [1])
+        with mock.patch('chord.hotkeys.time.monotonic', return_value=now + 22):
+            self.hot_keys.decay()
+        self.assertEqual(self.hot_keys.stats()["pushed_keys"], 0)
+
+    def test_table_keeps_the_last_keys(self):
+        hot_keys = HotKeys(max_keys=2)
+        for key in (1, 2, 3):
+            hot_keys.new_holders(key, [node(1)])
+        self.assertEqual(list(hot_keys.holders), [2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import time, unittest
+from unittest import mock
+from chord.lrucache import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_entries_expire_after_the_ttl(self):
+        cache = LRUCache()
+        self.assertEqual(cache.ttl, 10)
+        now = time.monotonic()
+        with mock.patch('chord.lrucache.time.monotonic', return_value=now):
+            cache.set_key_value(1, "a")
+            cache.set_key_value(2, "b", ttl=60)
+        with mock.patch('chord.lrucache.time.monotonic', return_value=now + 11):
+            self.assertIsNone(cache.get_key(1))
+            self.assertEqual(cache.get_key(2), "b")
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(max_entries=2)
+        cache.set_key_value(1, "a")
+        cache.set_key_value(2, "b")
+        cache.get_key(1)
+        cache.set_key_value(3, "c")
+        self.assertIsNone(cache.get_key(2))
+        self.assertEqual((cache.get_key(1), cache.get_key(3)), ("a", "c"))
+
+    def test_size_budget(self):
+        cache = LRUCache(max_bytes=300)
+        cache.set_key_value(1, "a" * 100)
+        cache.set_key_value(2, "b" * 100)
+        cache.set_key_value(3, "c" * 1000) # Larger than the whole budget, not cached
+        self.assertIsNone(cache.get_key(3))
+        cache.set_key_value(4, "d" * 100)
+        self.assertIsNone(cache.get_key(1))
+        self.assertLessEqual(cache.size, 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
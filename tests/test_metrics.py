@@ -0,0 +1,84 @@
+import socket, unittest
+from chord.chordnode import ChordNode
+from chord.metrics import Histogram, Metrics
+from chord.type import Type
+
+HOST  = '127.0.0.1'
+MBITS = 16
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def sample(samples, name, **labels):
+    return next(sample for sample in samples if sample["name"] == name and sample["labels"] == labels)
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_histogram_buckets_and_quantiles(self):
+        histogram = Histogram(buckets=(1, 2, 5))
+        for value in (0.5, 1, 1.5, 3, 3, 3, 3, 3, 3, 10):
+            histogram.observe(value)
+        collected = histogram.collect()
+        self.assertEqual(collected["buckets"], [[1, 2], [2, 3], [5, 9]])
+        self.assertEqual((collected["count"], collected["sum"]), (10, 31))
+        self.assertEqual((collected["p50"], collected["p99"]), (5, float('inf')))
+        self.assertIsNone(Histogram().quantile(0.5))
+
+    def test_samples_are_identified_by_their_labels(self):
+        metrics = Metrics()
+        metrics.inc("requests_total", (("type", "get"),))
+        metrics.inc("requests_total", (("type", "get"),), 2)
+        metrics.inc("requests_total", (("type", "set"),))
+        metrics.add_collector(lambda: [("keys", (("store", "own"),), 7)])
+        collected = metrics.collect()
+        self.assertEqual(sample(collected["counters"], "requests_total", type="get")["value"], 3)
+        self.assertEqual(sample(collected["counters"], "requests_total", type="set")["value"], 1)
+        self.assertEqual(sample(collected["gauges"], "keys", store="own")["value"], 7)
+        self.assertGreaterEqual(sample(collected["gauges"], "uptime_seconds")["value"], 0)
+
+    def test_exposition_format(self):
+        metrics = Metrics(prefix="test")
+        metrics.inc("errors_total", (("type", "get"),))
+        metrics.observe("latency_seconds", 0.003)
+        lines = metrics.exposition().splitlines()
+        self.assertIn("# TYPE test_errors_total counter", lines)
+        self.assertIn('test_errors_total{type="get"} 1', lines)
+        self.assertIn("# TYPE test_latency_seconds histogram", lines)
+        self.assertIn('test_latency_seconds_bucket{le="0.005"} 1', lines)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn("test_latency_seconds_count 1", lines)
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server_node = ChordNode(100, HOST, free_port(), MBITS)
+        self.client_node = ChordNode(200, HOST, free_port(), MBITS)
+        for node in (self.server_node, self.client_node):
+            node.create()
+            self.assertTrue(node.server.start_server().success)
+
+    def tearDown(self):
+        for node in (self.server_node, self.client_node):
+            node.server.stop_server()
+
+    def test_stats_reports_the_messages_handled(self):
+        for _ in range(3):
+            self.assertTrue(self.client_node.send_request(Type.CHECK_STATUS, 100, self.server_node))
+        stats = self.client_node.send_request(Type.STATS, 100, self.server_node)
+        handled = sample(stats["histograms"], "message_handle_seconds", type=Type.CHECK_STATUS.value)
+        self.assertEqual(handled["count"], 3)
+        sent = sample(self.client_node.stats()["histograms"], "request_seconds", type=Type.CHECK_STATUS.value)
+        self.assertEqual(sent["count"], 3)
+
+        text = self.client_node.send_request(Type.STATS, 100, self.server_node, {"format": "text"})
+        self.assertIn(f'chord_message_handle_seconds_count{{type="{Type.CHECK_STATUS.value}"}} 3', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,321 @@
+import shutil, socket, tempfile, threading, time, unittest
+from chord.chordnode import ChordNode
+from chord.asyncchordnode import AsyncChordNode
+from chord.virtualnodehost import VirtualNodeHost
+from chord.consistency import Consistency
+from chord.type import Type
+
+HOST  = '127.0.0.1'
+MBITS = 16
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+class RingTestCase(unittest.TestCase):
+    """
+    Starts the nodes of a small ring on localhost, ids of MBITS bits
+    """
+
+    node_class = ChordNode
+
+    def setUp(self):
+        self.nodes = []
+
+    def tearDown(self):
+        for node in self.nodes:
+            if node.server_started:
+                node.stop()
+
+    def start_node(self, id, entry=None, port=None, data_dir=None):
+        node = self.node_class(id, HOST, port or free_port(), MBITS, data_dir)
+        node.create()
+        self.assertTrue(node.start().success)
+        self.nodes.append(node)
+        if entry:
+            self.assertTrue(node.join(entry))
+        return node
+
+    def stop_node(self, node):
+        node.stop()
+        self.nodes.remove(node)
+
+    def wait_until(self, predicate, timeout=10, message="the ring did not converge"):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if predicate():
+                return
+            time.sleep(0.05)
+        self.fail(message)
+
+    def wait_ring(self, nodes):
+        """
+        Waits until the successor and predecessor of every node are its neighbours in the ring
+        """
+        ring = sorted(nodes, key=lambda node: node.id)
+
+        def converged():
+            return all(node.successor.id == ring[(i + 1) % len(ring)].id and
+                       node.predecessor and node.predecessor.id == ring[i - 1].id
+                       for i, node in enumerate(ring))
+        self.wait_until(converged)
+
+    def set_key(self, entry, key, value):
+        response = entry.send_request(Type.SET_DATA, key, entry, {"key": key, "value": value})
+        self.assertTrue(response and response['success'])
+
+
+class FailoverTest(RingTestCase):
+
+    def test_successor_fails_over_to_the_successor_list(self):
+        ids = [1000, 20000, 40000, 60000]
+        nodes = [self.start_node(ids[0])]
+        nodes += [self.start_node(id, nodes[0]) for id in ids[1:]]
+        self.wait_ring(nodes)
+        self.wait_until(lambda: len(nodes[0].successor_list) == len(ids) - 1)
+        self.assertEqual([node.id for node in nodes[0].successor_list], ids[1:])
+
+        values = {key: f"value-{key}" for key in range(0, 2**MBITS, 997)}
+        for key, value in values.items():
+            self.set_key(nodes[0], key, value)
+        replicated = {key for key in values if nodes[2]._is_local_key(key)}
+        self.wait_until(lambda: all(nodes[3].replicated_data.get_key(key) for key in replicated),
+                        message="the keys were not replicated")
+
+        # The successor and the next entry of the list fail at once
+        self.stop_node(nodes[1])
+        self.stop_node(nodes[2])
+        self.wait_until(lambda: nodes[0].successor.id == ids[3] and nodes[3].predecessor and
+                        nodes[3].predecessor.id == ids[0])
+        self.wait_until(lambda: nodes[0].successor_list and nodes[0].successor_list[0].id == ids[3])
+
+        # The keys of the last failed node are served from its replica, the replica of the other one is lost
+        for key in values:
+            if nodes[0]._is_local_key(key) or key in replicated:
+                response = nodes[3].send_request(Type.GET_DATA, key, nodes[3])
+                self.assertEqual(response['payload'], values[key], key)
+
+
+class AsyncFailoverTest(FailoverTest):
+
+    node_class = AsyncChordNode
+
+
+class IterativeLookupTest(RingTestCase):
+
+    def owner(self, ids, key):
+        return min((id for id in ids if id >= key), default=min(ids))
+
+    def wait_successor_lists(self, nodes):
+        """
+        Waits until the successor list of every node has the next nodes of the ring, the lookups use them as shortcuts
+        """
+        ring = sorted(nodes, key=lambda node: node.id)
+        size = min(len(ring) - 1, ChordNode.SUCCESSOR_LIST_SIZE)
+        self.wait_until(lambda: all([n.id for n in node.successor_list] ==
+                                    [ring[(i + j) % len(ring)].id for j in range(1, size + 1)]
+                                    for i, node in enumerate(ring)))
+
+    def test_lookups_find_the_owner(self):
+        ids = [1000, 14000, 27000, 40000, 53000, 60000]
+        nodes = [self.start_node(ids[0])]
+        nodes += [self.start_node(id, nodes[0]) for id in ids[1:]]
+        self.wait_ring(nodes)
+        self.wait_successor_lists(nodes)
+        for node in nodes:
+            node.lookup_iterative = True
+        for node in (nodes[0], nodes[3]):
+            for key in range(0, 2**MBITS, 1009):
+                successor = node.find_successor(key, cached=False)
+                self.assertIsNotNone(successor, key)
+                self.assertEqual(successor.id, self.owner(ids, key), key)
+
+
+class AsyncIterativeLookupTest(IterativeLookupTest):
+
+    node_class = AsyncChordNode
+
+
+class HotKeyTest(RingTestCase):
+
+    def test_copy_of_a_hot_key_is_invalidated_by_a_set(self):
+        first = self.start_node(1000)
+        middle, owner = self.start_node(20000, first), self.start_node(40000, first)
+        self.wait_ring([first, middle, owner])
+        owner.hot_keys.threshold = 1
+        # The reads of the middle node reach the owner, not its replica
+        middle._read_target = lambda node, consistency: None
+        self.set_key(owner, 30000, "a")
+
+        read = {"consistency": Consistency.ANY}
+        self.assertEqual(middle.send_request(Type.GET_DATA, 30000, middle, read)['payload'], "a")
+        self.wait_until(lambda: owner.hot_keys.stats()["pushes"] == 1, message="the hot key was not pushed")
+        response = middle.send_request(Type.GET_DATA, 30000, middle, read)
+        self.assertEqual((response['payload'], response['node_reached'], response['replica']), ("a", middle.id, True))
+        # Only the owner answers an OWNER read
+        response = middle.send_request(Type.GET_DATA, 30000, middle, {"consistency": Consistency.OWNER})
+        self.assertEqual(response['node_reached'], owner.id)
+
+        self.set_key(owner, 30000, "b")
+        self.wait_until(lambda: middle.cache.get_key(30000) is None, message="the copy was not invalidated")
+        response = middle.send_request(Type.GET_DATA, 30000, middle, {"consistency": Consistency.OWNER})
+        self.assertEqual(response['payload'], "b")
+
+
+class AsyncHotKeyTest(HotKeyTest):
+
+    node_class = AsyncChordNode
+
+
+class TracingTest(RingTestCase):
+
+    def test_sampled_request_is_traced_in_every_hop(self):
+        first = self.start_node(1000)
+        middle, owner = self.start_node(20000, first), self.start_node(40000, first)
+        self.wait_ring([first, middle, owner])
+        self.set_key(owner, 30000, "a")
+        first.tracer.sample_rate = 1.0
+        self.assertEqual(first.send_request(Type.GET_DATA, 30000, first)['payload'], "a")
+        first.tracer.sample_rate = 0.0
+
+        handled = [span for span in owner.tracer.dump()
+                   if span["type"] == Type.GET_DATA.value and span["kind"] == "handle"]
+        self.assertEqual(len(handled), 1)
+        trace_id = handled[0]["trace_id"]
+        self.assertEqual(handled[0]["node"], owner.id)
+        self.assertEqual(handled[0]["peer"], first.id)
+        spans = first.tracer.dump(trace_id)
+        self.assertIn(("send", first.id, owner.id), [(span["kind"], span["node"], span["peer"]) for span in spans])
+        self.assertTrue(all(span["success"] for span in spans))
+
+        # The spans of a trace are read from other node with TRACES
+        remote = first.send_request(Type.TRACES, owner.id, owner, {"trace_id": trace_id})
+        self.assertEqual(remote, owner.tracer.dump(trace_id))
+        # A lookup hop through the middle node, if there is one, is recorded with the same trace
+        for node in (first, middle, owner):
+            self.assertTrue(all(span["node"] == node.id for span in node.tracer.dump(trace_id)))
+
+
+class AsyncTracingTest(TracingTest):
+
+    node_class = AsyncChordNode
+
+
+class VirtualNodesTest(RingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.hosts = []
+
+    def tearDown(self):
+        for host in self.hosts:
+            host.stop()
+        super().tearDown()
+
+    def start_host(self, count, entry=None):
+        host = VirtualNodeHost(HOST, free_port(), count, MBITS)
+        self.hosts.append(host)
+        self.assertTrue(host.start(entry))
+        return host
+
+    def test_virtual_nodes_of_two_hosts_form_one_ring(self):
+        first = self.start_host(3)
+        second = self.start_host(3, first.nodes[0])
+        vnodes = first.nodes + second.nodes
+        self.assertEqual(len({vnode.id for vnode in vnodes}), 6)
+        self.wait_ring(vnodes)
+
+        values = {key: f"value-{key}" for key in range(0, 2**MBITS, 1999)}
+        for key, value in values.items():
+            self.set_key(first.nodes[1], key, value)
+        for key, value in values.items():
+            owner = next(vnode for vnode in vnodes if vnode._is_local_key(key))
+            self.assertEqual(owner.own_data.get_key(key), value, key)
+            response = second.nodes[2].send_request(Type.GET_DATA, key, second.nodes[2])
+            self.assertEqual(response['payload'], value, key)
+        # The virtual nodes of a host share its server and a single connection to the other host
+        self.assertTrue(all(vnode.server is first.server for vnode in first.nodes))
+        self.assertLessEqual(first.server.pool.connection_count(), 1)
+
+
+class RejoinTest(RingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = tempfile.mkdtemp()
+        self.intervals = ChordNode.MAINTENANCE_INTERVALS
+        # The successor does not notice the node has stopped, as when it restarts within a check_predecessor interval
+        ChordNode.MAINTENANCE_INTERVALS = dict(self.intervals, check_predecessor=(60, 60, 0))
+
+    def tearDown(self):
+        super().tearDown()
+        ChordNode.MAINTENANCE_INTERVALS = self.intervals
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_keys_survive_a_quick_restart(self):
+        first = self.start_node(1000)
+        successor = self.start_node(40000, first)
+        node = self.start_node(20000, first, data_dir=self.data_dir)
+        self.wait_ring([first, successor, node])
+
+        values = {key: f"value-{key}" for key in range(0, 2**MBITS, 97)}
+        for key, value in values.items():
+            self.set_key(first, key, value)
+        owned = {key: value for key, value in values.items() if node._is_local_key(key)}
+        self.assertTrue(owned)
+        self.wait_until(lambda: all(successor.replicated_data.get_key(key) == value for key, value in owned.items()),
+                        message="the keys were not replicated")
+
+        port = node.port
+        self.stop_node(node)
+        node = self.start_node(20000, first, port=port, data_dir=self.data_dir)
+        # The successor still has the node as predecessor, its keys are only in the replicated data
+        self.assertEqual(successor.predecessor.id, node.id)
+        self.assertEqual(successor.own_data.keys_in_range(first.id, node.id), [])
+
+        self.assertEqual(node.own_data.get_keys(list(owned)), owned)
+        self.assertEqual(len(node.own_data.keys_in_range(first.id, node.id)), len(owned))
+
+
+class AsyncRejoinTest(RejoinTest):
+
+    node_class = AsyncChordNode
+
+
+class AsyncDurableTest(RingTestCase):
+
+    node_class = AsyncChordNode
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.release.set()
+        super().tearDown()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_commit_does_not_block_the_event_loop(self):
+        node = self.start_node(1000, data_dir=self.data_dir)
+        self.wait_until(lambda: node.predecessor)
+        self.release = threading.Event()
+        write_records = node.own_data._write_records
+        node.own_data._write_records = lambda records: (self.release.wait(5), write_records(records))
+
+        pending = node.send_request_future(Type.SET_DATA, 10, node, {"key": 10, "value": "a"}, timeout=10)
+        self.wait_until(lambda: node.own_data.get_key(10) == "a")
+        # The node answers other requests while the write waits for its commit, and the SET waits for it
+        start = time.monotonic()
+        self.assertTrue(node.send_request(Type.CHECK_STATUS, node.id, node))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertFalse(pending.done())
+
+        self.release.set()
+        self.assertTrue(pending.result(10)['success'])
+
+
+if __name__ == '__main__':
+    unittest.main()
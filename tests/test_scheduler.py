@@ -0,0 +1,132 @@
+import asyncio, threading, unittest
+from concurrent.futures import Future
+from chord.scheduler import MaintenanceJob, MaintenanceScheduler
+
+
+class MaintenanceSchedulerTest(unittest.TestCase):
+    """
+    The jobs are launched by hand from _next, the timer thread is not started
+    """
+
+    def setUp(self):
+        self.scheduler = MaintenanceScheduler()
+        self.results = dict() # job name -> result returned by its function
+
+    def add_job(self, name, min_interval=1, max_interval=8, tightens=()):
+        self.results[name] = False
+        job = MaintenanceJob(name, lambda: self.results[name], min_interval, max_interval, backoff=2,
+                             tightens=tightens)
+        self.scheduler.add_job(job)
+        return job
+
+    def run_due(self):
+        """
+        :return: The names of the jobs run, in order
+        """
+        names = []
+        job, _ = self.scheduler._next()
+        while job:
+            names.append(job.name)
+            self.scheduler._launch(job)
+            job, _ = self.scheduler._next()
+        return names
+
+    def test_first_run_is_immediate(self):
+        self.add_job("stabilize")
+        self.add_job("fix_fingers")
+        self.assertEqual(self.run_due(), ["stabilize", "fix_fingers"])
+        job, delay = self.scheduler._next()
+        self.assertIsNone(job)
+        self.assertGreater(delay, 0.5)
+
+    def test_interval_backs_off_until_a_change(self):
+        job = self.add_job("stabilize")
+        intervals = []
+        for _ in range(5):
+            self.scheduler._launch(job)
+            intervals.append(job.interval)
+        self.assertEqual(intervals, [2, 4, 8, 8, 8])
+        self.results["stabilize"] = True
+        self.scheduler._launch(job)
+        self.assertEqual((job.interval, job.runs, job.changes), (1, 6, 1))
+
+    def test_tighten_runs_the_job_now(self):
+        job = self.add_job("fix_fingers")
+        self.run_due()
+        self.scheduler._launch(job)
+        self.assertEqual(self.run_due(), [])
+        self.scheduler.tighten("fix_fingers", "unknown")
+        self.assertEqual(job.interval, 1)
+        self.assertEqual(self.run_due(), ["fix_fingers"])
+
+    def test_change_tightens_the_related_jobs(self):
+        stabilize = self.add_job("stabilize", tightens=("fix_fingers",))
+        fix_fingers = self.add_job("fix_fingers")
+        self.run_due()
+        self.scheduler._launch(fix_fingers)
+        self.assertEqual(fix_fingers.interval, 4)
+        self.results["stabilize"] = True
+        self.scheduler._launch(stabilize)
+        self.assertEqual(fix_fingers.interval, 1)
+        self.assertEqual(self.run_due(), ["fix_fingers"])
+
+    def test_running_job_waits_for_its_future(self):
+        pending = Future()
+        job = MaintenanceJob("replication", lambda: pending, 1, 8)
+        self.scheduler.add_job(job)
+        self.assertEqual(self.run_due(), ["replication"])
+        self.assertTrue(job.running)
+        # Tightened while it runs, it runs again as soon as it ends
+        job.interval = 8
+        self.scheduler.tighten("replication")
+        self.assertEqual(self.run_due(), [])
+        pending.set_result(False)
+        self.assertFalse(job.running)
+        self.assertEqual(self.run_due(), ["replication"])
+
+    def test_failed_job_is_retried_soon(self):
+        def fail():
+            raise ConnectionError("node down")
+        job = MaintenanceJob("check_predecessor", fail, 1, 8)
+        job.interval = 8
+        observed = []
+        self.scheduler.observer = lambda name, duration, changed: observed.append((name, changed))
+        self.scheduler.add_job(job)
+        self.assertEqual(self.run_due(), ["check_predecessor"])
+        self.assertEqual(job.interval, 1)
+        self.assertEqual(observed, [("check_predecessor", True)])
+
+    def test_timer_thread_runs_the_jobs(self):
+        ran = threading.Event()
+        runs = []
+        def run():
+            runs.append(1)
+            if len(runs) == 3:
+                ran.set()
+            return True
+        self.scheduler.add_job(MaintenanceJob("stabilize", run, 0.01, 0.1))
+        self.scheduler.start()
+        try:
+            self.assertTrue(ran.wait(5))
+        finally:
+            self.scheduler.stop()
+        self.assertGreaterEqual(self.scheduler.stats()["stabilize"]["runs"], 3)
+
+    def test_event_loop_runs_the_coroutine_jobs(self):
+        async def run_jobs():
+            ran = asyncio.Event()
+            async def stabilize():
+                await asyncio.sleep(0)
+                ran.set()
+                return False
+            self.scheduler.add_job(MaintenanceJob("stabilize", stabilize, 0.01, 0.1))
+            task = asyncio.ensure_future(self.scheduler.run_async())
+            await asyncio.wait_for(ran.wait(), 5)
+            self.scheduler.stop()
+            await asyncio.wait_for(task, 5)
+        asyncio.run(run_jobs())
+        self.assertGreaterEqual(self.scheduler.stats()["stabilize"]["runs"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
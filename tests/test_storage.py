@@ -0,0 +1,131 @@
+import random, unittest
+from chord.storage import Storage
+from chord.sortedkeys import SortedKeys
+
+RING = 2**16
+
+
+def in_interval(key, start, end):
+    """
+    The ring interval (start, end], start == end is the whole ring
+    """
+    if start < end:
+        return start < key <= end
+    return key > start or key <= end
+
+
+def ring_order(keys, start):
+    return sorted(keys, key=lambda key: (key - start - 1) % RING)
+
+
+class SortedKeysTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(7)
+
+    def test_add_and_discard_keep_the_keys_sorted(self):
+        keys = SortedKeys(load=4)
+        reference = set()
+        for _ in range(2000):
+            key = self.random.randrange(200)
+            if self.random.random() < 0.6:
+                keys.add(key)
+                reference.add(key)
+            else:
+                keys.discard(key)
+                reference.discard(key)
+            self.assertEqual(len(keys), len(reference))
+        self.assertEqual(list(keys), sorted(reference))
+        self.assertTrue(all(block for block in keys.blocks))
+        self.assertEqual(keys.maxes, [block[-1] for block in keys.blocks])
+        self.assertTrue(all(len(block) <= 8 for block in keys.blocks))
+
+    def test_irange(self):
+        keys = SortedKeys(range(0, 100, 3), load=4)
+        self.assertEqual(keys.irange(10, 20), [12, 15, 18])
+        self.assertEqual(keys.irange(9, 21), [12, 15, 18, 21])
+        self.assertEqual(keys.irange(None, 7), [0, 3, 6])
+        self.assertEqual(keys.irange(90, None), [93, 96, 99])
+        self.assertEqual(keys.irange(None, None, limit=5), [0, 3, 6, 9, 12])
+        self.assertEqual(keys.irange(10, 80, limit=2), [12, 15])
+        self.assertEqual(keys.irange(99, None), [])
+        self.assertEqual(SortedKeys().irange(None, None), [])
+
+    def test_remove_range_and_remove_many(self):
+        reference = set(self.random.sample(range(1000), 300))
+        keys = SortedKeys(reference, load=4)
+        for _ in range(50):
+            low, high = sorted(self.random.sample(range(1000), 2))
+            expected = sorted(key for key in reference if low < key <= high)
+            self.assertEqual(keys.remove_range(low, high), expected)
+            reference -= set(expected)
+            batch = self.random.sample(range(1000), 10)
+            keys.remove_many(batch)
+            reference -= set(batch)
+            self.assertEqual(list(keys), sorted(reference))
+            self.assertEqual(len(keys), len(reference))
+        self.assertEqual(keys.maxes, [block[-1] for block in keys.blocks])
+
+
+class StorageRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(11)
+        self.storage = Storage()
+        self.storage.keys = SortedKeys(load=8) # Small blocks, so the ranges cross several of them
+        self.data = {key: f"value-{key}" for key in self.random.sample(range(RING), 500)}
+        self.storage.update_store_data(self.data)
+
+    def intervals(self):
+        keys = sorted(self.data)
+        yield 100, 60000
+        yield 60000, 100 # Wraps around the end of the ring
+        yield keys[10], keys[10] # The whole ring
+        yield keys[-1], keys[0] # Only the first and last keys
+        yield RING - 1, 0
+        yield keys[5], keys[6]
+        for _ in range(20):
+            yield self.random.randrange(RING), self.random.randrange(RING)
+
+    def test_keys_in_range(self):
+        for start, end in self.intervals():
+            expected = ring_order([key for key in self.data if in_interval(key, start, end)], start)
+            self.assertEqual(self.storage.keys_in_range(start, end), expected, (start, end))
+
+    def test_iter_range_resumes_after_a_key(self):
+        for start, end in self.intervals():
+            expected = ring_order([key for key in self.data if in_interval(key, start, end)], start)
+            received, after = [], None
+            while True:
+                chunk = self.storage.iter_range(start, end, after=after, limit=7)
+                received.extend(key for key, _ in chunk)
+                if len(chunk) < 7 or chunk[-1][0] == end:
+                    break
+                after = chunk[-1][0]
+            self.assertEqual(received, expected, (start, end))
+            self.assertEqual([key for key, _ in self.storage.scan_range(start, end, 7)], expected)
+
+    def test_pop_range_wraps_around(self):
+        start, end = 60000, 100
+        expected = {key: value for key, value in self.data.items() if in_interval(key, start, end)}
+        self.assertTrue(expected)
+        self.assertEqual(self.storage.pop_range(start, end), expected)
+        self.assertEqual(list(self.storage.keys), sorted(set(self.data) - set(expected)))
+        self.assertEqual(self.storage.keys_in_range(start, end), [])
+
+    def test_pop_range_whole_ring(self):
+        start = sorted(self.data)[42]
+        self.assertEqual(self.storage.pop_range(start, start), self.data)
+        self.assertEqual(len(self.storage.keys), 0)
+        self.assertEqual(self.storage.store, {})
+
+    def test_pop_keys(self):
+        keys = self.random.sample(sorted(self.data), 200) + [RING + 1]
+        removed = self.storage.pop_keys(keys)
+        self.assertEqual(removed, {key: self.data[key] for key in keys if key in self.data})
+        self.assertEqual(list(self.storage.keys), sorted(set(self.data) - set(removed)))
+        self.assertEqual(set(self.storage.store), set(self.data) - set(removed))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import socket, threading, time, unittest
+from concurrent.futures import Future
+from chord.chordnode import ChordNode
+from chord.node import Node
+from chord.type import Type
+from chord.tcpclientserver import TCPClientServer
+from utils.codec import CODECS_BY_NAME, BinaryCodec, JsonCodec
+from utils.compression import Bz2Compressor, ZlibCompressor
+
+HOST  = '127.0.0.1'
+MBITS = 16
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+class TransportTestCase(unittest.TestCase):
+    """
+    A client node and a server node on localhost, only their transport is started
+    """
+
+    def setUp(self):
+        self.server_node = ChordNode(100, HOST, free_port(), MBITS)
+        self.client_node = ChordNode(200, HOST, free_port(), MBITS)
+        for node in (self.server_node, self.client_node):
+            node.create()
+            # Only the transport is started, the nodes do not run their maintenance jobs
+            self.assertTrue(node.server.start_server().success)
+        self.server = self.server_node.server
+
+    def tearDown(self):
+        for node in (self.server_node, self.client_node):
+            node.server.stop_server()
+
+    def check_status(self):
+        return self.client_node.send_request(Type.CHECK_STATUS, self.server_node.id, self.server_node, timeout=2)
+
+    def accepted(self):
+        return [sock for sock in self.server.connections if sock is not self.server.server_sock]
+
+    def wait_until(self, predicate):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if predicate():
+                return
+            time.sleep(0.02)
+        self.fail("timed out")
+
+    def client_connection(self):
+        return self.client_node.server.pool.connections[(HOST, self.server.port)]
+
+
+class ListenerTest(TransportTestCase):
+
+    def test_survives_a_socket_closed_behind_select(self):
+        self.assertTrue(self.check_status())
+        self.wait_until(lambda: len(self.accepted()) == 1)
+        # A socket closed while it is still in the select list makes select fail
+        self.accepted()[0].close()
+        with socket.create_connection((HOST, self.server.port)):
+            self.wait_until(lambda: not any(sock.fileno() < 0 for sock in self.server.connections))
+        # The pooled connection of the client was closed with the socket
+        self.wait_until(self.check_status)
+
+    def test_malformed_frame_closes_only_its_connection(self):
+        self.assertTrue(self.check_status())
+        with socket.create_connection((HOST, self.server.port)) as sock:
+            # A frame with an unknown codec
+            sock.sendall(TCPClientServer.FRAME_HEADER.pack(0x7f, 3) + b"abc")
+            sock.settimeout(5)
+            try:
+                self.assertEqual(sock.recv(1), b"")
+            except ConnectionResetError:
+                pass
+        self.assertTrue(self.check_status())
+        self.wait_until(lambda: len(self.accepted()) == 1)
+
+    def test_failed_request_closes_its_connection(self):
+        self.assertTrue(self.check_status())
+        self.wait_until(lambda: len(self.accepted()) == 1)
+        self.server_node.process_message_future = lambda message, queue_wait: 1 / 0
+        self.assertFalse(self.check_status())
+        self.wait_until(lambda: not self.accepted())
+        del self.server_node.process_message_future
+        self.wait_until(self.check_status)
+
+
+class NegotiationTest(TransportTestCase):
+
+    def test_json_is_proposed(self):
+        self.assertTrue(self.check_status())
+        self.assertIs(self.client_connection().codec, CODECS_BY_NAME[JsonCodec.name])
+
+    def test_binary_is_accepted_from_a_peer_that_proposes_it(self):
+        self.client_node.server.PREFERRED_CODECS = (BinaryCodec.name, JsonCodec.name)
+        self.assertTrue(self.check_status())
+        self.assertIs(self.client_connection().codec, CODECS_BY_NAME[BinaryCodec.name])
+
+    def test_compression_of_the_large_frames(self):
+        self.server_node.predecessor = Node(self.server_node.id, HOST, self.server.port)
+        value = "value " * 2000
+        self.server_node.own_data.set_key_value(1, value)
+        response = self.client_node.send_request(Type.GET_DATA, 1, self.server_node, {"padding": value})
+        self.assertEqual(response['payload'], value)
+        self.assertEqual(self.client_connection().compressor.name, ZlibCompressor.name)
+        # The request and its response are compressed, the handshake is not
+        self.assertEqual(self.client_node.server.frames_compressed, 1)
+        self.assertEqual(self.server.frames_compressed, 1)
+        self.assertTrue(self.check_status())
+        self.assertEqual(self.server.frames_compressed, 1)
+
+    def test_compression_is_accepted_only_if_enabled(self):
+        self.server.compression = None
+        self.assertTrue(self.check_status())
+        self.assertIsNone(self.client_connection().compressor)
+        self.assertIsNone(self.server.compressors.get(self.accepted()[0]))
+
+    def test_first_compression_proposed_is_chosen(self):
+        self.client_node.server.compression = Bz2Compressor.name
+        self.assertTrue(self.client_node.send_request(Type.CHECK_STATUS, 1, self.server_node, {"padding": "a" * 8192}))
+        self.assertEqual(self.client_connection().compressor.name, Bz2Compressor.name)
+        self.assertEqual(self.server.compressors[self.accepted()[0]].name, Bz2Compressor.name)
+
+    def test_decompression_is_bounded(self):
+        compressor = ZlibCompressor()
+        with self.assertRaises(ValueError):
+            compressor.decompress(compressor.compress(bytes(10000)), 100)
+
+
+class MultiplexingTest(TransportTestCase):
+
+    def test_responses_are_matched_out_of_order(self):
+        self.server_node.predecessor = Node(self.server_node.id, HOST, self.server.port)
+        self.server_node.own_data.update_store_data({1: "slow", 2: "fast"})
+        release = threading.Event()
+        handle = self.server_node.process_message_future
+
+        def delayed(message, queue_wait):
+            # The response of the key 1 is held back until the response of the key 2 has arrived
+            handled = handle(message, queue_wait)
+            if message.key != 1:
+                return handled
+            response = Future()
+            handled.add_done_callback(lambda done: threading.Thread(
+                target=lambda: (release.wait(5), response.set_result(done.result()))).start())
+            return response
+        self.server_node.process_message_future = delayed
+
+        slow = self.client_node.send_request_future(Type.GET_DATA, 1, self.server_node)
+        fast = self.client_node.send_request_future(Type.GET_DATA, 2, self.server_node)
+        self.assertEqual(fast.result(5)['payload'], "fast")
+        self.assertFalse(slow.done())
+        release.set()
+        self.assertEqual(slow.result(5)['payload'], "slow")
+        self.assertEqual(self.client_node.server.pool.connection_count(), 1)
+        self.assertEqual(len(self.accepted()), 1)
+
+    def test_concurrent_requests_share_one_connection(self):
+        requests = [self.client_node.send_request_future(Type.CHECK_STATUS, key, self.server_node)
+                    for key in range(50)]
+        self.assertTrue(all(request.result(5) for request in requests))
+        self.assertEqual(self.client_node.server.pool.connection_count(), 1)
+        self.assertEqual(len(self.accepted()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import time, unittest
+from chord.tracing import Tracer
+
+
+class TracerTest(unittest.TestCase):
+
+    def test_new_traces_are_sampled_at_the_rate(self):
+        self.assertEqual(Tracer(sample_rate=0).propagate(), Tracer.UNSAMPLED)
+        tracer = Tracer(sample_rate=1)
+        trace = tracer.propagate()
+        self.assertTrue(Tracer.sampled(trace))
+        self.assertNotEqual(trace[0], tracer.propagate()[0])
+        self.assertEqual(tracer.stats()["sampled_traces"], 2)
+
+    def test_requests_sent_while_handling_carry_its_trace(self):
+        tracer = Tracer(sample_rate=1)
+        token = tracer.enter((42, True))
+        try:
+            self.assertEqual(tracer.propagate(), (42, True))
+        finally:
+            tracer.leave(token)
+        # An unsampled request is not sampled by the nodes it reaches
+        token = tracer.enter(Tracer.UNSAMPLED)
+        self.assertFalse(Tracer.sampled(tracer.propagate()))
+        tracer.leave(token)
+        self.assertTrue(Tracer.sampled(tracer.propagate()))
+
+    def test_buffer_keeps_the_last_spans(self):
+        tracer = Tracer(capacity=3)
+        for trace_id in (1, 2, 1, 2):
+            tracer.record((trace_id, True), "send", "get_data", 100, 200, time.perf_counter(), True)
+        self.assertEqual([span["trace_id"] for span in tracer.dump()], [2, 1, 2])
+        self.assertEqual(len(tracer.dump(1)), 1)
+        self.assertEqual(tracer.stats(), {"sampled_traces": 0, "spans_recorded": 4, "spans_buffered": 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
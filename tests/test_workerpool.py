@@ -0,0 +1,63 @@
+import threading, unittest
+from chord.workerpool import WorkerPool
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.stop()
+
+    def start_pool(self, pool):
+        self.pools.append(pool)
+        pool.start()
+        return pool
+
+    def test_lower_priority_runs_first(self):
+        pool = WorkerPool(workers=1, name="test")
+        order = []
+        done = threading.Event()
+        # Queued before the worker starts, so they are ordered by the queue
+        for priority, name in [(2, "maintenance"), (1, "get"), (0, "continuation"), (1, "set")]:
+            pool.submit(priority, order.append, name)
+        pool.submit(3, done.set)
+        self.start_pool(pool)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(order, ["continuation", "get", "set", "maintenance"])
+
+    def test_full_queue_rejects_the_task(self):
+        pool = WorkerPool(workers=1, max_queue=2, name="test")
+        self.assertTrue(pool.submit(1, int))
+        self.assertTrue(pool.submit(1, int))
+        self.assertFalse(pool.submit(0, int))
+        self.assertEqual((pool.stats()["submitted"], pool.stats()["rejected"]), (2, 1))
+
+    def test_failed_task_does_not_stop_its_worker(self):
+        pool = self.start_pool(WorkerPool(workers=1, name="test"))
+        done = threading.Event()
+        pool.submit(1, lambda: 1 / 0)
+        pool.submit(1, done.set)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(pool.stats()["completed"], 2)
+
+    def test_stop_discards_the_queued_tasks(self):
+        pool = self.start_pool(WorkerPool(workers=1, name="test"))
+        running, release = threading.Event(), threading.Event()
+        ran = []
+        pool.submit(1, lambda: (running.set(), release.wait(5)))
+        self.assertTrue(running.wait(5))
+        pool.submit(1, ran.append, "queued")
+        threads = list(pool.threads)
+        pool.stop()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(ran, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
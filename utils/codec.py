@@ -0,0 +1,146 @@
+import json, struct
+
+
+class JsonCodec:
+    """
+    Encodes the messages as json, the format used by every node before the codecs were negotiated
+    Dict keys are always sent as strings
+    """
+
+    id = 1
+    name = 'json'
+
+    def encode(self, obj):
+        return json.dumps(obj).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(bytes(data).decode('utf-8'))
+
+
+class BinaryCodec:
+    """
+    Compact tagged binary encoding of the message dicts
+    Integers that fit in 160 bits (the ids and keys of the ring) are sent as fixed 20 bytes fields
+    and dict keys keep their type, so a store of integer keys does not need to be parsed again
+    """
+
+    id = 2
+    name = 'binary'
+
+    ID_BYTES = 20
+
+    NONE, TRUE, FALSE, INT, ID, BIGINT, FLOAT, STR, BYTES, LIST, DICT = b'NTFiIBdsblm'
+
+    INT64 = struct.Struct('!q')
+    UINT32 = struct.Struct('!I')
+    DOUBLE = struct.Struct('!d')
+
+    def encode(self, obj):
+        out = bytearray()
+        self._encode(obj, out)
+        return bytes(out)
+
+    def _encode(self, obj, out):
+        # Exact type checks first, they cover almost every value of a message
+        kind = type(obj)
+        if kind is str:
+            data = obj.encode('utf-8')
+            out += b's' + self.UINT32.pack(len(data)) + data
+        elif kind is int:
+            self._encode_int(obj, out)
+        elif kind is list or kind is tuple:
+            out += b'l' + self.UINT32.pack(len(obj))
+            encode = self._encode
+            for item in obj:
+                encode(item, out)
+        elif kind is dict:
+            out += b'm' + self.UINT32.pack(len(obj))
+            encode = self._encode
+            for key, value in obj.items():
+                encode(key, out)
+                encode(value, out)
+        elif obj is None:
+            out.append(self.NONE)
+        elif obj is True:
+            out.append(self.TRUE)
+        elif obj is False:
+            out.append(self.FALSE)
+        elif isinstance(obj, float):
+            out += b'd' + self.DOUBLE.pack(obj)
+        elif isinstance(obj, str):
+            # str subclasses like the Type enum
+            self._encode(str.__str__(obj), out)
+        elif isinstance(obj, int):
+            self._encode_int(int(obj), out)
+        elif isinstance(obj, (bytes, bytearray)):
+            out += b'b' + self.UINT32.pack(len(obj)) + obj
+        elif isinstance(obj, (list, tuple)):
+            self._encode(list(obj), out)
+        elif isinstance(obj, dict):
+            self._encode(dict(obj), out)
+        else:
+            raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+    def _encode_int(self, obj, out):
+        if -0x8000000000000000 <= obj < 0x8000000000000000:
+            out += b'i' + self.INT64.pack(obj)
+        elif 0 <= obj < 1 << (8 * self.ID_BYTES):
+            out += b'I' + obj.to_bytes(self.ID_BYTES, 'big')
+        else:
+            size = (obj.bit_length() + 8) // 8
+            out += b'B' + self.UINT32.pack(size) + obj.to_bytes(size, 'big', signed=True)
+
+    def decode(self, data):
+        data = bytes(data)
+        obj, offset = self._decode(data, 0)
+        if offset != len(data):
+            raise ValueError(f"Trailing data after offset {offset}")
+        return obj
+
+    def _decode(self, data, offset):
+        tag = data[offset]
+        offset += 1
+        if tag == self.ID:
+            end = offset + self.ID_BYTES
+            return int.from_bytes(data[offset:end], 'big'), end
+        if tag == self.INT:
+            return self.INT64.unpack_from(data, offset)[0], offset + 8
+        if tag == self.NONE:
+            return None, offset
+        if tag == self.TRUE:
+            return True, offset
+        if tag == self.FALSE:
+            return False, offset
+        if tag == self.FLOAT:
+            return self.DOUBLE.unpack_from(data, offset)[0], offset + 8
+
+        (size,) = self.UINT32.unpack_from(data, offset)
+        offset += 4
+        end = offset + size
+        if tag == self.STR:
+            return data[offset:end].decode('utf-8'), end
+        if tag == self.LIST:
+            items = []
+            append = items.append
+            decode = self._decode
+            for _ in range(size):
+                item, offset = decode(data, offset)
+                append(item)
+            return items, offset
+        if tag == self.DICT:
+            obj = {}
+            decode = self._decode
+            for _ in range(size):
+                key, offset = decode(data, offset)
+                obj[key], offset = decode(data, offset)
+            return obj, offset
+        if tag == self.BIGINT:
+            return int.from_bytes(data[offset:end], 'big', signed=True), end
+        if tag == self.BYTES:
+            return data[offset:end], end
+        raise ValueError(f"Unknown tag {tag} at offset {offset - 5}")
+
+
+CODECS = {codec.id: codec for codec in (JsonCodec(), BinaryCodec())}
+CODECS_BY_NAME = {codec.name: codec for codec in CODECS.values()}
+DEFAULT_CODEC = CODECS[JsonCodec.id]
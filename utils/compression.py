@@ -0,0 +1,80 @@
+import zlib, bz2, lzma
+
+
+class Compressor:
+    """
+    Compresses the bodies of the frames of a connection, the algorithm is negotiated in the handshake
+    The level is only used to compress, any level is decompressed
+    """
+
+    name = None
+    LEVEL = None
+
+    def __init__(self, level=None):
+        super().__init__()
+        self.level = self.LEVEL if level is None else level
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def _decompressor(self):
+        raise NotImplementedError
+
+    def decompress(self, data, max_size):
+        """
+        :param max_size: The maximum size of the decompressed data, so a small frame can not take the memory of the node
+        :return: The decompressed bytes
+        """
+        decompressor = self._decompressor()
+        out = decompressor.decompress(data, max_size)
+        if not decompressor.eof:
+            raise ValueError(f"Compressed body is truncated or exceeds {max_size} bytes")
+        return out
+
+
+class ZlibCompressor(Compressor):
+    """
+    Fast, the level 1 compresses json documents several times for a small cost
+    """
+
+    name = 'zlib'
+    LEVEL = 1
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def _decompressor(self):
+        return zlib.decompressobj()
+
+
+class Bz2Compressor(Compressor):
+
+    name = 'bz2'
+    LEVEL = 9
+
+    def compress(self, data):
+        return bz2.compress(data, self.level)
+
+    def _decompressor(self):
+        return bz2.BZ2Decompressor()
+
+
+class LzmaCompressor(Compressor):
+    """
+    The best ratio and the slowest, for links where the bandwidth costs more than the cpu
+    """
+
+    name = 'lzma'
+    LEVEL = 1
+
+    def compress(self, data):
+        return lzma.compress(data, preset=self.level)
+
+    def _decompressor(self):
+        return lzma.LZMADecompressor()
+
+
+COMPRESSORS = {compressor.name: compressor for compressor in (ZlibCompressor, Bz2Compressor, LzmaCompressor)}
+
+# Set in the codec id of the frame header when the body is compressed
+COMPRESSED = 0x80
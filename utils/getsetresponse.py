@@ -7,4 +7,6 @@ class GetSetResponse(Response):
         self.key = key
         self.node_reached = None
         self.nodes_visited = []
+        self.version = None   # The version of the owner data that answered, or that stored the SET
+        self.replica = False  # True if a replica answered instead of the owner
 
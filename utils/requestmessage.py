@@ -3,8 +3,10 @@ from utils.message import Message
 
 class RequestMessage(Message):
 
-    def __init__(self, type=None, key=None, origen=None, destination=None, payload=None):
+    def __init__(self, type=None, key=None, origen=None, destination=None, payload=None, request_id=None, trace=None):
         super().__init__(origen, destination, payload)
         self.type = type
         self.key = key
+        self.request_id = request_id # Set by the transport, identifies the response of the request
+        self.trace = trace # [trace id, sampled] of the request that originated this one
         
\ No newline at end of file
@@ -2,8 +2,9 @@ from utils.update import updateAttr
 from utils.message import Message
 
 class Response(Message):
-    def __init__(self, origen=None, destination=None, payload=None):
+    def __init__(self, origen=None, destination=None, payload=None, request_id=None):
         super().__init__(origen, destination, payload)
         self.success = False
         self.error   = ''
+        self.request_id = request_id # The request_id of the RequestMessage answered
        
\ No newline at end of file